@@ -1,60 +1,84 @@
-from langchain_gigachat import GigaChat, GigaChatEmbeddings
-from langchain_chroma import Chroma
-from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse
-from typing import Optional, Literal
-from routes import chat, classify, health, get_manifests
-
-
-from pydantic import BaseModel, ValidationError # For validating user's POST request body
-from core.placeholder_engine import extract_placeholders, PLACEHOLDER_TYPES, is_placeholder_valid, fill_placeholders, format_placeholder_list
-from core.session_manager import SessionStore
-
-import logging, os, uuid, json
-
-from core.config import llm, vector_store
-from core.llm_utils import (
-    llm_classify_intent,
-    llm_assess_specificity,
-    llm_detect_meta_intent,
-    llm_rephrase_history
-)
-
-from core.placeholder_engine import handle_placeholder_reply
-from models import ChatResponse, ChatRequest, QueryRequest, \
-    ClassifyRequest, ClassifyResponse
-
-# General logging settings
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from routes import admin, chat, classify, health, get_manifests, metrics, render
+
+from core.session_manager import create_session_store, run_session_reaper
+from core.bulk_render import shutdown_pool as shutdown_render_pool
+from core.config import warm_up, get_llm, get_vector_store, get_retriever
+from core.safe_llm import run_blocking
+from core.logging_config import setup_logging
+
+# JSON logs written by a background thread, see core/logging_config.py for LOG_* settings
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
-# In-memory session store
-session_store = SessionStore()
-# sessions = {}
+# Wait for LLM clients and the vector index before accepting requests.
+# By default the worker starts at once and /ready reports 503 until warm-up is done
+WARM_UP_BLOCKING = os.getenv("WARM_UP_BLOCKING", "false").lower() in ("1", "true", "yes")
+
+# Session store selected by SESSION_BACKEND, use "redis" to run several workers
+session_store = create_session_store()
+
+# Delay between failed warm-up attempts doubles up to this many seconds
+WARM_UP_RETRY_MAX_DELAY = float(os.getenv("WARM_UP_RETRY_MAX_DELAY", "60"))
+
+ROUTE_MODULES = [admin, chat, classify, get_manifests, metrics, render]
 
-for module in [chat, classify, get_manifests]:
-    module.session_store = session_store
-    module.llm = llm
-    if hasattr(module, "vector_store"):
-        module.vector_store = vector_store
+def inject_session_store() -> None:
+    """The store needs no warm-up, routes get it before the first request"""
+    for module in ROUTE_MODULES:
+        module.session_store = session_store
 
+def inject_dependencies() -> None:
+    """Hand the shared clients to the route modules"""
+    for module in ROUTE_MODULES:
+        if hasattr(module, "llm"):
+            module.llm = get_llm()
+        if hasattr(module, "vector_store"):
+            module.vector_store = get_vector_store()
+        if hasattr(module, "retriever"):
+            module.retriever = get_retriever()
 
-app = FastAPI()
+async def _warm_up() -> None:
+    """Retry with backoff until warm-up succeeds, /ready and the routes answer 503 meanwhile"""
+    delay = 1.0
+    while True:
+        try:
+            # Injected before the worker is reported ready, so no request sees a route without its clients
+            await run_blocking(warm_up, inject_dependencies)
+            return
+        except Exception:
+            logger.exception("[APP] Не удалось инициализировать клиенты LLM и векторную базу, повтор через %.0f с", delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WARM_UP_RETRY_MAX_DELAY)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    inject_session_store()
+    reaper_task = asyncio.create_task(run_session_reaper(session_store))
+    warm_up_task = asyncio.create_task(_warm_up())
+    if WARM_UP_BLOCKING:
+        await warm_up_task
+    yield
+    warm_up_task.cancel()
+    reaper_task.cancel()
+    session_store.close()
+    shutdown_render_pool()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 app.include_router(chat.router)
 app.include_router(classify.router)
 app.include_router(health.router)
 app.include_router(get_manifests.router)
-# If parameter is a Pydantic model, FastAPI reads it from request body
-
-get_manifests.llm = llm
-get_manifests.vector_store = vector_store
-get_manifests.session_store = session_store
-app.include_router(get_manifests.router)
+app.include_router(render.router)
+app.include_router(admin.router)
+app.include_router(metrics.router)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000)
+    uvicorn.run(app, host="0.0.0.0", port=5000, log_config=None) # keep uvicorn on our handlers
@@ -0,0 +1,228 @@
+"""
+Render manifests for a JSONL file of requests, without the HTTP chat path and without LLM calls.
+
+Each input line is a JSON object:
+    {"id": "billing-db", "template_id": "istio_postgres_se", "values": {"serverPort": "5432", ...}}
+    {"id": "orders-kafka", "query": "кафка tcp без ip", "values": {...}}
+"template_id" is used as is, "query" is resolved with the hybrid retriever (keyword router, then vector search).
+"id" is optional and names the output file, the line number is used otherwise;
+a repeated id gets the line number appended. Numbers in "values" are taken as strings.
+
+The input is read in windows of --window lines: queries of a window are retrieved in one batch,
+value sets are rendered on a process pool, results are written before the next window is read,
+so memory is bounded by the window size, not by the file.
+
+Outputs in --out-dir:
+    <id>.yaml        rendered manifests of every valid request
+    results.jsonl    one line per input line: status, template and the file or the errors
+    summary.json     counters, rewritten after every window
+
+Run from the repository root:
+    python batch_render.py nightly.jsonl --out-dir ./rendered
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from itertools import islice
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+from core.template_registry import template_registry, Template
+from core.bulk_render import render_source
+from core.logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Resolved queries remembered across windows
+QUERY_CACHE_SIZE = int(os.getenv("BATCH_QUERY_CACHE_SIZE", "10000"))
+
+def _coerce_values(values: dict) -> dict:
+    """JSON numbers as strings, like a user would type them; other non-strings are left to validate_values"""
+    return {
+        name: str(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+        for name, value in values.items()
+    }
+
+def _read_records(path: str) -> Iterator[tuple[int, Optional[dict], Optional[str]]]:
+    """(line number, record, parse error) of every non-empty line"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, None, f"некорректный JSON: {e}"
+                continue
+            error = _record_error(record)
+            if error:
+                yield line_number, None, error
+            else:
+                record["values"] = _coerce_values(record.get("values", {}))
+                yield line_number, record, None
+
+def _record_error(record) -> Optional[str]:
+    """Why the parsed line can't be rendered, None if it can"""
+    if not isinstance(record, dict):
+        return "строка должна быть объектом"
+    for field in ("template_id", "query"):
+        if field in record and record[field] is not None and (not isinstance(record[field], str) or not record[field].strip()):
+            return f"{field} должен быть непустой строкой"
+    if not (record.get("template_id") or record.get("query")):
+        return "нужно поле template_id или query"
+    if not isinstance(record.get("values", {}), dict):
+        return "values должен быть объектом"
+    return None
+
+class _Resolver:
+    """Template per record; queries are retrieved in batches, the last QUERY_CACHE_SIZE of them are remembered"""
+
+    def __init__(self, cache_size: int = QUERY_CACHE_SIZE):
+        self._retriever = None
+        self._cache_size = cache_size
+        self._by_query: OrderedDict[str, tuple[Optional[Template], Optional[str]]] = OrderedDict()
+
+    def resolve(self, records: list[dict]) -> list[tuple[Optional[Template], Optional[str]]]:
+        """(template, error) per record"""
+        queries = list(dict.fromkeys(
+            record["query"] for record in records
+            if not record.get("template_id") and record["query"] not in self._by_query
+        ))
+        # Kept apart from the LRU, a window larger than the cache would evict its own queries
+        retrieved = self._retrieve(queries) if queries else {}
+
+        resolved = []
+        for record in records:
+            if record.get("template_id"):
+                template = template_registry.get(record["template_id"])
+                resolved.append((template, None if template else f"шаблон {record['template_id']} не найден"))
+                continue
+            query = record["query"]
+            if query in retrieved:
+                resolved.append(retrieved[query])
+            elif query in self._by_query:
+                self._by_query.move_to_end(query)
+                resolved.append(self._by_query[query])
+            else:
+                # The search failed, the query is retried in the next window
+                resolved.append((None, "ошибка поиска манифеста"))
+        return resolved
+
+    def _remember(self, query: str, resolution: tuple[Optional[Template], Optional[str]]) -> None:
+        self._by_query[query] = resolution
+        self._by_query.move_to_end(query)
+        while len(self._by_query) > self._cache_size:
+            self._by_query.popitem(last=False)
+
+    def _retrieve(self, queries: list[str]) -> dict[str, tuple[Optional[Template], Optional[str]]]:
+        from core.manifest_engine import pick_manifest
+
+        if self._retriever is None:
+            from core.config import get_retriever
+            self._retriever = get_retriever()
+
+        try:
+            results = self._retriever.retrieve_many(queries)
+        except Exception as e:
+            logger.error("[BATCH] Ошибка при поиске по векторной базе: %s", e)
+            return {}
+
+        retrieved = {}
+        for query, result in zip(queries, results):
+            if result.ambiguous:
+                sources = ", ".join(c.source for c in result.candidates[:2])
+                retrieved[query] = (None, f"запрос подходит к нескольким манифестам: {sources}")
+            else:
+                template = pick_manifest(result)
+                retrieved[query] = (template, None if template else "подходящий манифест не найден")
+            self._remember(query, retrieved[query])
+        return retrieved
+
+def _output_name(record: dict, line_number: int, template: Template, used: set[str]) -> str:
+    """File name for the record, unique within the run: a repeated id gets the line number appended"""
+    name = re.sub(r"[^\w.-]+", "_", str(record.get("id") or f"{line_number:06d}-{template.id}"))
+    if name in used:
+        name = f"{name}-{line_number:06d}"
+    used.add(name)
+    return name + ".yaml"
+
+def _render_task(task: tuple) -> dict:
+    return render_source(*task)
+
+def run(path: str, out_dir: str, workers: int, window: int, strict: bool) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    template_registry.load()
+    resolver = _Resolver()
+    used_names: set[str] = set() # Output names only, the records themselves are not kept across windows
+    summary = {"total": 0, "rendered": 0, "failed": 0, "seconds": 0.0}
+    started = time.monotonic()
+
+    records = _read_records(path)
+    with multiprocessing.get_context("spawn").Pool(workers) as pool, \
+            open(os.path.join(out_dir, "results.jsonl"), "w", encoding="utf-8") as results_file:
+        while True:
+            batch = list(islice(records, window))
+            if not batch:
+                break
+
+            valid = [(line_number, record) for line_number, record, _ in batch if record is not None]
+            resolved = dict(zip((line_number for line_number, _ in valid), resolver.resolve([record for _, record in valid])))
+
+            tasks, outcomes, names = [], {}, {}
+            for line_number, record, error in batch:
+                template, error = resolved.get(line_number, (None, error))
+                if template is None:
+                    outcomes[line_number] = {"line": line_number, "id": record and record.get("id"), "status": "error", "errors": {"": error}}
+                    continue
+                outcomes[line_number] = {"line": line_number, "id": record.get("id"), "template_id": template.id}
+                names[line_number] = _output_name(record, line_number, template, used_names)
+                tasks.append((template.source, template.text, line_number, record.get("values", {}), record.get("strict", strict)))
+
+            # Results come back in task order while the pool keeps rendering the rest of the window
+            for result in pool.imap(_render_task, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+                outcome = outcomes[result["index"]]
+                if "errors" in result:
+                    outcome.update(status="error", errors=result["errors"])
+                    continue
+                filename = names[result["index"]]
+                with open(os.path.join(out_dir, filename), "w", encoding="utf-8") as f:
+                    f.write(result["manifest"])
+                outcome.update(status="ok", file=filename)
+
+            for line_number, _, _ in batch:
+                outcome = outcomes[line_number]
+                results_file.write(json.dumps(outcome, ensure_ascii=False) + "\n")
+                summary["total"] += 1
+                summary["rendered" if outcome["status"] == "ok" else "failed"] += 1
+            results_file.flush()
+
+            summary["seconds"] = round(time.monotonic() - started, 3)
+            with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            logger.info("[BATCH] Обработано %d, ошибок %d", summary["total"], summary["failed"])
+
+    return summary
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="JSONL file of requests")
+    parser.add_argument("--out-dir", default="./rendered")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--window", type=int, default=1000, help="Input lines held in memory at once")
+    parser.add_argument("--no-strict", action="store_true", help="Render requests with missing values, keeping their placeholders")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    summary = run(args.input, args.out_dir, args.workers, args.window, strict=not args.no_strict)
+    print(json.dumps(summary, ensure_ascii=False))
+    if summary["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
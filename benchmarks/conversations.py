@@ -0,0 +1,325 @@
+"""
+Cost of full scripted conversations with fake LLM and embeddings, no network.
+
+Conversations go through routes/chat.chat (async path) and, in the "engine" suite, through the sync
+start_manifest_flow_from_query + handle_placeholder_reply. Each one opens a manifest flow, sometimes after a
+clarifying turn, fills every placeholder (with an occasional "сколько осталось") and ends with the rendered manifest.
+Micro-benchmarks cover fill_placeholders and the session store.
+
+Reported: per-stage timings (turns, LLM calls by kind, embeddings, retrieval, render, store operations),
+LLM calls per completed manifest, throughput at each --concurrency, peak memory.
+Results are saved to benchmarks/results/<commit>.json; --compare prints the change against an earlier file.
+
+Run from the repository root:
+    python -m benchmarks.conversations --sessions 200 --concurrency 1 10 50
+    python -m benchmarks.conversations --compare benchmarks/results/<commit>.json
+"""
+import os
+import gc
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import Timings, Latency, FakeLLM, FakeEmbeddings, FakeVectorStore, template_documents
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Keywords of templates the benchmark corpus is built from, as in data/documents.py
+TEMPLATE_KEYWORDS = {
+    "istio_postgres_se": "istio, service mesh, postgresql, база данных, с service entry"
+}
+OPENING_SPECIFIC = "Нужны манифесты для интеграции istio с postgres через service entry"
+OPENING_VAGUE = "Хочу настроить istio"
+CLARIFICATION = "с базой postgres"
+MAX_TURNS = 40
+
+def _value(template, name: str) -> str:
+    return "5432" if template.types.get(name) == "int" else f"{name.lower()}-value"
+
+def _timed(timings: Timings, stage: str, func):
+    if asyncio.iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                timings.add(stage, time.perf_counter() - started)
+    else:
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.add(stage, time.perf_counter() - started)
+    return wrapper
+
+def _instrument(timings: Timings, store, retriever) -> None:
+    """Time the store, the retriever and rendering where the code under test calls them"""
+    from core.template_registry import Template
+
+    for name in ("create", "get", "update", "end"):
+        setattr(store, name, _timed(timings, f"store.{name}", getattr(store, name)))
+    retriever.retrieve = _timed(timings, "retrieve", retriever.retrieve)
+    if not hasattr(Template, "_untimed_render"):
+        Template._untimed_render = Template.render
+    Template.render = _timed(timings, "render", Template._untimed_render)
+
+def _create_store(kind: str, directory: str):
+    from core.session_manager import InMemorySessionStore
+    if kind == "sqlite":
+        from core.session_persistence import SQLiteSessionStore
+        return SQLiteSessionStore(path=os.path.join(directory, f"sessions-{time.monotonic_ns()}.db"))
+    return InMemorySessionStore()
+
+class Conversation:
+    """Picks the next user message from the state of the session, so failed LLM calls don't derail the script"""
+
+    def __init__(self, index: int, store, template):
+        self.vague = index % 3 == 0 # Every third user starts too vague and needs a clarifying turn
+        self.ask_progress_at = 3 if index % 5 == 0 else None
+        self.store = store
+        self.template = template
+        self.session_id = None
+        self.turns = 0
+        self.completed = False
+
+    def next_message(self) -> tuple[str, str]:
+        """(turn kind, message)"""
+        state = self.store.get(self.session_id) if self.session_id else None
+        if state is None:
+            return ("fresh", OPENING_VAGUE if self.vague else OPENING_SPECIFIC)
+        if state.mode == "ASK_SCENARIO":
+            return ("ask_scenario", CLARIFICATION)
+        if self.ask_progress_at is not None and len(state.values) == self.ask_progress_at:
+            self.ask_progress_at = None
+            return ("manifest", "сколько осталось")
+        return ("manifest", _value(self.template, state.current_placeholder))
+
+    def accept(self, session_id, reply: str) -> None:
+        self.turns += 1
+        self.session_id = session_id
+        self.completed = reply.startswith("Все значения заполнены")
+
+async def _chat_conversation(conversation: Conversation, timings: Timings) -> None:
+    from routes import chat
+    from models import ChatRequest
+
+    while not conversation.completed and conversation.turns < MAX_TURNS:
+        kind, message = conversation.next_message()
+        started = time.perf_counter()
+        response = await chat.chat(ChatRequest(message=message, session_id=conversation.session_id))
+        timings.add(f"turn.{kind}", time.perf_counter() - started)
+        conversation.accept(response.session_id, response.reply)
+
+def _engine_conversation(conversation: Conversation, timings: Timings, retriever, llm, store) -> None:
+    from core.manifest_engine import start_manifest_flow_from_query
+    from core.placeholder_engine import handle_placeholder_reply
+
+    while not conversation.completed and conversation.turns < MAX_TURNS:
+        kind, message = conversation.next_message()
+        started = time.perf_counter()
+        if kind == "manifest":
+            reply, done = handle_placeholder_reply(llm, conversation.session_id, store, message)
+            session_id = None if done else conversation.session_id
+        else:
+            # The engine suite skips intent classification, the query is taken as already rephrased
+            response = start_manifest_flow_from_query(OPENING_SPECIFIC, retriever, llm, store)
+            reply, session_id = response.reply, response.session_id
+        timings.add(f"turn.{kind}", time.perf_counter() - started)
+        conversation.accept(session_id, reply)
+
+async def _run_suite(suite: str, args, concurrency: int, template, directory: str) -> dict:
+    from routes import chat
+    from core.retriever import HybridRetriever
+
+    timings = Timings()
+    rng = random.Random(args.seed)
+    llm = FakeLLM(Latency(args.llm_latency, args.llm_jitter, args.llm_failure_rate, rng), timings)
+    embeddings = FakeEmbeddings(Latency(args.embed_latency, args.embed_jitter, args.embed_failure_rate, rng), timings)
+    documents = template_documents([template], TEMPLATE_KEYWORDS)
+    vector_store = FakeVectorStore(documents, embeddings)
+    retriever = HybridRetriever(vector_store, documents)
+    store = _create_store(args.store, directory)
+    _instrument(timings, store, retriever)
+    chat.llm, chat.vector_store, chat.retriever, chat.session_store = llm, vector_store, retriever, store
+
+    conversations = [Conversation(i, store, template) for i in range(args.sessions)]
+    started = time.perf_counter()
+    if suite == "chat":
+        slots = asyncio.Semaphore(concurrency)
+
+        async def run(conversation):
+            async with slots:
+                await _chat_conversation(conversation, timings)
+        await asyncio.gather(*(run(conversation) for conversation in conversations))
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            await asyncio.get_running_loop().run_in_executor(None, lambda: list(pool.map(
+                lambda conversation: _engine_conversation(conversation, timings, retriever, llm, store), conversations
+            )))
+    elapsed = time.perf_counter() - started
+    store.close()
+
+    completed = sum(conversation.completed for conversation in conversations)
+    turns = sum(conversation.turns for conversation in conversations)
+    llm_calls = timings.count("llm.")
+    return {
+        "suite": suite,
+        "concurrency": concurrency,
+        "sessions": args.sessions,
+        "completed": completed,
+        "turns": turns,
+        "seconds": round(elapsed, 3),
+        "manifests_per_second": round(completed / elapsed, 2),
+        "turns_per_second": round(turns / elapsed, 2),
+        "llm_calls": llm_calls,
+        "llm_calls_per_manifest": round(llm_calls / completed, 2) if completed else None,
+        "embedding_calls": timings.count("embed"),
+        "stages": timings.summary()
+    }
+
+def _bench_fill_placeholders(template, iterations: int) -> dict:
+    from core.placeholder_engine import fill_placeholders
+
+    values = {name: _value(template, name) for name in template.placeholders}
+    fill_placeholders(template.text, values)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fill_placeholders(template.text, values)
+    elapsed = time.perf_counter() - started
+    return {"iterations": iterations, "us_per_call": round(1e6 * elapsed / iterations, 2)}
+
+def _bench_store(kind: str, template, operations: int, directory: str) -> dict:
+    from core.session_manager import SessionState
+
+    store = _create_store(kind, directory)
+    timings = Timings()
+    for i in range(operations):
+        started = time.perf_counter()
+        session_id = store.create(SessionState(mode="MANIFEST", template=template))
+        timings.add("create", time.perf_counter() - started)
+        started = time.perf_counter()
+        store.update(session_id, lambda state: state.accept(_value(template, state.current_placeholder)))
+        timings.add("update", time.perf_counter() - started)
+        started = time.perf_counter()
+        store.get(session_id)
+        timings.add("get", time.perf_counter() - started)
+        if i % 2:
+            started = time.perf_counter()
+            store.end(session_id)
+            timings.add("end", time.perf_counter() - started)
+    store.close()
+    return {"backend": kind, "operations": operations, "stages": timings.summary()}
+
+def _commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _print_report(results: dict) -> None:
+    for run in results["runs"]:
+        print(f"\n[{run['suite']}] concurrency {run['concurrency']}: {run['completed']}/{run['sessions']} manifests "
+              f"in {run['seconds']} s, {run['manifests_per_second']} manifests/s, {run['turns_per_second']} turns/s, "
+              f"{run['llm_calls_per_manifest']} LLM calls per manifest")
+        print(f"  {'stage':32}{'count':>8}{'mean, ms':>11}{'p50, ms':>11}{'p95, ms':>11}")
+        for stage, stats in run["stages"].items():
+            print(f"  {stage:32}{stats['count']:>8}{stats['mean_ms']:>11.3f}{stats['p50_ms']:>11.3f}{stats['p95_ms']:>11.3f}")
+    print(f"\nfill_placeholders: {results['fill_placeholders']['us_per_call']} us per call")
+    for name, stats in results["session_store"]["stages"].items():
+        print(f"session store ({results['session_store']['backend']}) {name}: {stats['mean_ms']} ms mean, {stats['p95_ms']} ms p95")
+    print(f"peak memory: {results['peak_rss_mib']} MiB RSS" + (f", {results['peak_traced_mib']} MiB traced" if results.get("peak_traced_mib") else ""))
+
+def _compare(results: dict, path: str) -> None:
+    with open(path, encoding="utf-8") as f:
+        before = json.load(f)
+    print(f"\nchange against {before['commit']} ({path}):")
+    runs_before = {(run["suite"], run["concurrency"]): run for run in before["runs"]}
+    for run in results["runs"]:
+        old = runs_before.get((run["suite"], run["concurrency"]))
+        if not old:
+            continue
+        for metric in ("manifests_per_second", "turns_per_second", "llm_calls_per_manifest"):
+            if old[metric] and run[metric] is not None:
+                print(f"  [{run['suite']} x{run['concurrency']}] {metric}: {old[metric]} -> {run[metric]} ({(run[metric] / old[metric] - 1) * 100:+.1f}%)")
+    old_fill, new_fill = before["fill_placeholders"]["us_per_call"], results["fill_placeholders"]["us_per_call"]
+    print(f"  fill_placeholders us per call: {old_fill} -> {new_fill} ({(new_fill / old_fill - 1) * 100:+.1f}%)")
+    print(f"  peak RSS MiB: {before['peak_rss_mib']} -> {results['peak_rss_mib']}")
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100, help="Conversations per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50], help="Concurrent conversations, one run each")
+    parser.add_argument("--suites", nargs="+", choices=["chat", "engine"], default=["chat", "engine"])
+    parser.add_argument("--store", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per LLM call")
+    parser.add_argument("--llm-jitter", type=float, default=0.02)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--embed-latency", type=float, default=0.01)
+    parser.add_argument("--embed-jitter", type=float, default=0.005)
+    parser.add_argument("--embed-failure-rate", type=float, default=0.0)
+    parser.add_argument("--caches", action="store_true", help="Keep the LLM and semantic caches on; every conversation is alike, so they hide LLM cost")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also trace Python allocations for peak heap size, slows everything down")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Where to save results, default benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    args = parser.parse_args(argv)
+
+    # Read at import by the modules under test
+    if not args.caches:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+    from core.template_registry import template_registry
+    template = template_registry.get("istio_postgres_se")
+    if template is None:
+        sys.exit("Template istio_postgres_se not found, run from the repository root")
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    async def run_all(directory: str) -> list[dict]:
+        # One event loop for all runs: module-level semaphores bind to the loop they are first used in
+        return [await _run_suite(suite, args, concurrency, template, directory) for suite in args.suites for concurrency in args.concurrency]
+
+    with tempfile.TemporaryDirectory() as directory:
+        runs = asyncio.run(run_all(directory))
+        gc.collect()
+        results = {
+            "commit": _commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "runs": runs,
+            "fill_placeholders": _bench_fill_placeholders(template, 20000),
+            "session_store": _bench_store(args.store, template, 5000, directory),
+            "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) # ru_maxrss is in KiB on Linux
+        }
+    if args.tracemalloc:
+        results["peak_traced_mib"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+
+    _print_report(results)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nsaved to {output}")
+
+    if args.compare:
+        _compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Deterministic stand-ins for GigaChat, the embeddings model and the vector store.
+
+Answers depend only on the prompt, latency is base + uniform jitter, a configurable share of calls fails
+the way a remote client does. Randomness comes from one seeded generator, so a run is reproducible
+for the same seed and concurrency. Every call is recorded in Timings under the stage it belongs to
+"""
+import re
+import time
+import json
+import random
+import asyncio
+import hashlib
+import threading
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Optional
+
+class FakeError(ConnectionError):
+    """What the fakes raise for a failed remote call"""
+
+class Timings:
+    """Durations per stage, thread- and task-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = defaultdict(list)
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def count(self, prefix: str) -> int:
+        with self._lock:
+            return sum(len(values) for stage, values in self.samples.items() if stage.startswith(prefix))
+
+    def summary(self) -> dict:
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+        return {stage: _stats(values) for stage, values in sorted(samples.items())}
+
+def _stats(values: list[float]) -> dict:
+    """count and mean / p50 / p95 / max in milliseconds of sorted durations"""
+    def percentile(p: float) -> float:
+        return values[min(len(values) - 1, int(p * len(values)))]
+    return {
+        "count": len(values),
+        "mean_ms": round(1000 * sum(values) / len(values), 3),
+        "p50_ms": round(1000 * percentile(0.5), 3),
+        "p95_ms": round(1000 * percentile(0.95), 3),
+        "max_ms": round(1000 * values[-1], 3)
+    }
+
+class Latency:
+    """base + uniform(0, jitter) seconds, fails with probability failure_rate"""
+
+    def __init__(self, base: float, jitter: float, failure_rate: float, rng: random.Random):
+        self.base = base
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._rng = rng
+        self._lock = threading.Lock()
+
+    def draw(self) -> tuple[float, bool]:
+        with self._lock:
+            return (self.base + self._rng.uniform(0, self.jitter), self._rng.random() < self.failure_rate)
+
+# Prompt markers of the LLM helpers, in the order they are checked
+_STAGES = [
+    ("маршрутизатор запросов", "route_turn"),
+    ("классификатор запросов пользователя", "classify_intent"),
+    ("достаточно ли специфичен", "assess_specificity"),
+    ("историю сообщений", "rephrase_history"),
+    ("заполнения плейсхолдеров", "meta_intent"),
+    ("сбора сценария", "meta_in_scenario"),
+    ("абракадабра", "gibberish"),
+    ("Поприветствуй", "greeting"),
+    ("Объясни значение плейсхолдера", "placeholder_explanation")
+]
+
+def prompt_stage(prompt: str) -> str:
+    for marker, stage in _STAGES:
+        if marker in prompt:
+            return stage
+    return "chat"
+
+# What the fake rephrases a specific request to
+REPHRASED_QUERY = "интеграция istio service mesh с postgresql через service entry"
+
+def _is_specific(text: str) -> bool:
+    text = text.lower()
+    return "postgres" in text or "постгрес" in text
+
+def _answer(stage: str, prompt: str) -> str:
+    user_text = prompt.rsplit(":", 1)[-1]
+    if stage == "route_turn":
+        specific = _is_specific(user_text)
+        return json.dumps({
+            "intent": "GET_MANIFESTS",
+            "is_specific": specific,
+            "rephrased_query": REPHRASED_QUERY if specific else "",
+            "followups": [] if specific else ["С каким сервисом интегрировать istio?"]
+        }, ensure_ascii=False)
+    if stage == "classify_intent":
+        return "GET_MANIFESTS"
+    if stage == "assess_specificity":
+        specific = _is_specific(prompt.split("Запрос:")[-1])
+        return json.dumps({
+            "is_specific": specific,
+            "rephrased_query": REPHRASED_QUERY if specific else "",
+            "followups": [] if specific else ["С каким сервисом интегрировать istio?", "Нужен ли service entry?"]
+        }, ensure_ascii=False)
+    if stage == "rephrase_history":
+        return REPHRASED_QUERY if _is_specific(prompt) else "istio"
+    if stage == "meta_intent":
+        return json.dumps({"intent": "OTHER"})
+    if stage == "meta_in_scenario":
+        return "OTHER"
+    if stage == "gibberish":
+        return "FALSE"
+    # Free-form replies are a few sentences long
+    return "Нашел подходящие манифесты. " * 8 + "Введите, пожалуйста, значение следующего параметра."
+
+class FakeLLM:
+    """invoke / ainvoke / astream of a chat model, answering by prompt kind"""
+
+    model = "fake-llm"
+
+    def __init__(self, latency: Latency, timings: Timings):
+        self.latency = latency
+        self.timings = timings
+
+    def _call(self, prompt: str) -> tuple[str, str, float, bool]:
+        stage = prompt_stage(prompt)
+        delay, failed = self.latency.draw()
+        return stage, _answer(stage, prompt), delay, failed
+
+    def invoke(self, prompt: str):
+        stage, answer, delay, failed = self._call(prompt)
+        started = time.perf_counter()
+        time.sleep(delay)
+        self.timings.add(f"llm.{stage}", time.perf_counter() - started)
+        if failed:
+            raise FakeError(f"fake {stage} call failed")
+        return SimpleNamespace(content=answer)
+
+    async def ainvoke(self, prompt: str):
+        stage, answer, delay, failed = self._call(prompt)
+        started = time.perf_counter()
+        await asyncio.sleep(delay)
+        self.timings.add(f"llm.{stage}", time.perf_counter() - started)
+        if failed:
+            raise FakeError(f"fake {stage} call failed")
+        return SimpleNamespace(content=answer)
+
+    async def astream(self, prompt: str):
+        stage, answer, delay, failed = self._call(prompt)
+        started = time.perf_counter()
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay / len(words))
+            if failed and i == len(words) // 2:
+                self.timings.add(f"llm.{stage}", time.perf_counter() - started)
+                raise FakeError(f"fake {stage} stream failed")
+            yield SimpleNamespace(content=word if i == 0 else " " + word)
+        self.timings.add(f"llm.{stage}", time.perf_counter() - started)
+
+class FakeEmbeddings:
+    """Bag-of-words vectors hashed into `size` dimensions, so similar texts are close"""
+
+    model = "fake-embeddings"
+
+    def __init__(self, latency: Latency, timings: Timings, size: int = 256):
+        self.latency = latency
+        self.timings = timings
+        self.size = size
+
+    def _vector(self, text: str) -> list[float]:
+        vector = [0.0] * self.size
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.size] += 1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        delay, failed = self.latency.draw()
+        started = time.perf_counter()
+        time.sleep(delay)
+        self.timings.add("embed", time.perf_counter() - started)
+        if failed:
+            raise FakeError("fake embedding call failed")
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+class FakeVectorStore:
+    """Brute-force cosine search over the given documents, embedding each query with the fake embeddings"""
+
+    def __init__(self, documents: list, embeddings: FakeEmbeddings):
+        self.embeddings = embeddings
+        self.documents = documents
+        self._vectors = [embeddings._vector(self._text(doc)) for doc in documents]
+
+    @staticmethod
+    def _text(doc) -> str:
+        return f"{doc.metadata.get('description', '')} {doc.metadata.get('keywords', '')}"
+
+    def similarity_search_by_vector_with_relevance_scores(self, vector: list[float], k: int = 4) -> list[tuple]:
+        """(document, cosine distance), closest first"""
+        scored = [(doc, 1 - sum(a * b for a, b in zip(vector, doc_vector))) for doc, doc_vector in zip(self.documents, self._vectors)]
+        scored.sort(key=lambda item: item[1])
+        return scored[:k]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list[tuple]:
+        return self.similarity_search_by_vector_with_relevance_scores(self.embeddings.embed_query(query), k)
+
+def template_documents(templates, keywords: Optional[dict[str, str]] = None) -> list:
+    """Documents for the vector store and BM25 made from registry templates, as data/documents.py makes them from files"""
+    keywords = keywords or {}
+    return [
+        SimpleNamespace(page_content=template.text, metadata={
+            "source": template.source,
+            "description": template.id.replace("_", " "),
+            "keywords": keywords.get(template.id, template.id.replace("_", ", "))
+        })
+        for template in templates
+    ]
@@ -0,0 +1,86 @@
+"""
+Per-session memory of MANIFEST sessions, before and after compact session records.
+
+"before" replays the previous layout: a Pydantic model per session with its own copy of the template text
+(it used to be read from disk for every session), placeholder lists and a dict of filled values.
+"after" is the current SessionState pointing at the interned Template.
+
+Run from the repository root:
+    python -m benchmarks.session_memory --sessions 10000
+"""
+import sys
+import gc
+import argparse
+import tracemalloc
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
+
+from core.template_registry import template_registry
+from core.session_manager import InMemorySessionStore, SessionState, dump_state
+
+class LegacySessionState(BaseModel):
+    mode: str
+    collected_messages: List[str] = Field(default_factory=list)
+    source_file: Optional[str] = None
+    original_doc_text: Optional[str] = None
+    docs_texts: Optional[List[str]] = None
+    remaining_placeholders: List[str] = Field(default_factory=list)
+    filled_values: Dict[str, str] = Field(default_factory=dict)
+    current_placeholder: Optional[str] = None
+
+def _legacy_session(template, filled: int) -> LegacySessionState:
+    placeholders = list(template.placeholders)
+    return LegacySessionState(
+        mode="MANIFEST",
+        source_file=template.source,
+        original_doc_text=template.text.encode("utf-8").decode("utf-8"), # A fresh copy, as after open().read()
+        remaining_placeholders=placeholders[filled + 1:],
+        filled_values={name: f"value-{name}" for name in placeholders[:filled]},
+        current_placeholder=placeholders[filled] if filled < len(placeholders) else None
+    )
+
+def _compact_session(template, filled: int) -> SessionState:
+    state = SessionState(mode="MANIFEST", template=template)
+    for name in template.placeholders[:filled]:
+        state.accept(f"value-{name}")
+    return state
+
+def _measure(build, templates, sessions: int) -> tuple[int, object]:
+    """Bytes allocated to keep `sessions` sessions alive in an in-memory store"""
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    store = InMemorySessionStore(max_sessions=sessions)
+    for i in range(sessions):
+        template = templates[i % len(templates)]
+        # Sessions are spread over all stages of filling
+        store.save(f"session-{i}", build(template, i % (len(template.placeholders) + 1)))
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return after - before, store
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    templates = [template_registry.get(template_id) for template_id in template_registry.ids()]
+    if not templates:
+        sys.exit("No templates found, run from the repository root")
+
+    legacy_bytes, legacy_store = _measure(_legacy_session, templates, args.sessions)
+    legacy_serialized = len(legacy_store.get("session-1").model_dump_json())
+    del legacy_store
+
+    compact_bytes, compact_store = _measure(_compact_session, templates, args.sessions)
+    compact_serialized = len(dump_state(compact_store.get("session-1")))
+
+    print(f"templates: {len(templates)}, sessions: {args.sessions}")
+    print(f"{'':10}{'total, MiB':>12}{'per session, B':>16}{'serialized, B':>15}")
+    for name, total, serialized in [("before", legacy_bytes, legacy_serialized), ("after", compact_bytes, compact_serialized)]:
+        print(f"{name:10}{total / 2**20:>12.2f}{total / args.sessions:>16.0f}{serialized:>15}")
+    print(f"ratio: {legacy_bytes / compact_bytes:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Optional
+from core.template_registry import Template, compile_template
+from core.placeholder_engine import validate_values
+
+logger = logging.getLogger(__name__)
+
+RENDER_POOL_WORKERS = int(os.getenv("RENDER_POOL_WORKERS", str(os.cpu_count() or 1)))
+# Smaller batches are rendered in the event loop process, shipping them to a worker costs more than rendering
+RENDER_POOL_MIN_ITEMS = int(os.getenv("RENDER_POOL_MIN_ITEMS", "64"))
+RENDER_CHUNK_SIZE = int(os.getenv("RENDER_CHUNK_SIZE", "32")) # Value sets per task sent to a worker
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs threads (executors, session flusher) may copy held locks
+        _pool = ProcessPoolExecutor(max_workers=RENDER_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def render_item(template: Template, index: int, values: dict[str, str], strict: bool) -> dict:
+    """Result line of one value set: the manifest, or the errors per placeholder"""
+    try:
+        errors = validate_values(template, values, strict)
+        if errors:
+            return {"index": index, "errors": errors}
+        return {"index": index, "manifest": template.render(values)}
+    except Exception as e:
+        logger.exception("[BULK_RENDER] Ошибка при рендеринге элемента %s", index)
+        return {"index": index, "errors": {"": str(e)}}
+
+@lru_cache(maxsize=16)
+def _worker_template(source: str, text: str) -> Template:
+    return compile_template(source, text)
+
+def _render_chunk(source: str, text: str, start: int, value_sets: list[dict[str, str]], strict: bool) -> list[dict]:
+    """Runs in a worker process: the template is compiled once per worker, not once per task"""
+    template = _worker_template(source, text)
+    return [render_item(template, start + offset, values, strict) for offset, values in enumerate(value_sets)]
+
+def render_source(source: str, text: str, index: int, values: dict[str, str], strict: bool) -> dict:
+    """Worker entry point for a single value set of any template"""
+    return render_item(_worker_template(source, text), index, values, strict)
+
+async def render_many(template: Template, value_sets: list[dict[str, str]], strict: bool = True) -> AsyncIterator[dict]:
+    """
+    Render every value set, yielding results in input order as soon as they are ready.
+    Large batches are split into chunks and fanned out over the process pool,
+    with at most two chunks per worker in flight so memory stays bounded
+    """
+    if len(value_sets) < RENDER_POOL_MIN_ITEMS:
+        for index, values in enumerate(value_sets):
+            yield render_item(template, index, values, strict)
+        return
+
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    starts = iter(range(0, len(value_sets), RENDER_CHUNK_SIZE))
+    in_flight = deque()
+
+    def submit() -> bool:
+        start = next(starts, None)
+        if start is None:
+            return False
+        chunk = value_sets[start:start + RENDER_CHUNK_SIZE]
+        try:
+            future = loop.run_in_executor(pool, _render_chunk, template.source, template.text, start, chunk, strict)
+        except BrokenProcessPool as e:
+            future = loop.create_future()
+            future.set_exception(e)
+        in_flight.append((start, len(chunk), future))
+        return True
+
+    try:
+        while len(in_flight) < 2 * RENDER_POOL_WORKERS and submit():
+            pass
+        while in_flight:
+            start, count, future = in_flight.popleft()
+            try:
+                results = await future
+            except Exception as e:
+                # A worker died or the chunk could not be sent, only the items of this chunk fail
+                logger.error("[BULK_RENDER] Ошибка в процессе рендеринга: %r", e)
+                if isinstance(e, BrokenProcessPool) and _pool is pool:
+                    shutdown_pool() # The next batch gets a fresh pool
+                results = [{"index": start + offset, "errors": {"": "ошибка рендеринга"}} for offset in range(count)]
+            submit()
+            for result in results:
+                yield result
+    finally:
+        for _, _, future in in_flight:
+            future.cancel()
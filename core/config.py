@@ -1,8 +1,10 @@
 import os
 import logging
-from langchain_gigachat import GigaChat, GigaChatEmbeddings
-from langchain_chroma import Chroma
-from data.documents import load_documents
+import threading
+from functools import wraps
+from typing import Callable, Optional
+from core.indexer import sync_vector_store, INDEX_MANIFEST
+from core.template_registry import template_registry
 
 logger = logging.getLogger(__name__)
 
@@ -10,50 +12,139 @@ VECTOR_DIR = "./database"
 
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
 
-llm = GigaChat(model="GigaChat-2-Max",
+# Clients, documents and the vector store are created on first use, not on import.
+# The app creates them in its lifespan handler via warm_up()
+
+def _provider(factory):
+    """Memoize factory: the object is created once, on the first call, even from several threads"""
+    lock = threading.Lock()
+    instance = []
+
+    @wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    get.is_initialized = lambda: bool(instance)
+    return get
+
+@_provider
+def get_llm():
+    from langchain_gigachat import GigaChat
+
+    return GigaChat(model="GigaChat-2-Max",
                 base_url="https://X/v1",
                 verify_ssl_certs=False, # Verify the server's SSL certificate
                 cert_file='cert.pem', # Path to certificate to verify the server's identity
                 key_file='key.pem') # Path to private key file to verify the client's identity
 
-embeddings = GigaChatEmbeddings(model="EmbeddingsGigaR",
+@_provider
+def get_embeddings():
+    from langchain_gigachat import GigaChatEmbeddings
+    from core.embedding_cache import CachedEmbeddings
+
+    # Remote embedding calls go through a persistent cache, for queries and index builds alike
+    return CachedEmbeddings(GigaChatEmbeddings(model="EmbeddingsGigaR",
                 base_url="https://X/v1",
                 verify_ssl_certs=False,
                 cert_file='cert.pem',
-                key_file='key.pem')
+                key_file='key.pem'))
+
+def get_documents():
+    """List of documents with metadata"""
+    from data.documents import load_documents
+    return load_documents()
 
-# Load a list of documents with metadata
-docs = load_documents()
+def _open_vector_store():
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        persist_directory=VECTOR_DIR,
+        embedding_function=get_embeddings(), # embedding model for similarity search
+        collection_metadata={"hnsw:space": "cosine"}
+    )
 
 # Build vector store
 def build_vector_store():
     """
-    Build or rebuild the database
-    Run on documents change
+    Rebuild the database from scratch, re-adding every document
     """
-    return Chroma.from_documents(
-        documents=docs,
-        embedding=embeddings,
-        persist_directory=VECTOR_DIR,
-        collection_metadata={"hnsw:space": "cosine"} 
-    )
+    os.makedirs(VECTOR_DIR, exist_ok=True)
+    store = _open_vector_store()
+    sync_vector_store(store, get_documents(), os.path.join(VECTOR_DIR, INDEX_MANIFEST), full=True)
+    return store
 
 def load_vector_store():
     """
     Load the database
-    Run on app startup
+    Run on app startup: only new or changed documents are embedded, removed ones are deleted
     """
-
-    # Check if database exists and create it if not
     if not os.path.exists(VECTOR_DIR):
         logger.info("База данных не найдена. Создаем новую...")
         os.makedirs(VECTOR_DIR)
-        build_vector_store()
 
-    return Chroma(
-        persist_directory=VECTOR_DIR,
-        embedding_function=embeddings # embedding model for similarity search
-    )
+    docs = get_documents()
+    store = _open_vector_store()
+    sync_vector_store(store, docs, os.path.join(VECTOR_DIR, INDEX_MANIFEST))
+    return store
 
 # Load the database with manifest templates
-vector_store = load_vector_store()
+get_vector_store = _provider(load_vector_store)
+
+@_provider
+def get_retriever():
+    """Hybrid (vector + BM25) search over the templates"""
+    from core.retriever import HybridRetriever
+    return HybridRetriever(get_vector_store(), get_documents())
+
+_warm_up_error: str | None = None
+_ready = threading.Event()
+
+def warm_up(on_ready: Optional[Callable[[], None]] = None) -> None:
+    """
+    Load manifest templates, create the LLM client, the embeddings, the vector store (syncing the index) and the retriever.
+    on_ready runs before the worker is reported ready, e.g. to hand the clients to the routes.
+    Blocking, meant to run once per worker before it takes traffic; safe to call again after a failure
+    """
+    global _warm_up_error
+    try:
+        template_registry.load()
+        get_llm()
+        get_vector_store()
+        get_retriever()
+        if on_ready is not None:
+            on_ready()
+        _warm_up_error = None
+        _ready.set()
+        logger.info("[CONFIG] Клиенты LLM и векторная база готовы")
+    except Exception as e:
+        _warm_up_error = str(e)
+        raise
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+def readiness() -> dict:
+    """State of the providers for the readiness probe"""
+    return {
+        "ready": is_ready(),
+        "llm": get_llm.is_initialized(),
+        "vector_store": get_vector_store.is_initialized(),
+        "error": _warm_up_error
+    }
+
+def __getattr__(name):
+    # Backwards compatible access to config.llm / config.embeddings / config.vector_store / config.docs,
+    # resolved lazily on first access instead of on import
+    providers = {
+        "llm": get_llm,
+        "embeddings": get_embeddings,
+        "vector_store": get_vector_store,
+        "docs": get_documents
+    }
+    if name in providers:
+        return providers[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,252 @@
+import os
+import re
+import json
+import zlib
+import fcntl
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "4096"))
+
+_INITIAL_CAPACITY = 1024
+
+class _VectorFile:
+    """
+    Append-only float32 matrix on disk, shared by every process that uses the same directory.
+    <name>.f32 is a NumPy memmap of shape (capacity, dim), <name>.idx has one "key<TAB>row<TAB>crc32" line per vector
+    and <name>.json keeps the dimension.
+    Appends take an exclusive lock on <name>.lock and read what other processes appended before picking rows;
+    lines that fail the checksum (a write cut by a crash) are skipped.
+    Threads of one process share the instance through its own lock
+    """
+
+    def __init__(self, directory: str, name: str):
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, name)
+        self._data_path = base + ".f32"
+        self._index_path = base + ".idx"
+        self._meta_path = base + ".json"
+        self._lock_path = base + ".lock"
+        self.rows: dict[str, int] = {}
+        self.dim: Optional[int] = None
+        self._matrix: Optional[np.memmap] = None
+        self._next_row = 0
+        self._index_offset = 0 # Bytes of the idx file already read
+        self._lock = threading.Lock()
+        self._refresh()
+
+    @staticmethod
+    def _checksum(key: str, row: int) -> str:
+        return format(zlib.crc32(f"{key}\t{row}".encode("utf-8")), "08x")
+
+    def _refresh(self) -> None:
+        """Read index lines appended since the last call, by this or another process"""
+        if self.dim is None:
+            if not os.path.exists(self._meta_path):
+                return
+            with open(self._meta_path, encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        if not os.path.exists(self._index_path) or os.path.getsize(self._index_path) <= self._index_offset:
+            return
+
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_offset)
+            chunk = f.read()
+        # A line without its newline is still being written, read it next time
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        self._index_offset += len(complete)
+        for line in complete.decode("utf-8", errors="replace").splitlines():
+            key, row, checksum = (line.split("\t") + ["", ""])[:3]
+            if not row.isdigit() or checksum != self._checksum(key, int(row)):
+                continue
+            self.rows[key] = int(row)
+            self._next_row = max(self._next_row, int(row) + 1)
+        self._map()
+
+    def _map(self) -> None:
+        """Map the whole data file, it may have been grown by another process"""
+        if self.dim is None or not os.path.exists(self._data_path):
+            return
+        capacity = os.path.getsize(self._data_path) // (self.dim * 4)
+        if self._matrix is not None and self._matrix.shape[0] == capacity:
+            return
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        self._matrix = np.memmap(self._data_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim)) if capacity else None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self.rows.get(key)
+            if row is None:
+                self._refresh()
+                row = self.rows.get(key)
+                if row is None:
+                    return None
+            return np.array(self._matrix[row])
+
+    def append(self, items: list[tuple[str, np.ndarray]]) -> None:
+        if not items:
+            return
+        with self._lock, open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._append_locked(items)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _append_locked(self, items: list[tuple[str, np.ndarray]]) -> None:
+        self._refresh()
+        if self.dim is None:
+            self.dim = len(items[0][1])
+            with open(self._meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim}, f)
+        # Another process may have stored some of the keys meanwhile
+        items = [(key, vector) for key, vector in items if key not in self.rows]
+        if not items:
+            return
+        self._reserve(self._next_row + len(items))
+
+        lines = []
+        for key, vector in items:
+            row = self._next_row
+            self._matrix[row] = vector
+            self.rows[key] = row
+            self._next_row += 1
+            lines.append(f"{key}\t{row}\t{self._checksum(key, row)}\n")
+        self._matrix.flush()
+
+        # Index lines go last, so a crash never leaves a key pointing at an unwritten row
+        with open(self._index_path, "ab") as f:
+            if f.tell() > self._index_offset:
+                # The previous writer died in the middle of a line, start ours on a fresh one
+                lines.insert(0, "\n")
+            data = "".join(lines).encode("utf-8")
+            f.write(data)
+            self._index_offset = f.tell()
+
+    def _reserve(self, count: int) -> None:
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if count <= capacity:
+            return
+        new_capacity = max(_INITIAL_CAPACITY, capacity * 2, count)
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+            self._matrix = None
+        with open(self._data_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._map()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with a bounded in-memory LRU and a persistent vector file,
+    so a text is sent to the remote model only once per model.
+    Used both for queries and for building the vector store
+    """
+
+    def __init__(self, base: Embeddings, cache_dir: str = EMBEDDING_CACHE_DIR, memory_size: int = EMBEDDING_CACHE_MEMORY_SIZE):
+        self.base = base
+        self.model = getattr(base, "model", None) or type(base).__name__
+        self.memory_size = memory_size
+        self._mem: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._disk = _VectorFile(cache_dir, re.sub(r"[^\w.-]", "_", self.model)) if cache_dir else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, kind: str, text: str) -> str:
+        # Queries and documents are keyed separately: some models (EmbeddingsGigaR) prefix queries with an instruction
+        return hashlib.sha256(f"{self.model}\x00{kind}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: list[str]) -> list[Optional[np.ndarray]]:
+        """Cached vector per key, None for misses. The vector file is read without holding self._lock"""
+        with self._lock:
+            vectors = [self._mem.get(key) for key in keys]
+            for key, vector in zip(keys, vectors):
+                if vector is not None:
+                    self._mem.move_to_end(key)
+        if self._disk is None:
+            return vectors
+
+        loaded = []
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                vectors[i] = self._disk.get(keys[i])
+                if vectors[i] is not None:
+                    loaded.append((keys[i], vectors[i]))
+        if loaded:
+            with self._lock:
+                for key, vector in loaded:
+                    self._remember(key, vector)
+        return vectors
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._mem[key] = vector
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_size:
+            self._mem.popitem(last=False)
+
+    def _count(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def _store(self, items: list[tuple[str, np.ndarray]]) -> None:
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+        # The append waits on the file lock, other threads keep answering from memory meanwhile
+        if self._disk is not None:
+            try:
+                # Two threads may have missed on the same text, append() keeps one row per key
+                self._disk.append(items)
+            except OSError as e:
+                logger.warning("[EmbeddingCache] Не удалось сохранить эмбеддинги на диск: %s", e)
+
+    def _embed_many(self, kind: str, texts: list[str], embed) -> list[list[float]]:
+        keys = [self._key(kind, text) for text in texts]
+        vectors = self._lookup(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self._count(len(texts) - len(missing), len(missing))
+
+        if missing:
+            # Unique texts only, in one call to the remote model
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            embedded = dict(zip(unique, (np.asarray(v, dtype=np.float32) for v in embed(unique))))
+            self._store([(self._key(kind, text), vector) for text, vector in embedded.items()])
+            for i in missing:
+                vectors[i] = embedded[texts[i]]
+
+        return [vector.tolist() for vector in vectors]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed_many("doc", texts, self.base.embed_documents)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed several search queries in one embed_documents call to the remote model.
+        Vectors are the same as from embed_query and share its cache entries
+        """
+        # GigaChatEmbeddings.embed_query prepends an instruction to the text when use_prefix_query is set
+        prefix = getattr(self.base, "prefix_query", "") if getattr(self.base, "use_prefix_query", False) else ""
+        return self._embed_many("query", texts, lambda unique: self.base.embed_documents([prefix + text for text in unique]))
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self._key("query", text)
+        vector = self._lookup([key])[0]
+        self._count(int(vector is not None), int(vector is None))
+
+        if vector is None:
+            vector = np.asarray(self.base.embed_query(text), dtype=np.float32)
+            self._store([(key, vector)])
+
+        return vector.tolist()
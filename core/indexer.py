@@ -0,0 +1,82 @@
+import os
+import json
+import hashlib
+import logging
+from core.semantic_cache import semantic_cache
+
+logger = logging.getLogger(__name__)
+
+# Stored next to the Chroma collection: document id -> content hash of what is indexed
+INDEX_MANIFEST = "index_manifest.json"
+
+def document_id(doc) -> str:
+    """Stable id of a template in the collection, independent of its content"""
+    key = f"{doc.metadata.get('source', '')}\x00{doc.metadata.get('description', '')}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def document_hash(doc) -> str:
+    """Hash of everything that ends up in the index: text and metadata"""
+    digest = hashlib.sha256(doc.page_content.encode("utf-8"))
+    digest.update(json.dumps(doc.metadata, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+def _load_manifest(path: str) -> dict[str, str] | None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("[Indexer] Не удалось прочитать %s, индекс будет перестроен: %s", path, e)
+        return None
+
+def _save_manifest(path: str, manifest: dict[str, str]) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def sync_vector_store(vector_store, documents, manifest_path: str, full: bool = False) -> dict[str, int]:
+    """
+    Bring the collection in line with documents: embed only new or changed ones,
+    delete vectors of removed ones. full=True drops everything and re-adds all documents.
+    Returns counts of added, updated, removed and unchanged documents
+    """
+    manifest = None if full else _load_manifest(manifest_path)
+
+    if manifest is None:
+        # Unknown contents (first run, legacy index built without ids, or forced rebuild): start clean
+        existing_ids = vector_store.get(include=[])["ids"]
+        if existing_ids:
+            vector_store.delete(ids=existing_ids)
+        manifest = {}
+
+    current = {}
+    for doc in documents:
+        current.setdefault(document_id(doc), doc) # Duplicate entries collapse into one vector
+
+    hashes = {doc_id: document_hash(doc) for doc_id, doc in current.items()}
+    changed = [doc_id for doc_id, h in hashes.items() if manifest.get(doc_id) != h]
+    removed = [doc_id for doc_id in manifest if doc_id not in current]
+
+    if removed:
+        vector_store.delete(ids=removed)
+    if changed:
+        # Chroma upserts by id, so changed documents replace their old vectors in place
+        vector_store.add_documents([current[doc_id] for doc_id in changed], ids=changed)
+
+    _save_manifest(manifest_path, hashes)
+
+    if changed or removed:
+        # Cached query outcomes were resolved against the old documents
+        semantic_cache.clear()
+        logger.info("[Indexer] Индекс манифестов изменился, семантический кэш очищен")
+
+    stats = {
+        "added": sum(1 for doc_id in changed if doc_id not in manifest),
+        "updated": sum(1 for doc_id in changed if doc_id in manifest),
+        "removed": len(removed),
+        "unchanged": len(current) - len(changed)
+    }
+    logger.info("[Indexer] Синхронизация индекса: %s", stats)
+    return stats
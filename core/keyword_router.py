@@ -0,0 +1,119 @@
+import re
+import threading
+import logging
+from collections import defaultdict
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Spelling variants and transliterations mapped to one canonical term, applied before stemming
+SYNONYMS = {
+    "кафка": "kafka",
+    "кафке": "kafka",
+    "кафку": "kafka",
+    "истио": "istio",
+    "постгрес": "postgresql",
+    "постгресе": "postgresql",
+    "постгресу": "postgresql",
+    "postgres": "postgresql",
+    "pg": "postgresql",
+    "секман": "secman",
+    "секмана": "secman",
+    "секманом": "secman",
+    "айпи": "ip",
+    "ип": "ip",
+    "тсп": "tcp",
+    "тцп": "tcp",
+    "меш": "mesh",
+    "сервис": "service",
+    "мтлс": "mtls",
+    "входящий": "inbound",
+    "входящего": "inbound",
+    "исходящий": "outbound",
+    "исходящего": "outbound",
+}
+_CANONICAL = set(SYNONYMS.values())
+
+# Words that carry no meaning for picking a template
+STOPWORDS = {
+    "с", "со", "к", "ко", "в", "во", "на", "по", "для", "и", "или", "из", "от", "до", "через", "а", "мне", "меня",
+    "нужно", "нужен", "нужна", "нужны", "надо", "хочу", "хотим", "хотел", "хотелось", "бы", "как", "это",
+    "настроить", "настройка", "настройки", "сделать", "подскажи", "помоги", "пожалуйста", "дай",
+    "манифест", "манифесты", "манифестов", "манифеста", "yaml", "ямл", "сгенерируй", "сгенерировать",
+    "the", "a", "an", "to", "for", "with", "and", "of", "i", "want", "need", "please", "manifest", "manifests"
+}
+
+_RU_SUFFIXES = sorted([
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "иях", "ях", "ах", "ением", "анием", "ение", "ения", "ание", "ания", "иться", "ится", "ием", "ия", "ие", "ий",
+    "ая", "яя", "ое", "ее", "ые", "ой", "ей", "ый", "ов", "ев", "ам", "ям", "ом", "ем", "ую", "юю", "ться", "ть",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь"
+], key=len, reverse=True)
+_EN_SUFFIXES = ["ing", "es", "s"]
+_CYRILLIC_RE = re.compile(r"[а-я]")
+_TOKEN_RE = re.compile(r"\w+")
+
+def stem(word: str) -> str:
+    """Strip one inflection ending, keeping at least 3 letters of the stem"""
+    suffixes = _RU_SUFFIXES if _CYRILLIC_RE.search(word) else _EN_SUFFIXES
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def normalize_terms(text: str) -> list[str]:
+    """Lowercased, synonym-normalized and stemmed terms of the text, stopwords dropped"""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if token in STOPWORDS:
+            continue
+        token = SYNONYMS.get(token, token)
+        terms.append(token if token in _CANONICAL else stem(token))
+    return terms
+
+class KeywordRouter:
+    """
+    Inverted index over the keywords of the templates.
+    A query is routed to a template without vector search only if every meaningful term of the query
+    is a known keyword term and exactly one template has all of them
+    """
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+        self._postings: dict[str, set[int]] = defaultdict(set)
+        for i, doc in enumerate(self.documents):
+            for term in normalize_terms(doc.metadata.get("keywords", "")):
+                self._postings[term].add(i)
+        # Terms every template has (istio, service mesh) can't tell templates apart
+        self._common = {term for term, docs in self._postings.items() if len(docs) == len(self.documents)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def route(self, query: str) -> Optional[Any]:
+        """The one template the query names, None to fall through to the full search"""
+        document = self._match(query)
+        if document is not None:
+            logger.info("[Router] %s", document.metadata.get("source"))
+        with self._lock:
+            if document is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return document
+
+    def _match(self, query: str) -> Optional[Any]:
+        terms = set(normalize_terms(query)) - self._common
+        if not terms:
+            return None
+        if any(term not in self._postings for term in terms):
+            return None # An unknown word may change the meaning, e.g. "без tls"
+
+        matching = set.intersection(*(self._postings[term] for term in terms))
+        if len(matching) != 1:
+            return None
+        return self.documents[matching.pop()]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 3) if total else 0.0}
@@ -0,0 +1,181 @@
+import os
+import time
+import atexit
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+# Optional SQLite file that keeps cached responses across restarts
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or None
+# How often new responses are written to LLM_CACHE_PATH; a crash loses at most this much of them
+LLM_CACHE_FLUSH_INTERVAL = float(os.getenv("LLM_CACHE_FLUSH_INTERVAL", "1.0"))
+
+# Seconds each kind of call stays cached. Classifiers are deterministic enough to keep for a day,
+# free-form texts are refreshed more often
+LLM_CACHE_TTLS = {
+    "classify_intent": 24 * 3600,
+    "assess_specificity": 24 * 3600,
+    "rephrase_history": 24 * 3600,
+    "meta_intent": 24 * 3600,
+    "meta_in_scenario": 24 * 3600,
+    "gibberish": 24 * 3600,
+    "route_turn": 24 * 3600,
+    "greeting": 3600,
+    "placeholder_explanation": 3600
+}
+DEFAULT_TTL = 3600
+
+@dataclass
+class CachedResponse:
+    """Stands in for the LLM message object, callers only read .content"""
+    content: str
+
+def model_name(llm) -> str:
+    return getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+
+def cache_key(model: str, prompt: str) -> str:
+    # Prompts are multi-line f-strings, so indentation and line breaks don't matter
+    normalized = " ".join(prompt.split())
+    return hashlib.sha256(f"{model}\x00{normalized}".encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """
+    Two-tier cache of LLM responses: in-memory LRU in front of an optional SQLite file.
+    Writes to the file are batched by a background thread (write-behind), the memory lock is never held during disk I/O
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_SIZE, path: Optional[str] = LLM_CACHE_PATH,
+                 flush_interval: float = LLM_CACHE_FLUSH_INTERVAL):
+        self.max_entries = max_entries
+        self._mem: OrderedDict[str, tuple[str, float]] = OrderedDict() # key -> (content, expires_at)
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict[str, int]] = {}
+        self._pending: list[tuple[str, str, str, float]] = [] # Rows not written to the file yet
+        self._db = self._open_db(path) if path else None
+        self._db_lock = threading.Lock()
+        if self._db is not None:
+            self.flush_interval = flush_interval
+            self._stop = threading.Event()
+            self._flusher = threading.Thread(target=self._flush_loop, name="llm-cache-flusher", daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    @property
+    def persistent(self) -> bool:
+        """True if misses of the memory tier go on to the SQLite file"""
+        return self._db is not None
+
+    def _open_db(self, path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, namespace TEXT, content TEXT, expires_at REAL)"
+        )
+        db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+        db.commit()
+        return db
+
+    def _count(self, namespace: str, field: str) -> None:
+        counters = self._stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counters[field] += 1
+
+    def get(self, namespace: str, key: str, memory_only: bool = False) -> Optional[str]:
+        """
+        Cached content or None.
+        memory_only=True never touches the disk, for the event loop: a None from it is not counted as a miss
+        while the file may still have the entry, the caller goes on with get() in a thread
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry and entry[1] > now:
+                self._mem.move_to_end(key)
+                self._count(namespace, "hits")
+                return entry[0]
+            if entry:
+                del self._mem[key]
+            if self._db is None:
+                self._count(namespace, "misses")
+                return None
+            if memory_only:
+                return None
+
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT content, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        with self._lock:
+            if row:
+                self._remember(key, row[0], row[1])
+                self._count(namespace, "hits")
+                return row[0]
+            self._count(namespace, "misses")
+            return None
+
+    def set(self, namespace: str, key: str, content: str) -> None:
+        expires_at = time.time() + LLM_CACHE_TTLS.get(namespace, DEFAULT_TTL)
+        with self._lock:
+            self._remember(key, content, expires_at)
+            if self._db is not None:
+                self._pending.append((key, namespace, content, expires_at))
+
+    def _remember(self, key: str, content: str, expires_at: float) -> None:
+        self._mem[key] = (content, expires_at)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def flush(self) -> int:
+        """Write pending responses to the file in one transaction, returns how many were written"""
+        if self._db is None:
+            return 0
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        try:
+            with self._db_lock, self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO llm_cache (key, namespace, content, expires_at) VALUES (?, ?, ?, ?)",
+                    pending
+                )
+        except sqlite3.Error as e:
+            logger.warning("[LLMCache] Не удалось сохранить ответы на диск: %s", e)
+            return 0
+        return len(pending)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        """Stop the background thread and write out what is still pending"""
+        if self._db is None or self._stop.is_set():
+            return
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        """Hit/miss counters per namespace"""
+        with self._lock:
+            return {namespace: dict(counters) for namespace, counters in self._stats.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._pending.clear()
+        if self._db is not None:
+            with self._db_lock, self._db:
+                self._db.execute("DELETE FROM llm_cache")
+
+llm_cache = LLMCache()
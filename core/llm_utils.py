@@ -1,8 +1,9 @@
 import json
 import logging
 from pydantic import BaseModel
-from typing import Literal
+from typing import Literal, Optional
 from models import Intent
+from core.safe_llm import cached_invoke, cached_ainvoke
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +22,12 @@ class SpecificityModel(BaseModel):
     rephrased_query: str = ""
     followups: list[str] = []
 
-def llm_classify_intent(llm, text: str) -> Intent:
-    """Determine the purpose of the user's request"""
-    prompt = f""" Ты - классификатор запросов пользователя. Выбери намерение пользователя на основании его запроса:
+# Expected response from LLM json for the combined turn router
+class TurnRouteModel(SpecificityModel):
+    intent: Literal["GET_MANIFESTS", "HELP", "CHAT"]
+
+def _classify_intent_prompt(text: str) -> str:
+    return f""" Ты - классификатор запросов пользователя. Выбери намерение пользователя на основании его запроса:
     - GET_MANIFESTS: запросил манифесты, yaml, интеграцию, сценарий и т.п.
     - HELP: спрашивает, что ты умеешь, как с тобой работать, просит инструкцию по твоему использованию
     - CHAT: любой другой запрос, который не требует манифестов
@@ -33,22 +37,29 @@ def llm_classify_intent(llm, text: str) -> Intent:
     Пользователь: {text}
     """
 
+def _parse_intent(response) -> Intent:
+    label = (getattr(response, "content", "") or "").strip().upper()
+    logger.info("[llm_classify_intent] label = %s", label)
+    return Intent(label) if label in Intent._value2member_map_ else Intent.CHAT
+
+def llm_classify_intent(llm, text: str) -> Intent:
+    """Determine the purpose of the user's request"""
     try:
-        response = llm.invoke(prompt)
-        label = (getattr(response, "content", "") or "").strip().upper()
-        logger.info(f"[llm_classify_intent] label = {label}")
-        return Intent(label) if label in Intent._value2member_map_ else Intent.CHAT
-        # if label in ["GET_MANIFESTS", "HELP", "CHAT"]:
-        #     return label
+        return cached_invoke(llm, _classify_intent_prompt(text), "classify_intent", _parse_intent)
     except Exception as e:
-        logger.error(f"[llm_classify_intent] Произошла ошибка при классификации запроса пользователя: {e}")
+        logger.error("[llm_classify_intent] Произошла ошибка при классификации запроса пользователя: %s", e)
         return Intent.CHAT
 
-def llm_assess_specificity(llm, user_text: str) -> dict:
-    """
-    Запрос к LLM для оценки, насколько запрос пользователя позволяет понять, какие манифесты генерировать
-    """
-    prompt = f""" Ты - ассистент, который помогает пользователю сформировать манифесты для интеграции сервисов.
+async def llm_classify_intent_async(llm, text: str) -> Intent:
+    """Async variant of llm_classify_intent"""
+    try:
+        return await cached_ainvoke(llm, _classify_intent_prompt(text), "classify_intent", _parse_intent)
+    except Exception as e:
+        logger.error("[llm_classify_intent] Произошла ошибка при классификации запроса пользователя: %s", e)
+        return Intent.CHAT
+
+def _assess_specificity_prompt(user_text: str) -> str:
+    return f""" Ты - ассистент, который помогает пользователю сформировать манифесты для интеграции сервисов.
     Определи, достаточно ли специфичен запрос пользователя, чтобы искать нужные манифесты (True/False).
     Если нет - предложи 2-4 коротких уточняющих вопроса.
     Если да - перефразируй запрос кратко и предметно.
@@ -68,37 +79,49 @@ def llm_assess_specificity(llm, user_text: str) -> dict:
     Запрос: {user_text}
     """
 
-    try:
-        response = llm.invoke(prompt)
-        # If response is not a string and falsy, make sure at least string is returned
-        raw = (getattr(response, "content", "") or "").strip()
-        parsed = json.loads(raw)
+def _parse_specificity(response) -> dict:
+    # If response is not a string and falsy, make sure at least string is returned
+    raw = (getattr(response, "content", "") or "").strip()
+    parsed = json.loads(raw)
 
-        # Validate & normalize the LLM response with Pydantic
-        model = SpecificityModel.model_validate(parsed)
-        data = model.model_dump()
+    # Validate & normalize the LLM response with Pydantic
+    model = SpecificityModel.model_validate(parsed)
+    data = model.model_dump()
 
-        logger.info(f"[llm_assess_specificity] data['is_specific'] = {data['is_specific']}")
-        logger.info(f"[llm_assess_specificity] data['rephrased_query'] = {data['rephrased_query']}")
-        return data
+    logger.debug("[llm_assess_specificity] is_specific = %s, rephrased_query = %s", data["is_specific"], data["rephrased_query"])
+    return data
 
-    except Exception as e:
-        logger.error(f"[llm_assess_specificity] Ошибка при оценке специфичности запроса: {e}")
-        return {
-            "is_specific": False,
-            "rephrased_query": "",
-            "followups": [
-                "С каким сервисом вы хотите интегрировать istio service mesh?",
-            ]
-        }
+def _specificity_fallback() -> dict:
+    return {
+        "is_specific": False,
+        "rephrased_query": "",
+        "followups": [
+            "С каким сервисом вы хотите интегрировать istio service mesh?",
+        ]
+    }
 
-def llm_rephrase_history(llm, messages: list[str]) -> str:
+def llm_assess_specificity(llm, user_text: str) -> dict:
     """
-    Rephrase user's request if it is vague or contains duplicates after combining user's previous messages
+    Запрос к LLM для оценки, насколько запрос пользователя позволяет понять, какие манифесты генерировать
     """
+    try:
+        return cached_invoke(llm, _assess_specificity_prompt(user_text), "assess_specificity", _parse_specificity)
+    except Exception as e:
+        logger.error("[llm_assess_specificity] Ошибка при оценке специфичности запроса: %s", e)
+        return _specificity_fallback()
+
+async def llm_assess_specificity_async(llm, user_text: str) -> dict:
+    """Async variant of llm_assess_specificity"""
+    try:
+        return await cached_ainvoke(llm, _assess_specificity_prompt(user_text), "assess_specificity", _parse_specificity)
+    except Exception as e:
+        logger.error("[llm_assess_specificity] Ошибка при оценке специфичности запроса: %s", e)
+        return _specificity_fallback()
+
+def _rephrase_history_prompt(messages: list[str]) -> str:
     history = " | ".join(m.strip() for m in messages if m and m.strip())
-    
-    prompt = f"""
+
+    return f"""
     Ты получаешь историю сообщений пользователя, которые уточняют один и тот же запрос.
     Перефразируй их в одно короткое и однозначное предложение, которое выражает суть, убери повторы и лишние слова.
     Верни ТОЛЬКО перефразированный запрос без каких-либо пояснений.
@@ -107,18 +130,28 @@ def llm_rephrase_history(llm, messages: list[str]) -> str:
     {history}
     """
 
+def _parse_rephrased(response, messages: list[str]) -> str:
+    rephrased = (getattr(response, "content", "") or "").strip()
+    return rephrased or (messages[-1].strip() if messages else "")
+
+def llm_rephrase_history(llm, messages: list[str]) -> str:
+    """
+    Rephrase user's request if it is vague or contains duplicates after combining user's previous messages
+    """
     try:
-        response = llm.invoke(prompt)
-        rephrased = (getattr(response, "content", "") or "").strip()
-        return rephrased or (messages[-1].strip() if messages else "")
+        return cached_invoke(llm, _rephrase_history_prompt(messages), "rephrase_history", lambda response: _parse_rephrased(response, messages))
     except Exception:
         return messages[-1].strip() if messages else ""
 
-def llm_detect_meta_intent(llm, user_text: str) -> str:
-    """For situations when a user enters a non-value during MANIFEST mode
-    Returns one of: HOW_MANY_LEFT, LIST_PLACEHOLDERS, HELP, CANCEL, OTHER"""
+async def llm_rephrase_history_async(llm, messages: list[str]) -> str:
+    """Async variant of llm_rephrase_history"""
+    try:
+        return await cached_ainvoke(llm, _rephrase_history_prompt(messages), "rephrase_history", lambda response: _parse_rephrased(response, messages))
+    except Exception:
+        return messages[-1].strip() if messages else ""
 
-    prompt = f"""
+def _meta_intent_prompt(user_text: str) -> str:
+    return f"""
     Ты - классификатор коротких пользовательских сообщений, введенных во время заполнения плейсхолдеров в YAML.
     Верни строго JSON одного из следующих видов, ничего кроме JSON не добавляй:
 
@@ -129,28 +162,37 @@ def llm_detect_meta_intent(llm, user_text: str) -> str:
     {{"intent": "OTHER"}} - любое другое сообщение (в т.ч. случайный текст, который не является значением)
     Текст: {user_text}
     """
-    try:
-        resp = llm.invoke(prompt)
-        raw = (getattr(resp, "content", "") or "").strip()
-        logger.info(f"[MetaIntent] LLM raw = {raw}")
 
-        parsed = json.loads(raw)
-        logger.info(f"[MetaIntent] Parsed JSON: {parsed}")
+def _parse_meta_intent(resp) -> str:
+    raw = (getattr(resp, "content", "") or "").strip()
+    logger.debug("[MetaIntent] LLM raw = %s", raw)
 
-        model = MetaIntentModel.model_validate(parsed)
-        return model.intent
+    parsed = json.loads(raw)
+    logger.debug("[MetaIntent] Parsed JSON: %s", parsed)
+
+    model = MetaIntentModel.model_validate(parsed)
+    return model.intent
+
+def llm_detect_meta_intent(llm, user_text: str) -> str:
+    """For situations when a user enters a non-value during MANIFEST mode
+    Returns one of: HOW_MANY_LEFT, LIST_PLACEHOLDERS, HELP, CANCEL, OTHER"""
+    try:
+        return cached_invoke(llm, _meta_intent_prompt(user_text), "meta_intent", _parse_meta_intent)
     except Exception as e:
         # fallback in case of parsing failure or bad LLM output
-        logger.warning(f"[MetaIntent] Parsing failed: {e}")
+        logger.warning("[MetaIntent] Parsing failed: %s", e)
         return "OTHER"
 
-def llm_detect_meta_in_scenario_mode(llm, user_text: str) -> str:
-    """
-    Detects meta-intent in ASK_SCENARIO mode.
-    Returns one of: "HELP", "CANCEL", "OTHER"
-    """
+async def llm_detect_meta_intent_async(llm, user_text: str) -> str:
+    """Async variant of llm_detect_meta_intent"""
+    try:
+        return await cached_ainvoke(llm, _meta_intent_prompt(user_text), "meta_intent", _parse_meta_intent)
+    except Exception as e:
+        logger.warning("[MetaIntent] Parsing failed: %s", e)
+        return "OTHER"
 
-    prompt = f"""
+def _meta_in_scenario_prompt(user_text: str) -> str:
+    return f"""
     Ты - помощник, который классифицирует сообщения пользователя на этапе сбора сценария.
 
     Возможные категории:
@@ -165,37 +207,120 @@ def llm_detect_meta_in_scenario_mode(llm, user_text: str) -> str:
     Ответь только одной категорией: HELP, CANCEL или OTHER.
     """
 
-    try:
-        response = llm.invoke(prompt)
-        text = (getattr(response, "content", "") or "").strip().upper()
-
-        # Normalize result just in case
-        if "HELP" in text:
-            return "HELP"
-        elif "CANCEL" in text:
-            return "CANCEL"
-        else:
-            return "OTHER"
+def _parse_meta_in_scenario(response) -> str:
+    text = (getattr(response, "content", "") or "").strip().upper()
 
-    except Exception as e:
-        logger.warning(f"[llm_detect_meta_in_scenario_mode] Ошибка при вызове LLM: {e}")
+    # Normalize result just in case
+    if "HELP" in text:
+        return "HELP"
+    elif "CANCEL" in text:
+        return "CANCEL"
+    else:
         return "OTHER"
 
-def llm_detect_gibberish(llm, user_text: str) -> bool:
+def llm_detect_meta_in_scenario_mode(llm, user_text: str) -> str:
     """
-    Checks if the user's message is gibberish or meaningless.
-    Returns True if gibberish, False otherwise.
+    Detects meta-intent in ASK_SCENARIO mode.
+    Returns one of: "HELP", "CANCEL", "OTHER"
     """
-    prompt = f"""
+    try:
+        return cached_invoke(llm, _meta_in_scenario_prompt(user_text), "meta_in_scenario", _parse_meta_in_scenario)
+    except Exception as e:
+        logger.warning("[llm_detect_meta_in_scenario_mode] Ошибка при вызове LLM: %s", e)
+        return "OTHER"
+
+async def llm_detect_meta_in_scenario_mode_async(llm, user_text: str) -> str:
+    """Async variant of llm_detect_meta_in_scenario_mode"""
+    try:
+        return await cached_ainvoke(llm, _meta_in_scenario_prompt(user_text), "meta_in_scenario", _parse_meta_in_scenario)
+    except Exception as e:
+        logger.warning("[llm_detect_meta_in_scenario_mode] Ошибка при вызове LLM: %s", e)
+        return "OTHER"
+
+def _gibberish_prompt(user_text: str) -> str:
+    return f"""
     Ты полочаешь текст от пользователя: "{user_text}"
     Определи, является ли он осмысленным или это просто случайный набор символов.
 
     Ответь одним словом: TRUE если это абракадабра или бессмысленный текст, и FALSE в противном случае.
     """
 
+def _parse_gibberish(response) -> bool:
+    result = (getattr(response, "content", "") or "").strip().upper()
+    return result == "TRUE"
+
+def llm_detect_gibberish(llm, user_text: str) -> bool:
+    """
+    Checks if the user's message is gibberish or meaningless.
+    Returns True if gibberish, False otherwise.
+    """
+    try:
+        return cached_invoke(llm, _gibberish_prompt(user_text), "gibberish", _parse_gibberish)
+    except Exception:
+        return False
+
+async def llm_detect_gibberish_async(llm, user_text: str) -> bool:
+    """Async variant of llm_detect_gibberish"""
     try:
-        response = llm.invoke(prompt)
-        result = (getattr(response, "content", "") or "").strip().upper()
-        return result == "TRUE"
+        return await cached_ainvoke(llm, _gibberish_prompt(user_text), "gibberish", _parse_gibberish)
     except Exception:
         return False
+
+
+def _route_turn_prompt(text: str) -> str:
+    return f""" Ты - маршрутизатор запросов пользователя в ассистенте, который помогает сформировать манифесты для интеграции сервисов.
+    За один ответ выполни три шага.
+
+    1) Определи намерение пользователя:
+    - GET_MANIFESTS: запросил манифесты, yaml, интеграцию, сценарий и т.п.
+    - HELP: спрашивает, что ты умеешь, как с тобой работать, просит инструкцию по твоему использованию
+    - CHAT: любой другой запрос, который не требует манифестов
+
+    2) Перефразируй запрос в одно короткое и однозначное предложение, убери повторы и лишние слова.
+
+    3) Если намерение GET_MANIFESTS, определи, достаточно ли специфичен запрос, чтобы искать нужные манифесты.
+    Считай запрос достаточно специфичным, если он одновременно содержит:
+    1) "Явное упоминание istio/Istio/истио/Истио и"
+    2) "Конкретное название внешнего сервиса/БД/системы (например: secman, postgres, kafka, redis и т.д.)
+    Формулировки вида "Хочу...", "Нужны..." не влияют на специфичность."
+    Если запрос не специфичен - предложи 2-4 коротких уточняющих вопроса.
+
+    Верни строго JSON вида, ничего кроме JSON не добавляй:
+    {{
+        "intent": "GET_MANIFESTS|HELP|CHAT",
+        "is_specific": true|false,
+        "rephrased_query": "строка (может быть пустой)",
+        "followups": ["вопрос1", "вопрос2", ...]
+    }}
+
+    Пользователь: {text}
+    """
+
+def _parse_route(response) -> dict:
+    raw = (getattr(response, "content", "") or "").strip()
+    parsed = json.loads(raw)
+
+    model = TurnRouteModel.model_validate(parsed)
+    data = model.model_dump()
+
+    logger.info("[llm_route_turn] intent = %s, is_specific = %s", data["intent"], data["is_specific"])
+    return data
+
+def llm_route_turn(llm, text: str) -> Optional[dict]:
+    """
+    Classify intent, rephrase and assess specificity of a fresh message in one LLM call.
+    Returns None if the response can't be parsed, so the caller can fall back to separate calls
+    """
+    try:
+        return cached_invoke(llm, _route_turn_prompt(text), "route_turn", _parse_route)
+    except Exception as e:
+        logger.warning("[llm_route_turn] Не удалось разобрать ответ маршрутизатора: %s", e)
+        return None
+
+async def llm_route_turn_async(llm, text: str) -> Optional[dict]:
+    """Async variant of llm_route_turn"""
+    try:
+        return await cached_ainvoke(llm, _route_turn_prompt(text), "route_turn", _parse_route)
+    except Exception as e:
+        logger.warning("[llm_route_turn] Не удалось разобрать ответ маршрутизатора: %s", e)
+        return None
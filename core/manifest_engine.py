@@ -1,86 +1,102 @@
-import uuid
+import asyncio
 import logging
-from models import ChatResponse
+from models import ChatResponse, ManifestMatch, ManifestCandidate
 from typing import Optional
-from core.placeholder_engine import extract_placeholders, format_placeholder_list
+from core.placeholder_engine import format_placeholder_list
+from core.template_registry import template_registry, compile_template, Template
 from core.session_manager import SessionStore, SessionState
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type, wait_random_exponential
-from core.safe_llm import safe_llm_invoke
+from core.retriever import HybridRetriever, RetrievalResult, SIMILARITY_THRESHOLD
+from core.safe_llm import safe_llm_invoke, safe_llm_astream, run_blocking, cached_invoke, cached_ainvoke, response_text
 
 logger = logging.getLogger(__name__)
 
-SIMILARITY_THRESHOLD = 0.6
+def _search_error(reuse_session_id: Optional[str]) -> ChatResponse:
+    return ChatResponse(
+        intent="GET_MANIFESTS",
+        action="NONE",
+        suggested_payload=None,
+        reply="Произошла ошибка при поиске манифестов. Попробуйте другой запрос.",
+        session_id=reuse_session_id
+    )
 
-def start_manifest_flow_from_query(query: str, vector_store, llm, session_store: SessionStore, reuse_session_id: Optional[str] = None) -> ChatResponse:
+def _not_found(reuse_session_id: Optional[str]) -> ChatResponse:
+    return ChatResponse(
+        intent="GET_MANIFESTS",
+        action="NONE",
+        suggested_payload=None,
+        reply=("К сожалению, не удалось найти подходящий манифест. Попробуйте другой запрос.\n"),
+        session_id=reuse_session_id
+    )
+
+def _resolve_template(doc_source: str, fallback_text: Optional[str] = None) -> Optional[Template]:
     """
-    Perform vector search, extract placeholders, and initialize LLM-guided flow.
+    Registered template for the manifest source.
+    If the file is not in the registry, the text embedded in the index is compiled on the fly
     """
-    try:
-        results = vector_store.similarity_search_with_score(query, k=1)
-    except Exception as e:
-        logger.error(f"Произошла ошибка при поиске по векторной базе: {e}")
-        return ChatResponse(
-            intent="GET_MANIFESTS",
-            action="NONE",
-            suggested_payload=None,
-            reply="Произошла ошибка при поиске манифестов. Попробуйте другой запрос.",
-            session_id=reuse_session_id
-        )
+    template = template_registry.by_source(doc_source)
+    if template:
+        logger.debug("[MANIFEST_SEARCH] Selected manifest file: %s", doc_source)
+        return template
 
-    if not results:
-        return ChatResponse(
-            intent="GET_MANIFESTS",
-            action="NONE",
-            suggested_payload=None,
-            reply=("К сожалению, не удалось найти подходящий манифест. Попробуйте другой запрос.\n"),
-            session_id=reuse_session_id
-        )
+    if fallback_text is None:
+        logger.warning("Template %s is not in the registry", doc_source)
+        return None
+    logger.warning("Template %s is not in the registry, falling back to embedded text", doc_source)
+    return template_registry.intern(compile_template(doc_source, fallback_text))
 
-    matched_doc, raw_score = results[0]
-    print("Found document: %s, raw_score = %s", matched_doc.metadata, raw_score)
+def pick_manifest(result: RetrievalResult) -> Optional[Template]:
+    """Template of the best retrieval candidate, None if nothing is relevant enough"""
+    best = result.best
+    if not best:
+        return None
 
-    doc_source = matched_doc.metadata.get("source", "source unknown")
+    logger.debug("[MANIFEST_SEARCH] Found document: %s, score = %.4f", best.source, best.score)
+    return _resolve_template(best.source, best.document.page_content)
 
-    try:
-        with open(doc_source, encoding="utf-8") as f:
-            doc_text = f.read()
-        print(f"[MANIFEST_SEARCH] Selected manifest file: {doc_source}")
-    except Exception as e:
-        logger.warning(f"Failed to load raw YAML from {doc_source}, falling back to embedded text: {e}")
-        doc_text = matched_doc.page_content
+def _clarify(result: RetrievalResult, query: str, session_store: SessionStore, reuse_session_id: Optional[str]) -> ChatResponse:
+    """
+    Ask the user to choose between templates the retriever can't tell apart.
+    The answer goes through the ASK_SCENARIO flow together with the original request
+    """
+    session = session_store.get(reuse_session_id) if reuse_session_id else None
+    if session and session.mode == "ASK_SCENARIO":
+        session_id = reuse_session_id
+    else:
+        session_id = session_store.create(SessionState(mode="ASK_SCENARIO", collected_messages=(query,)), reuse_session_id)
 
-    similarity = 1 - raw_score
-    if similarity < SIMILARITY_THRESHOLD:
-        return ChatResponse(
-            intent="GET_MANIFESTS",
-            action="NONE",
-            suggested_payload=None,
-            reply=("К сожалению, не удалось найти подходящий манифест. Попробуйте другой запрос.\n"),
-            session_id=reuse_session_id
-        )
-    placeholders = extract_placeholders(doc_text)
-    first_placeholder = placeholders[0] if placeholders else None
-    placeholder_list = format_placeholder_list(placeholders)
-
-
-    state = SessionState(
-        mode="MANIFEST",
-        original_doc_text=doc_text,
-        remaining_placeholders=placeholders[1:] if first_placeholder else [],
-        filled_values={},
-        current_placeholder=first_placeholder,
-        source_file=doc_source
+    options = result.candidates[:2]
+    return ChatResponse(
+        intent="GET_MANIFESTS",
+        action="ASK_SCENARIO",
+        suggested_payload={"candidates": [{"source": c.source, "description": c.description} for c in options]},
+        reply=(
+            "Нашлось несколько похожих манифестов:\n"
+            + "\n".join(f"- {c.description}" for c in options)
+            + "\nУточните, какой из них вам нужен."
+        ),
+        session_id=session_id
     )
+
+def _prepare_session(template: Template, session_store: SessionStore, reuse_session_id: Optional[str]) -> tuple[ChatResponse, Optional[str], Optional[str]]:
+    """
+    Open a MANIFEST session for the matched template.
+    Returns (response, greeting_prompt, first_placeholder).
+    If greeting_prompt is None, response is final and no LLM call is needed
+    """
+    state = SessionState(mode="MANIFEST", template=template)
+    first_placeholder = state.current_placeholder
+    placeholder_list = format_placeholder_list(list(template.placeholders))
+
     session_id = session_store.create(state, reuse_session_id)
 
     if not first_placeholder:
-        return ChatResponse(
+        return (ChatResponse(
             intent="GET_MANIFESTS",
             action="NONE",
             suggested_payload=None,
             reply=("Манифест найден и не содержит параметров для заполнения."),
             session_id=session_id
-    )
+        ), None, None)
 
     prompt = (
         f"""Ты - ассистент, который помогает пользователю сформировать манифесты для интеграции сервисов.
@@ -90,20 +106,137 @@ def start_manifest_flow_from_query(query: str, vector_store, llm, session_store:
         Объясни его назначение и задай вопрос, чтобы получить значение."""
     )
 
-    try:
-        # llm_response = llm.invoke(prompt)
-        llm_response = safe_llm_invoke(llm, prompt)
-        ai_message = (getattr(llm_response, "content", "") or "").strip() or f"Введите значение для плейсхолдера {{{{first_placeholder}}}}:"
-    except Exception as e:
-        logger.warning(f"[MANIFEST_FLOW] Ошибка при обращении к LLM: {e}")
-        ai_message = f"Введите значение для плейсхолдера ${{{first_placeholder}}}:"
-    
     logger.info("[MANIFEST_FLOW] Новая сессия создана: %s", session_id)
 
-    return ChatResponse(
+    return (ChatResponse(
         intent="GET_MANIFESTS",
         action="NONE",
         suggested_payload=None,
-        reply=ai_message,
+        reply="",
         session_id=session_id
-    )
+    ), prompt, first_placeholder)
+
+def _greeting_fallback(first_placeholder: str) -> str:
+    return f"Введите значение для плейсхолдера ${{{first_placeholder}}}:"
+
+def _greet(llm, response: ChatResponse, prompt: str, first_placeholder: str) -> ChatResponse:
+    try:
+        greeting = cached_invoke(llm, prompt, "greeting", response_text, invoke=safe_llm_invoke)
+        response.reply = greeting or _greeting_fallback(first_placeholder)
+    except Exception as e:
+        logger.warning("[MANIFEST_FLOW] Ошибка при обращении к LLM: %s", e)
+        response.reply = _greeting_fallback(first_placeholder)
+    return response
+
+async def _greet_async(llm, response: ChatResponse, prompt: str, first_placeholder: str) -> ChatResponse:
+    try:
+        greeting = await cached_ainvoke(llm, prompt, "greeting", response_text, invoke=safe_llm_astream)
+        response.reply = greeting or _greeting_fallback(first_placeholder)
+    except Exception as e:
+        logger.warning("[MANIFEST_FLOW] Ошибка при обращении к LLM: %s", e)
+        response.reply = _greeting_fallback(first_placeholder)
+    return response
+
+def start_manifest_flow_from_query(query: str, retriever: HybridRetriever, llm, session_store: SessionStore, reuse_session_id: Optional[str] = None) -> ChatResponse:
+    """
+    Perform hybrid search, extract placeholders, and initialize LLM-guided flow.
+    """
+    try:
+        result = retriever.retrieve(query)
+    except Exception as e:
+        logger.error("Произошла ошибка при поиске по векторной базе: %s", e)
+        return _search_error(reuse_session_id)
+
+    if result.ambiguous:
+        return _clarify(result, query, session_store, reuse_session_id)
+    template = pick_manifest(result)
+    if not template:
+        return _not_found(reuse_session_id)
+
+    response, prompt, first_placeholder = _prepare_session(template, session_store, reuse_session_id)
+    if prompt is None:
+        return response
+    return _greet(llm, response, prompt, first_placeholder)
+
+async def start_manifest_flow_from_query_async(query: str, retriever: HybridRetriever, llm, session_store: SessionStore, reuse_session_id: Optional[str] = None) -> ChatResponse:
+    """
+    Async variant of start_manifest_flow_from_query.
+    Retrieval (remote embedding call) runs in the bounded pool, the greeting goes through ainvoke
+    """
+    try:
+        result = await run_blocking(retriever.retrieve, query)
+    except Exception as e:
+        logger.error("Произошла ошибка при поиске по векторной базе: %s", e)
+        return _search_error(reuse_session_id)
+
+    if result.ambiguous:
+        return await session_store.run(_clarify, result, query, session_store, reuse_session_id)
+    template = pick_manifest(result)
+    if not template:
+        return _not_found(reuse_session_id)
+
+    response, prompt, first_placeholder = await session_store.run(_prepare_session, template, session_store, reuse_session_id)
+    if prompt is None:
+        return response
+    return await _greet_async(llm, response, prompt, first_placeholder)
+
+async def start_manifest_flow_from_source_async(doc_source: str, llm, session_store: SessionStore, reuse_session_id: Optional[str] = None) -> ChatResponse:
+    """
+    Start the flow for an already resolved manifest file, skipping vector search
+    """
+    template = _resolve_template(doc_source)
+    if not template:
+        return _not_found(reuse_session_id)
+
+    response, prompt, first_placeholder = await session_store.run(_prepare_session, template, session_store, reuse_session_id)
+    if prompt is None:
+        return response
+    return await _greet_async(llm, response, prompt, first_placeholder)
+
+def _match(query: str, result: RetrievalResult) -> tuple[ManifestMatch, Optional[Template]]:
+    if result.ambiguous:
+        return ManifestMatch(
+            query=query,
+            status="AMBIGUOUS",
+            candidates=[ManifestCandidate(source=c.source, description=c.description) for c in result.candidates[:2]]
+        ), None
+
+    template = pick_manifest(result)
+    if not template:
+        return ManifestMatch(query=query, status="NOT_FOUND"), None
+
+    best = result.best
+    return ManifestMatch(
+        query=query,
+        status="FOUND",
+        manifest_id=template.id,
+        source=template.source,
+        score=best.score,
+        similarity=best.similarity,
+        placeholders=list(template.placeholders)
+    ), template
+
+async def _open_greeted_session(match: ManifestMatch, template: Template, llm, session_store: SessionStore) -> None:
+    response, prompt, first_placeholder = await session_store.run(_prepare_session, template, session_store, None)
+    if prompt is not None:
+        response = await _greet_async(llm, response, prompt, first_placeholder)
+    match.session_id = response.session_id
+    match.reply = response.reply
+
+async def resolve_manifests_async(queries: list[str], retriever: HybridRetriever, llm, session_store: SessionStore, greeting: bool = False) -> list[ManifestMatch]:
+    """
+    Match many queries at once: one embedding call and one vector search pass for all of them.
+    With greeting, a MANIFEST session is opened for every found manifest and the greetings are generated concurrently
+    """
+    try:
+        results = await run_blocking(retriever.retrieve_many, queries)
+    except Exception as e:
+        logger.error("Произошла ошибка при поиске по векторной базе: %s", e)
+        return [ManifestMatch(query=query, status="ERROR") for query in queries]
+
+    matches = [_match(query, result) for query, result in zip(queries, results)]
+    if greeting:
+        await asyncio.gather(*(
+            _open_greeted_session(match, template, llm, session_store) for match, template in matches if template is not None
+        ))
+    return [match for match, _ in matches]
@@ -0,0 +1,44 @@
+import re
+import time
+import tarfile
+from typing import Iterator
+from core.template_registry import Template, ManifestDocument, render_text
+
+# Rendered manifests are produced one document at a time,
+# so memory per render is bounded by the largest document, not by the whole bundle
+
+def _document_bytes(template: Template, document: ManifestDocument, values: dict[str, str]) -> bytes:
+    return (template.render_document(document, values).strip("\n") + "\n").encode("utf-8")
+
+def document_filename(document: ManifestDocument, index: int, values: dict[str, str]) -> str:
+    """File name for a rendered document, e.g. 03-gateway-egress-db-gw-db1.yaml"""
+    parts = [f"{index:02d}", document.kind.lower() or "document"]
+    name = render_text(document.name, values) if document.name else ""
+    if name:
+        parts.append(name)
+    return re.sub(r"[^\w.-]+", "_", "-".join(parts)) + ".yaml"
+
+def stream_yaml(template: Template, values: dict[str, str]) -> Iterator[bytes]:
+    """Multi-document YAML stream, documents separated by ---"""
+    for index, document in enumerate(template.documents):
+        if index:
+            yield b"---\n"
+        yield _document_bytes(template, document, values)
+
+def stream_tar(template: Template, values: dict[str, str]) -> Iterator[bytes]:
+    """Uncompressed tar stream with one file per Kubernetes resource under <template_id>/"""
+    mtime = int(time.time())
+    for index, document in enumerate(template.documents, start=1):
+        data = _document_bytes(template, document, values)
+
+        info = tarfile.TarInfo(f"{template.id}/{document_filename(document, index, values)}")
+        info.size = len(data)
+        info.mtime = mtime
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+
+        padding = -len(data) % tarfile.BLOCKSIZE
+        yield data + tarfile.NUL * padding
+
+    # End of archive: two zero blocks
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
@@ -1,34 +1,42 @@
-from core.llm_utils import llm_detect_meta_intent
+from core.llm_utils import llm_detect_meta_intent, llm_detect_meta_intent_async
+from core.safe_llm import cached_invoke, cached_ainvoke, response_text, safe_llm_astream
+from core.template_registry import render_text, PLACEHOLDER_PATTERN, PLACEHOLDER_TYPES
+from core.metrics import MANIFESTS_COMPLETED
+from core.session_manager import SessionStore
+from typing import Optional
 import re, logging
 
 logger = logging.getLogger(__name__)
 
-PLACEHOLDER_PATTERN = r"\{\{\s*\$(\w+)\s*\}\}" # {{ $dpPort1 }}
-
-PLACEHOLDER_TYPES = {
-    "secretServerHost": "str",
-    "egressLabel": "str",
-    "serverHostDB1": "str",
-    "serverHostDB1ip": "str",
-    "serverHostDB2": "str",
-    "serverHostDB2ip": "str",
-    "serverPort": "int",
-    "virtualPortDB1": "int",
-    "virtualPortDB2": "int",
-    "pathToCACert": "str",
-    "pathToCert": "str",
-    "pathToKey": "str"
+# Commands recognised without the LLM, keys are normalized with _normalize_command
+META_COMMANDS = {
+    "отмена": "CANCEL",
+    "отменить": "CANCEL",
+    "стоп": "CANCEL",
+    "выход": "CANCEL",
+    "закончить": "CANCEL",
+    "cancel": "CANCEL",
+    "список": "LIST_PLACEHOLDERS",
+    "list": "LIST_PLACEHOLDERS",
+    "сколько осталось": "HOW_MANY_LEFT",
+    "сколько": "HOW_MANY_LEFT",
+    "осталось": "HOW_MANY_LEFT",
+    "помощь": "HELP",
+    "справка": "HELP",
+    "help": "HELP",
+    "что ты умеешь": "HELP"
 }
 
 def extract_placeholders(yaml_text: str) -> list[str]:
     """Extract unique placeholders like {{ $dbPort1 }}."""
     return sorted(set(re.findall(PLACEHOLDER_PATTERN, yaml_text)))
 
-def fill_placeholders(yaml_text: str, values: dict[str, str]) -> str:
-    for key, value in values.items():
-        pattern = re.compile(r"\{\{\s*\$" + re.escape(key) + r"\s*\}\}")
-        yaml_text = pattern.sub(value, yaml_text)
-    return yaml_text
+def fill_placeholders(yaml_text: str, values: dict[str, str], strict: bool = False) -> str:
+    """
+    Substitute {{ $name }} with values in a single pass.
+    Unfilled placeholders are kept, strict=True raises MissingPlaceholdersError instead
+    """
+    return render_text(yaml_text, values, strict)
 
 def is_placeholder_valid(value: str, expected_type: str) -> bool:
     value = value.strip()
@@ -53,13 +61,99 @@ def is_placeholder_valid(value: str, expected_type: str) -> bool:
 
         return True
 
+def validate_values(template, values: dict[str, str], strict: bool = True) -> dict[str, str]:
+    """
+    Check a whole value set against the template without asking anything.
+    Returns placeholder -> error, empty if the values can be rendered
+    """
+    errors = {}
+    for name in template.placeholders:
+        value = values.get(name)
+        if value is None:
+            if strict:
+                errors[name] = "значение не задано"
+            continue
+        if not isinstance(value, str):
+            errors[name] = f"ожидает строку, получено {type(value).__name__}"
+            continue
+        expected_type = template.types.get(name, PLACEHOLDER_TYPES.get(name, "str"))
+        if not is_placeholder_valid(value, expected_type):
+            errors[name] = f"ожидает тип `{expected_type}`"
+    return errors
+
 def format_placeholder_list(placeholders: list[str]) -> str:
     """Formats a list of placeholders for printing."""
     if not placeholders:
         return "Найденные манифесты не содержат параметров для заполнения"
     return "Список параметров для заполнения:\n" + "\n".join(f"- ${name}" for name in placeholders)
 
-def handle_placeholder_reply(llm, session_id: str, sessions: dict, user_input: str) -> tuple[str, bool]:
+def _normalize_command(text: str) -> str:
+    """Lowercase, drop punctuation and extra spaces: ' Сколько  осталось?' -> 'сколько осталось'"""
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def detect_meta_intent_locally(user_input: str, expected_type: str) -> Optional[str]:
+    """
+    Rule tier in front of llm_detect_meta_intent.
+    Returns the intent for exact commands, "OTHER" for values that are valid for the expected type,
+    or None if the input is ambiguous and should go to the LLM
+    """
+    command = META_COMMANDS.get(_normalize_command(user_input))
+    if command:
+        return command
+
+    if is_placeholder_valid(user_input, expected_type):
+        return "OTHER"
+
+    return None
+
+def _handle_meta_intent(intent: str, session) -> tuple[str, bool]:
+    """Reply to a command entered instead of a placeholder value"""
+    logger.info("[MetaIntent] Detected: %s", intent)
+    if intent == "HOW_MANY_LEFT":
+        return (progress_text(session), False)
+    if intent == "LIST_PLACEHOLDERS":
+        return (list_placeholders_text(session), False)
+    if intent == "HELP":
+        return(
+            "Вы на этапе заполнения YAML-манифеста.\n"
+            "- Введите значение текущего плейсхолдера.\n"
+            "- Или напишите 'отмена' для выхода.\n"
+            "- Или напишите 'список' для просмотра всех плейсхолдеров.\n"
+            "- Или напишите 'сколько осталось' для просмотра количества оставшихся плейсхолдеров.\n",
+            False
+        )
+
+    if intent == "CANCEL":
+        # The caller ends the session
+        return ("Отменяю процесс. Вы можете начать заново", True)
+    return (f"Не удалось распознать команду. Попробуйте снова", False)
+
+def _accept_value(session, user_input: str) -> tuple[Optional[tuple[str, bool]], Optional[str]]:
+    """
+    Validate and save the value of the current placeholder.
+    Returns (None, next_placeholder) if the LLM should explain the next placeholder,
+    otherwise (reply, None) with the final reply
+    """
+    current_placeholder = session.current_placeholder
+    expected_type = PLACEHOLDER_TYPES.get(current_placeholder, "str")
+
+    if not is_placeholder_valid(user_input, expected_type):
+        return ((f"`{{{{ ${current_placeholder} }}}}` ожидает тип `{expected_type}`. Попробуйте снова:", False), None)
+
+    # Save the value of current placeholder
+    next_placeholder = session.accept(user_input)
+    if next_placeholder:
+        return (None, next_placeholder)
+
+    rendered = session.template.render(session.filled_values)
+    return (("Все значения заполнены! Итоговые манифесты:\n\n" + rendered, True), None)
+
+def _explain_placeholder_prompt(placeholder: str) -> str:
+    return f"Объясни значение плейсхолдера `{{{{ ${placeholder} }}}}` и попроси пользователя ввести значение."
+
+def handle_placeholder_reply(llm, session_id: str, sessions: SessionStore, user_input: str) -> tuple[str, bool]:
     """Shared logic for filling placeholders.
     Returns (reply_text, done).
     If done=True, session is complete and manifests are rendered"""
@@ -71,56 +165,62 @@ def handle_placeholder_reply(llm, session_id: str, sessions: dict, user_input: s
 
     user_input = user_input.strip()
 
-    current_placeholder = session.current_placeholder
-    expected_type = PLACEHOLDER_TYPES.get(current_placeholder, "str")
-
-    intent = llm_detect_meta_intent(llm, user_input)
-
+    expected_type = PLACEHOLDER_TYPES.get(session.current_placeholder, "str")
+    intent = detect_meta_intent_locally(user_input, expected_type) or llm_detect_meta_intent(llm, user_input)
     if intent != "OTHER":
-        logger.info(f"[MetaIntent] Detected: {intent}")
-        if intent == "HOW_MANY_LEFT":
-            return (progress_text(session), False)
-        if intent == "LIST_PLACEHOLDERS":
-            return (list_placeholders_text(session), False)
-        if intent == "HELP":
-            return(
-                "Вы на этапе заполнения YAML-манифеста.\n"
-                "- Введите значение текущего плейсхолдера.\n"
-                "- Или напишите 'отмена' для выхода.\n"
-                "- Или напишите 'список' для просмотра всех плейсхолдеров.\n"
-                "- Или напишите 'сколько осталось' для просмотра количества оставшихся плейсхолдеров.\n",
-                False
-            )
-
         if intent == "CANCEL":
             sessions.end(session_id)
-            return ("Отменяю процесс. Вы можете начать заново", True)
-        return (f"Не удалось распознать команду. Попробуйте снова", False)
+        return _handle_meta_intent(intent, session)
 
-    if not is_placeholder_valid(user_input, expected_type):
-        return (f"`{{{{ ${current_placeholder} }}}}` ожидает тип `{expected_type}`. Попробуйте снова:", False)
+    # Applied to the stored session atomically, another worker may be handling the same session
+    accepted = sessions.update(session_id, lambda state: _accept_value(state, user_input))
+    if accepted is None:
+        return ("Сессия не найдена. Начните новую сессию.", True)
+    reply, next_placeholder = accepted
+    if reply:
+        if reply[1]:
+            MANIFESTS_COMPLETED.inc()
+        return reply
+
+    try:
+        text = cached_invoke(llm, _explain_placeholder_prompt(next_placeholder), "placeholder_explanation", response_text)
+    except Exception:
+        text = f"Введите значение для ${{{next_placeholder}}}:"
+    return (text, False)
+
+async def handle_placeholder_reply_async(llm, session_id: str, sessions: SessionStore, user_input: str) -> tuple[str, bool]:
+    """Async variant of handle_placeholder_reply"""
+    session = await sessions.aget(session_id)
+    if not session:
+        return ("Сессия не найдена. Начните новую сессию.", True)
 
-    # Save the value of current placeholder
-    session.filled_values[current_placeholder] = user_input
-
-    if session.remaining_placeholders:
-        next_placeholder = session.remaining_placeholders.pop(0)
-        session.current_placeholder = next_placeholder
-
-        try:
-            prompt = f"Объясни значение плейсхолдера `{{{{ ${next_placeholder} }}}}` и попроси пользователя ввести значение."
-            response = llm.invoke(prompt)
-            text = (getattr(response, "content", "") or "").strip()
-        except Exception:
-            text = f"Введите значение для ${{{next_placeholder}}}:"
-        return (text, False)
-    
-    rendered = fill_placeholders(session.original_doc_text, session.filled_values)
-    pretty = f"Все значения заполнены. Итоговые манифесты:\n\n```yaml\n{rendered}\n```"
-    return ("Все значения заполнены! Итоговые манифесты:\n\n" + rendered, True)
+    user_input = user_input.strip()
+
+    expected_type = PLACEHOLDER_TYPES.get(session.current_placeholder, "str")
+    intent = detect_meta_intent_locally(user_input, expected_type) or await llm_detect_meta_intent_async(llm, user_input)
+    if intent != "OTHER":
+        if intent == "CANCEL":
+            await sessions.aend(session_id)
+        return _handle_meta_intent(intent, session)
+
+    # Applied to the stored session atomically, another worker may be handling the same session
+    accepted = await sessions.aupdate(session_id, lambda state: _accept_value(state, user_input))
+    if accepted is None:
+        return ("Сессия не найдена. Начните новую сессию.", True)
+    reply, next_placeholder = accepted
+    if reply:
+        if reply[1]:
+            MANIFESTS_COMPLETED.inc()
+        return reply
+
+    try:
+        text = await cached_ainvoke(llm, _explain_placeholder_prompt(next_placeholder), "placeholder_explanation", response_text, invoke=safe_llm_astream)
+    except Exception:
+        text = f"Введите значение для ${{{next_placeholder}}}:"
+    return (text, False)
 
 def progress_text(session: dict) -> str:
-    filled = len(session.filled_values)
+    filled = len(session.values)
     remaining = session.remaining_placeholders
     current = session.current_placeholder
 
@@ -128,14 +228,15 @@ def progress_text(session: dict) -> str:
 
     return f"""Вы заполнили {filled} из {total} полей.
            Осталось {total - filled}
-           Текущие плейсхолдеры: {', '.join([current] + remaining) if current else ', '.join(remaining) or 'Все заполнены!'}"""
+           Текущие плейсхолдеры: {', '.join([current, *remaining]) if current else ', '.join(remaining) or 'Все заполнены!'}"""
 
 def list_placeholders_text(session: dict) -> str:
-    placeholders = extract_placeholders(session.original_doc_text)
+    placeholders = session.template.placeholders if session.template else ()
+    filled_values = session.filled_values
     status_lines = []
     for placeholder in placeholders:
-        if placeholder in session.filled_values:
-            status_lines.append(f"- {placeholder} заполнен {session.filled_values[placeholder]}")
+        if placeholder in filled_values:
+            status_lines.append(f"- {placeholder} заполнен {filled_values[placeholder]}")
         else:
             status_lines.append(f"- {placeholder} не заполнен")
     return "Список всех плейсхолдеров:\n" + "\n".join(status_lines)
@@ -0,0 +1,197 @@
+import os
+import math
+import time
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Optional
+from core.keyword_router import KeywordRouter, normalize_terms
+from core.metrics import VECTOR_SEARCH_SECONDS, VECTOR_SEARCH_SIMILARITY
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_THRESHOLD = 0.6 # Min cosine similarity of a vector match
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_MIN_BM25 = float(os.getenv("RETRIEVAL_MIN_BM25", "1.0")) # Min BM25 score of a keyword match
+# Top two candidates are ambiguous if the second one's fused score is within this fraction of the first one's
+RETRIEVAL_AMBIGUITY_MARGIN = float(os.getenv("RETRIEVAL_AMBIGUITY_MARGIN", "0.01"))
+# ...or if their cosine similarities differ by less than this and keywords don't separate them either
+RETRIEVAL_SIMILARITY_MARGIN = float(os.getenv("RETRIEVAL_SIMILARITY_MARGIN", "0.02"))
+RRF_K = 60 # Reciprocal rank fusion constant, 1 / (RRF_K + rank)
+_SEARCH_SECONDS = VECTOR_SEARCH_SECONDS.labels("single")
+_BATCH_SEARCH_SECONDS = VECTOR_SEARCH_SECONDS.labels("batch")
+KEYWORD_ROUTING = os.getenv("KEYWORD_ROUTING", "true").lower() == "true"
+
+class BM25Index:
+    """Okapi BM25 over the description and keywords of the templates"""
+
+    def __init__(self, documents, k1: float = 1.5, b: float = 0.75):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self._term_freqs = [Counter(normalize_terms(self._text(doc))) for doc in self.documents]
+        self._lengths = [sum(tf.values()) for tf in self._term_freqs]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+
+        doc_freqs = Counter(term for tf in self._term_freqs for term in tf)
+        n = len(self.documents)
+        self._idf = {term: math.log((n - df + 0.5) / (df + 0.5) + 1) for term, df in doc_freqs.items()}
+
+    @staticmethod
+    def _text(doc) -> str:
+        return f"{doc.metadata.get('description', '')} {doc.metadata.get('keywords', '')}"
+
+    def search(self, query: str, k: int) -> list[tuple[Any, float]]:
+        """(document, score) of the k best matches with a positive score, best first"""
+        terms = [term for term in set(normalize_terms(query)) if term in self._idf]
+        if not terms:
+            return []
+
+        scored = []
+        for doc, tf, length in zip(self.documents, self._term_freqs, self._lengths):
+            score = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    norm = self.k1 * (1 - self.b + self.b * length / self._avg_length)
+                    score += self._idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            if score > 0:
+                scored.append((doc, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:k]
+
+@dataclass
+class Candidate:
+    document: Any
+    score: float = 0.0 # Fused reciprocal rank score
+    similarity: Optional[float] = None # Cosine similarity, None if not among the vector matches
+    bm25: float = 0.0
+
+    @property
+    def source(self) -> str:
+        return self.document.metadata.get("source", "source unknown")
+
+    @property
+    def description(self) -> str:
+        return self.document.metadata.get("description", self.source)
+
+    @property
+    def relevant(self) -> bool:
+        return (self.similarity is not None and self.similarity >= SIMILARITY_THRESHOLD) or self.bm25 >= RETRIEVAL_MIN_BM25
+
+@dataclass
+class RetrievalResult:
+    candidates: list[Candidate] # Relevant candidates, best first
+    ambiguous: bool = False # The top two are too close to pick one without asking the user
+    routed: bool = False # Picked by the keyword router, vector search was skipped
+
+    @property
+    def best(self) -> Optional[Candidate]:
+        return self.candidates[0] if self.candidates else None
+
+def _close(a: float, b: float, margin: float) -> bool:
+    return abs(a - b) <= margin * max(a, b)
+
+def is_ambiguous(first: Candidate, second: Candidate) -> bool:
+    if _close(first.score, second.score, RETRIEVAL_AMBIGUITY_MARGIN):
+        return True
+    # Near-identical templates (with/without ip) embed almost the same, rank fusion alone hides that
+    return (first.similarity is not None and second.similarity is not None
+            and abs(first.similarity - second.similarity) < RETRIEVAL_SIMILARITY_MARGIN
+            and _close(first.bm25, second.bm25, RETRIEVAL_AMBIGUITY_MARGIN))
+
+class HybridRetriever:
+    """
+    Vector search over the template embeddings combined with BM25 over their description and keywords.
+    Top-k of both are fused with reciprocal rank fusion.
+    Queries that name exactly one template by its keywords are answered by the keyword router alone
+    """
+
+    def __init__(self, vector_store, documents=(), top_k: int = RETRIEVAL_TOP_K, keyword_routing: bool = KEYWORD_ROUTING):
+        self.vector_store = vector_store
+        self.bm25 = BM25Index(documents)
+        self._by_source = {doc.metadata.get("source"): doc for doc in self.bm25.documents}
+        self.router = KeywordRouter(documents) if keyword_routing else None
+        self.top_k = top_k
+
+    def retrieve(self, query: str) -> RetrievalResult:
+        """Blocking unless routed by keywords: the vector search embeds the query with the remote model"""
+        routed = self._route(query)
+        if routed is not None:
+            return routed
+        started = time.perf_counter()
+        vector_hits = self.vector_store.similarity_search_with_score(query, k=self.top_k)
+        _SEARCH_SECONDS.observe(time.perf_counter() - started)
+        return self._fuse(query, vector_hits)
+
+    def retrieve_many(self, queries: list[str]) -> list[RetrievalResult]:
+        """
+        Blocking: retrieve for every query, in order.
+        Queries the keyword router can't answer are embedded in one call and searched in one pass
+        """
+        results: list[Optional[RetrievalResult]] = [None] * len(queries)
+        pending = []
+        for i, query in enumerate(queries):
+            results[i] = self._route(query)
+            if results[i] is None:
+                pending.append(i)
+
+        if pending:
+            started = time.perf_counter()
+            hits = self._vector_search_many([queries[i] for i in pending])
+            _BATCH_SEARCH_SECONDS.observe(time.perf_counter() - started)
+            for i, vector_hits in zip(pending, hits):
+                results[i] = self._fuse(queries[i], vector_hits)
+        return results
+
+    def _route(self, query: str) -> Optional[RetrievalResult]:
+        document = self.router.route(query) if self.router is not None else None
+        if document is None:
+            return None
+        return RetrievalResult([Candidate(document, score=1.0)], routed=True)
+
+    def _vector_search_many(self, queries: list[str]) -> list[list[tuple[Any, float]]]:
+        """(document, cosine distance) of the top-k vector matches of every query"""
+        embeddings = self.vector_store.embeddings
+        embed = getattr(embeddings, "embed_queries", embeddings.embed_documents)
+        vectors = embed(queries)
+
+        collection = getattr(self.vector_store, "_collection", None)
+        if collection is None:
+            return [self.vector_store.similarity_search_by_vector_with_relevance_scores(vector, k=self.top_k) for vector in vectors]
+
+        # Chroma answers all query embeddings in one request
+        found = collection.query(query_embeddings=vectors, n_results=self.top_k, include=["documents", "metadatas", "distances"])
+        return [
+            [(self._document(text, metadata), distance) for text, metadata, distance in zip(texts, metadatas, distances)]
+            for texts, metadatas, distances in zip(found["documents"], found["metadatas"], found["distances"])
+        ]
+
+    def _document(self, text: str, metadata: dict):
+        document = self._by_source.get(metadata.get("source"))
+        if document is None:
+            from langchain_core.documents import Document
+            document = Document(page_content=text or "", metadata=metadata or {})
+        return document
+
+    def _fuse(self, query: str, vector_hits: list[tuple[Any, float]]) -> RetrievalResult:
+        if vector_hits:
+            VECTOR_SEARCH_SIMILARITY.observe(1 - vector_hits[0][1])
+        keyword_hits = self.bm25.search(query, self.top_k)
+
+        candidates: dict[str, Candidate] = {}
+        for rank, (doc, distance) in enumerate(vector_hits, start=1):
+            candidate = candidates.setdefault(doc.metadata.get("source"), Candidate(doc))
+            candidate.similarity = 1 - distance
+            candidate.score += 1 / (RRF_K + rank)
+        for rank, (doc, score) in enumerate(keyword_hits, start=1):
+            candidate = candidates.setdefault(doc.metadata.get("source"), Candidate(doc))
+            candidate.bm25 = score
+            candidate.score += 1 / (RRF_K + rank)
+
+        ranked = sorted((c for c in candidates.values() if c.relevant), key=lambda c: c.score, reverse=True)
+        ambiguous = len(ranked) > 1 and is_ambiguous(ranked[0], ranked[1])
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[Retriever] %s", [(c.source, round(c.score, 4), c.similarity and round(c.similarity, 3), round(c.bm25, 2)) for c in ranked])
+        return RetrievalResult(ranked, ambiguous)
@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import logging
+import weakref
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import retry, stop_after_attempt, wait_random_exponential
+from core.llm_cache import llm_cache, cache_key, model_name, CachedResponse, LLM_CACHE_ENABLED
+from core.metrics import LLM_CALL_SECONDS, LLM_CALL_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Max number of LLM calls in flight at once (roughly, the number of connections to GigaChat)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Threads for other blocking calls: vector search, embeddings, session store and cache I/O
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "32"))
+
+# LLM clients that can't do async get a pool of their own, a burst of slow LLM calls
+# must not hold the threads that session and cache lookups wait for
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+
+# One semaphore per event loop: a semaphore is bound to the loop it first waits on,
+# and the bot runs messages on loops of their own
+_loop_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+_loop_slots_lock = threading.Lock()
+
+def _llm_slots() -> asyncio.Semaphore:
+    """LLM call slots of the running event loop"""
+    loop = asyncio.get_running_loop()
+    slots = _loop_slots.get(loop)
+    if slots is None:
+        with _loop_slots_lock:
+            slots = _loop_slots.setdefault(loop, asyncio.Semaphore(LLM_MAX_CONCURRENCY))
+    return slots
+
+_retry = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=0.5, max=4),
+    reraise=True
+)
+
+@_retry
+def safe_llm_invoke(llm, prompt: str):
+    """llm.invoke with retries on transient errors"""
+    return llm.invoke(prompt)
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call in the bounded I/O pool without freezing the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+async def llm_ainvoke(llm, prompt: str):
+    """
+    Async counterpart of llm.invoke.
+    Uses the client's native ainvoke if it has one, otherwise falls back to the LLM thread pool
+    """
+    async with _llm_slots():
+        ainvoke = getattr(llm, "ainvoke", None)
+        if callable(ainvoke):
+            return await ainvoke(prompt)
+        return await asyncio.get_running_loop().run_in_executor(_llm_executor, llm.invoke, prompt)
+
+@_retry
+async def safe_llm_ainvoke(llm, prompt: str):
+    """llm_ainvoke with retries on transient errors"""
+    return await llm_ainvoke(llm, prompt)
+
+# Where safe_llm_astream pushes tokens of the response being generated, set per request by streaming routes
+_token_sink: ContextVar[Optional[Callable[[str], None]]] = ContextVar("llm_token_sink", default=None)
+
+@contextmanager
+def stream_tokens_to(sink: Callable[[str], None]):
+    """Send tokens of user-facing LLM replies generated inside the block to sink"""
+    token = _token_sink.set(sink)
+    try:
+        yield
+    finally:
+        _token_sink.reset(token)
+
+async def safe_llm_astream(llm, prompt: str):
+    """
+    safe_llm_ainvoke that also pushes tokens to the sink set with stream_tokens_to while they are generated.
+    Without a sink, or for clients that can't stream, it is plain safe_llm_ainvoke.
+    A failed stream is retried as a plain call only if no token has been sent yet
+    """
+    sink = _token_sink.get()
+    astream = getattr(llm, "astream", None)
+    if sink is None or not callable(astream):
+        return await safe_llm_ainvoke(llm, prompt)
+
+    parts = []
+    try:
+        async with _llm_slots():
+            async for chunk in astream(prompt):
+                text = getattr(chunk, "content", "") or ""
+                if text:
+                    parts.append(text)
+                    sink(text)
+    except Exception as e:
+        if parts:
+            raise
+        logger.warning("[LLM] Не удалось получить потоковый ответ, повторяем обычным запросом: %s", e)
+        response = await safe_llm_ainvoke(llm, prompt)
+        text = getattr(response, "content", "") or ""
+        if text:
+            sink(text)
+        return response
+
+    return CachedResponse("".join(parts))
+
+def response_text(response) -> str:
+    """Text of an LLM response, empty string if there is none"""
+    return (getattr(response, "content", "") or "").strip()
+
+def _timed_invoke(invoke, llm, prompt: str, namespace: str):
+    """invoke(llm, prompt) recorded in the LLM latency histogram of namespace"""
+    started = time.perf_counter()
+    try:
+        return invoke(llm, prompt)
+    except Exception:
+        LLM_CALL_ERRORS.labels(namespace).inc()
+        raise
+    finally:
+        LLM_CALL_SECONDS.labels(namespace).observe(time.perf_counter() - started)
+
+async def _timed_ainvoke(invoke, llm, prompt: str, namespace: str):
+    started = time.perf_counter()
+    try:
+        return await invoke(llm, prompt)
+    except Exception:
+        LLM_CALL_ERRORS.labels(namespace).inc()
+        raise
+    finally:
+        LLM_CALL_SECONDS.labels(namespace).observe(time.perf_counter() - started)
+
+def cached_invoke(llm, prompt: str, namespace: str, parse, invoke=None):
+    """
+    Invoke the LLM and parse its response, serving repeated prompts from llm_cache.
+    A response is cached only after parse accepts it, so a bad LLM answer is never pinned.
+    invoke defaults to plain llm.invoke
+    """
+    invoke = invoke or (lambda llm, prompt: llm.invoke(prompt))
+    if not LLM_CACHE_ENABLED:
+        return parse(_timed_invoke(invoke, llm, prompt, namespace))
+
+    key = cache_key(model_name(llm), prompt)
+    content = llm_cache.get(namespace, key)
+    if content is not None:
+        return parse(CachedResponse(content))
+
+    response = _timed_invoke(invoke, llm, prompt, namespace)
+    result = parse(response)
+    content = getattr(response, "content", "")
+    if content:
+        llm_cache.set(namespace, key, content)
+    return result
+
+async def cached_ainvoke(llm, prompt: str, namespace: str, parse, invoke=None):
+    """Async variant of cached_invoke, invoke defaults to llm_ainvoke"""
+    invoke = invoke or llm_ainvoke
+    if not LLM_CACHE_ENABLED:
+        return parse(await _timed_ainvoke(invoke, llm, prompt, namespace))
+
+    key = cache_key(model_name(llm), prompt)
+    # The memory tier is answered inline, the SQLite tier is read in the pool; writes are batched by the cache
+    content = llm_cache.get(namespace, key, memory_only=True)
+    if content is None and llm_cache.persistent:
+        content = await run_blocking(llm_cache.get, namespace, key)
+    if content is not None:
+        return parse(CachedResponse(content))
+
+    response = await _timed_ainvoke(invoke, llm, prompt, namespace)
+    result = parse(response)
+    content = getattr(response, "content", "")
+    if content:
+        llm_cache.set(namespace, key, content)
+    return result
@@ -0,0 +1,77 @@
+import os
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Max cosine distance between a new query and a cached one to reuse the cached outcome
+SEMANTIC_CACHE_MAX_DISTANCE = float(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE", "0.05"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+
+@dataclass
+class ResolvedQuery:
+    """Outcome of the GET_MANIFESTS pipeline for one query"""
+    is_specific: bool
+    rephrased_query: str = ""
+    source: Optional[str] = None # Matched manifest file, None if the query was not specific
+    followups: list[str] = field(default_factory=list)
+
+class SemanticCache:
+    """
+    Query embedding -> resolved outcome.
+    Lookups are a single matrix-vector product over unit vectors, oldest entries are dropped first.
+    Near-identical phrasings may name different templates ("с ip" / "без ip"), so a hit also needs
+    the same normalized terms (stemmed, synonyms folded, stopwords dropped) as the cached query
+    """
+
+    def __init__(self, max_distance: float = SEMANTIC_CACHE_MAX_DISTANCE, max_entries: int = SEMANTIC_CACHE_SIZE):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._vectors: Optional[np.ndarray] = None
+        self._outcomes: list[ResolvedQuery] = []
+        self._terms: list[frozenset[str]] = [] # normalize_terms of each cached query
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def lookup(self, vector, terms: frozenset[str] = frozenset()) -> Optional[ResolvedQuery]:
+        with self._lock:
+            if self._vectors is None or not self._outcomes:
+                self.misses += 1
+                return None
+
+            similarities = self._vectors @ self._unit(vector)
+            close = np.flatnonzero(1 - similarities <= self.max_distance)
+            for i in close[np.argsort(-similarities[close])]:
+                if self._terms[i] == terms:
+                    self.hits += 1
+                    return self._outcomes[i]
+
+            self.misses += 1
+            return None
+
+    def add(self, vector, outcome: ResolvedQuery, terms: frozenset[str] = frozenset()) -> None:
+        row = self._unit(vector)[None, :]
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != row.shape[1]:
+                self._vectors, self._outcomes, self._terms = row, [outcome], [terms]
+                return
+            self._vectors = np.vstack([self._vectors, row])[-self.max_entries:]
+            self._outcomes = (self._outcomes + [outcome])[-self.max_entries:]
+            self._terms = (self._terms + [terms])[-self.max_entries:]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors, self._outcomes, self._terms = None, [], []
+
+semantic_cache = SemanticCache()
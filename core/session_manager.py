@@ -1,67 +1,502 @@
 from __future__ import annotations # Treat all type annotations in this file as strings behind the scenes, to avoid reference problems
-from typing import Dict, List, Optional, Literal
-from pydantic import BaseModel, Field # Function used to provide extra metadata, constraints, and validation rules to the fields of your BaseModel
+from typing import Any, Callable, Dict, List, Optional, Literal, TypeVar
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, replace
+from core.template_registry import template_registry, compile_template, Template
+from core.safe_llm import run_blocking
+import os
+import json
+import time
 import uuid
+import asyncio
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
 
 ModeType = Literal["ASK_SCENARIO", "MANIFEST"]
 
-class SessionState(BaseModel):
+# "memory" keeps sessions in the process (single worker only), "sqlite" also persists them across restarts,
+# "redis" shares them between workers and hosts
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "manifest-bot:")
+
+# A session not touched for SESSION_TTL_SECONDS is dropped; above SESSION_MAX_COUNT the least recently used one is evicted
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "60"))
+
+SESSION_COUNTERS = ("created", "ended", "expired", "evicted")
+
+T = TypeVar("T")
+
+@dataclass(slots=True)
+class SessionState:
+    """
+    Session record kept by the stores, API models are built from it only at the edge.
+    A MANIFEST session points at the shared interned Template instead of holding its text,
+    and tracks progress as a cursor into template.placeholders plus the values entered so far
+    """
     mode: ModeType
 
     # ASK_SCENARIO
-    collected_messages: List[str] = Field(default_factory=list)
-    
+    collected_messages: tuple[str, ...] = ()
+
     # MANIFEST
-    source_file: Optional[str] = None
-    original_doc_text: Optional[str] = None
-    docs_texts: Optional[List[str]] = None
-    
-    remaining_placeholders: List[str] = Field(default_factory=list)
-    filled_values: Dict[str, str] = Field(default_factory=dict)
-    current_placeholder: Optional[str] = None
-
-class SessionStore:
-    """Simple in-memory store (single-process)."""
-    
-    # _mem - private variable, Dict[str, SessionState] is a type hint
-    # meaning dictionary with str keys and values of type SessionState
-    def __init__(self): # Called when new instance of SessionStore is created
-        self._mem: Dict[str, SessionState] = {} 
-
-    # This signature says that reuse_session_id should be either provided string, or None will be returned as Default
-    # It is just a type hint not affecting program runtime
+    template: Optional[Template] = None
+    cursor: int = 0 # Index of the placeholder being asked, len(template.placeholders) once all are filled
+    values: tuple[str, ...] = () # values[i] is the value of template.placeholders[i]
+
+    @property
+    def template_id(self) -> Optional[str]:
+        return self.template.id if self.template else None
+
+    @property
+    def source_file(self) -> Optional[str]:
+        return self.template.source if self.template else None
+
+    @property
+    def original_doc_text(self) -> Optional[str]:
+        return self.template.text if self.template else None
+
+    @property
+    def current_placeholder(self) -> Optional[str]:
+        if self.template and self.cursor < len(self.template.placeholders):
+            return self.template.placeholders[self.cursor]
+        return None
+
+    @property
+    def remaining_placeholders(self) -> tuple[str, ...]:
+        """Placeholders after the current one"""
+        return self.template.placeholders[self.cursor + 1:] if self.template else ()
+
+    @property
+    def filled_values(self) -> Dict[str, str]:
+        return dict(zip(self.template.placeholders, self.values)) if self.template else {}
+
+    def add_message(self, message: str) -> None:
+        self.collected_messages += (message,)
+
+    def accept(self, value: str) -> Optional[str]:
+        """Store the value of the current placeholder and move on, returns the next placeholder or None if all are filled"""
+        self.values += (value,)
+        self.cursor += 1
+        return self.current_placeholder
+
+def dump_state(state: SessionState) -> bytes:
+    """
+    Compact serialized form of a session: short keys, defaults left out, the template as id and content hash.
+    A template compiled from the index text instead of a registry file also carries its source and text,
+    other workers and restarts have no file to find it by
+    """
+    data = {"m": state.mode}
+    if state.collected_messages:
+        data["c"] = state.collected_messages
+    if state.template:
+        data["t"] = (state.template.id, state.template.content_hash)
+        if template_registry.get(state.template.id) is not state.template:
+            data["s"] = (state.template.source, state.template.text)
+        data["i"] = state.cursor
+        if state.values:
+            data["v"] = state.values
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def load_state(raw: bytes | str) -> Optional[SessionState]:
+    """None if the session refers to a template this process doesn't have, e.g. one changed since the session started"""
+    data = json.loads(raw)
+    template = None
+    if "t" in data:
+        template_id, content_hash = data["t"]
+        template = template_registry.by_hash(content_hash)
+        if template is None and "s" in data:
+            template = template_registry.intern(compile_template(*data["s"]))
+        if template is None or template.content_hash != content_hash:
+            logger.warning("[STORE] Template %s (%s) of a stored session is not available", template_id, content_hash[:12])
+            return None
+    return SessionState(
+        mode=data["m"],
+        collected_messages=tuple(data.get("c", ())),
+        template=template,
+        cursor=data.get("i", 0),
+        values=tuple(data.get("v", ()))
+    )
+
+class SessionStore(ABC):
+    """
+    Interface of a session backend.
+    get() returns a snapshot: changes to it are kept only after save() or inside update().
+    Async code calls the a*() variants, which keep network round trips off the event loop
+    """
+
+    # True if calls may wait on the network: from async code they run in the thread pool
+    blocking_io = True
+
     def create(self, state: SessionState, reuse_session_id: Optional[str] = None) -> str:
         # If session is reused, essentially update its state
         if reuse_session_id:
-            print(f"[STORE] Reusing session_id: {reuse_session_id}")
-            self._mem[reuse_session_id] = state
+            logger.debug("[STORE] Reusing session_id: %s", reuse_session_id)
+            self.save(reuse_session_id, state)
             return reuse_session_id
         # If session is not reused, return a new session
         sid = str(uuid.uuid4())
-        print(f"[STORE] Creating new session_id: {sid}")
-        self._mem[sid] = state
+        logger.debug("[STORE] Creating new session_id: %s", sid)
+        self.save(sid, state)
+        self._count("created")
         return sid
-        
-    # Retrieve session data for given session_id
-    # -> Optional[SessionState] - return either a SessionState object 
-    # if session_id is found or None
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """Call func, a method of this store or a helper using it, from async code without blocking the event loop"""
+        if not self.blocking_io:
+            return func(*args)
+        return await run_blocking(func, *args)
+
+    async def acreate(self, state: SessionState, reuse_session_id: Optional[str] = None) -> str:
+        return await self.run(self.create, state, reuse_session_id)
+
+    async def aget(self, session_id: str) -> Optional[SessionState]:
+        return await self.run(self.get, session_id)
+
+    async def aupdate(self, session_id: str, mutate: Callable[[SessionState], T]) -> Optional[T]:
+        return await self.run(self.update, session_id, mutate)
+
+    async def aend(self, session_id: str) -> None:
+        await self.run(self.end, session_id)
+
+    @abstractmethod
+    def _count(self, counter: str, amount: int = 1) -> None:
+        ...
+
+    @abstractmethod
     def get(self, session_id: str) -> Optional[SessionState]:
-        return self._mem.get(session_id)
+        ...
 
+    @abstractmethod
     def save(self, session_id: str, state: SessionState) -> None:
-        self._mem[session_id] = state
+        ...
 
+    @abstractmethod
+    def update(self, session_id: str, mutate: Callable[[SessionState], T]) -> Optional[T]:
+        """
+        Atomically load the session, apply mutate to it and store the result.
+        Returns what mutate returned, None if there is no such session.
+        mutate may be called more than once if the session is changed concurrently, so it must not have side effects
+        """
+
+    @abstractmethod
     def end(self, session_id: str) -> None:
-        print(f"[STORE] Ending session: {session_id}")
-        self._mem.pop(session_id, None)
+        ...
 
+    @abstractmethod
     def list_ids(self) -> List[str]:
         """Return a list of all active session IDs (for debugging purposes)."""
-        return list(self._mem.keys())
 
+    @abstractmethod
     def clear(self) -> None:
         """Clear a list of all active session IDs (for debugging purposes)."""
-        self._mem.clear()
 
-    def get_latest_for_user(self, user_id: int) -> Optional[str]:
-        return self._user_to_session.get(user_id)
+    @abstractmethod
+    def bind_user(self, user_id: Any, session_id: Optional[str]) -> None:
+        """Remember the session a bot user is in, None forgets it"""
+
+    @abstractmethod
+    def get_latest_for_user(self, user_id: Any) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def reap(self) -> int:
+        """Drop sessions idle for longer than the TTL, returns how many were dropped"""
+
+    def close(self) -> None:
+        """Release resources on shutdown, e.g. flush pending writes"""
+        pass
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Live sessions and the created/ended/expired/evicted counters"""
+
+class InMemorySessionStore(SessionStore):
+    """
+    Simple in-memory store (single-process).
+    Sessions are kept in least recently used order, so both idle expiry and the size cap drop from the front
+    """
+
+    blocking_io = False
+
+    def __init__(self, ttl: int = SESSION_TTL_SECONDS, max_sessions: int = SESSION_MAX_COUNT): # Called when new instance of SessionStore is created
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # _mem - private variable, session_id -> (state, monotonic time of the last access)
+        self._mem: OrderedDict[str, tuple[SessionState, float]] = OrderedDict()
+        self._user_to_session: Dict[Any, str] = {}
+        self._counters = dict.fromkeys(SESSION_COUNTERS, 0)
+        self._lock = threading.RLock()
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        self._counters[counter] += amount
+
+    # Hooks for stores persisting sessions behind the in-memory one, called with the lock held
+
+    def _load(self, session_id: str) -> Optional[tuple[SessionState, float]]:
+        """(state, last access) of a session that is not in memory"""
+        return None
+
+    def _changed(self, session_id: str) -> None:
+        pass
+
+    def _dropped(self, session_id: str) -> None:
+        pass
+
+    def _user_changed(self, user_id: Any, session_id: Optional[str]) -> None:
+        pass
+
+    def _touch(self, session_id: str) -> Optional[SessionState]:
+        # Caller holds the lock
+        entry = self._mem.get(session_id) or self._load(session_id)
+        if entry is None:
+            return None
+        state, last_access = entry
+        now = time.monotonic()
+        if now - last_access > self.ttl:
+            self._mem.pop(session_id, None)
+            self._dropped(session_id)
+            self._count("expired")
+            return None
+        self._mem[session_id] = (state, now)
+        self._mem.move_to_end(session_id)
+        self._evict_over_cap() # A lazily loaded session may push the store over the cap
+        return state
+
+    # Retrieve session data for given session_id
+    # -> Optional[SessionState] - return either a SessionState object
+    # if session_id is found or None
+    def get(self, session_id: str) -> Optional[SessionState]:
+        with self._lock:
+            state = self._touch(session_id)
+            # A copy, like the other backends return: the stored session changes only through save() and update()
+            return replace(state) if state is not None else None
+
+    def save(self, session_id: str, state: SessionState) -> None:
+        with self._lock:
+            self._mem[session_id] = (state, time.monotonic())
+            self._mem.move_to_end(session_id)
+            self._changed(session_id)
+            self._evict_over_cap()
+
+    def _evict_over_cap(self) -> None:
+        # Caller holds the lock
+        while len(self._mem) > self.max_sessions:
+            session_id, _ = self._mem.popitem(last=False)
+            self._dropped(session_id)
+            self._count("evicted")
+
+    def update(self, session_id: str, mutate: Callable[[SessionState], T]) -> Optional[T]:
+        with self._lock:
+            state = self._touch(session_id)
+            if state is None:
+                return None
+            result = mutate(state)
+            self._changed(session_id)
+            return result
+
+    def end(self, session_id: str) -> None:
+        logger.debug("[STORE] Ending session: %s", session_id)
+        with self._lock:
+            if self._mem.pop(session_id, None) is not None:
+                self._count("ended")
+            self._dropped(session_id)
+
+    def list_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._mem.keys())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._user_to_session.clear()
+
+    def bind_user(self, user_id: Any, session_id: Optional[str]) -> None:
+        with self._lock:
+            if session_id:
+                self._user_to_session[user_id] = session_id
+            else:
+                self._user_to_session.pop(user_id, None)
+            self._user_changed(user_id, session_id)
+
+    def get_latest_for_user(self, user_id: Any) -> Optional[str]:
+        with self._lock:
+            session_id = self._user_to_session.get(user_id)
+            if session_id and session_id not in self._mem:
+                # The session expired or was evicted, drop the stale link too
+                del self._user_to_session[user_id]
+                return None
+            return session_id
+
+    def reap(self) -> int:
+        deadline = time.monotonic() - self.ttl
+        reaped = 0
+        with self._lock:
+            # Oldest access first: stop at the first session that is still alive
+            while self._mem:
+                session_id, (_, last_access) = next(iter(self._mem.items()))
+                if last_access > deadline:
+                    break
+                del self._mem[session_id]
+                self._dropped(session_id)
+                reaped += 1
+            self._count("expired", reaped)
+            stale_users = [user_id for user_id, session_id in self._user_to_session.items() if session_id not in self._mem]
+            for user_id in stale_users:
+                del self._user_to_session[user_id]
+        return reaped
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"live": len(self._mem), **self._counters}
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in Redis, shared by every worker and host.
+    client is anything speaking the redis-py API (redis.Redis, fakeredis.FakeRedis).
+    Session keys expire on their own after the idle TTL; a sorted set of last access times
+    enforces the size cap and lets reap() account for expired sessions
+    """
+
+    def __init__(self, client=None, url: str = REDIS_URL, prefix: str = REDIS_KEY_PREFIX,
+                 ttl: int = SESSION_TTL_SECONDS, max_sessions: int = SESSION_MAX_COUNT):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self._prefix = prefix
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._index = f"{prefix}sessions" # session_id -> time of the last access
+        self._counters = f"{prefix}session_counters"
+
+    def _key(self, session_id: str) -> str:
+        return f"{self._prefix}session:{session_id}"
+
+    def _user_key(self, user_id: Any) -> str:
+        return f"{self._prefix}user:{user_id}"
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        if amount:
+            self._client.hincrby(self._counters, counter, amount)
+
+    def _evict_over_cap(self) -> None:
+        excess = self._client.zcard(self._index) - self.max_sessions
+        if excess <= 0:
+            return
+        evicted = [_decode(member) for member, _ in self._client.zpopmin(self._index, excess)]
+        if evicted:
+            self._client.delete(*[self._key(session_id) for session_id in evicted])
+            self._count("evicted", len(evicted))
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        pipe = self._client.pipeline(transaction=False)
+        pipe.getex(self._key(session_id), ex=self.ttl) # Reading a session extends its TTL
+        pipe.zadd(self._index, {session_id: time.time()}, xx=True)
+        raw, _ = pipe.execute()
+        if raw is None:
+            # xx=True kept zadd from adding an unknown id; an id still indexed has just expired
+            if self._client.zrem(self._index, session_id):
+                self._count("expired")
+            return None
+        return load_state(raw)
+
+    def save(self, session_id: str, state: SessionState) -> None:
+        pipe = self._client.pipeline(transaction=False)
+        pipe.set(self._key(session_id), dump_state(state), ex=self.ttl)
+        pipe.zadd(self._index, {session_id: time.time()})
+        pipe.execute()
+        self._evict_over_cap()
+
+    def update(self, session_id: str, mutate: Callable[[SessionState], T]) -> Optional[T]:
+        from redis.exceptions import WatchError
+
+        key = self._key(session_id)
+        with self._client.pipeline() as pipe:
+            # Optimistic locking: if another worker writes the session between WATCH and EXEC, start over
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    state = load_state(raw) if raw is not None else None
+                    if state is None:
+                        pipe.unwatch()
+                        return None
+                    result = mutate(state)
+                    pipe.multi()
+                    pipe.set(key, dump_state(state), ex=self.ttl)
+                    pipe.zadd(self._index, {session_id: time.time()})
+                    pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+
+    def end(self, session_id: str) -> None:
+        logger.debug("[STORE] Ending session: %s", session_id)
+        pipe = self._client.pipeline(transaction=False)
+        pipe.delete(self._key(session_id))
+        pipe.zrem(self._index, session_id)
+        deleted, _ = pipe.execute()
+        if deleted:
+            self._count("ended")
+
+    def list_ids(self) -> List[str]:
+        return [_decode(member) for member in self._client.zrange(self._index, 0, -1)]
+
+    def clear(self) -> None:
+        keys = [self._index] + [_decode(key) for key in self._client.scan_iter(match=f"{self._prefix}session:*", count=500)]
+        keys += [_decode(key) for key in self._client.scan_iter(match=f"{self._prefix}user:*", count=500)]
+        self._client.delete(*keys)
+
+    def bind_user(self, user_id: Any, session_id: Optional[str]) -> None:
+        if session_id:
+            self._client.set(self._user_key(user_id), session_id, ex=self.ttl)
+        else:
+            self._client.delete(self._user_key(user_id))
+
+    def get_latest_for_user(self, user_id: Any) -> Optional[str]:
+        raw = self._client.get(self._user_key(user_id))
+        return _decode(raw) if raw is not None else None
+
+    def reap(self) -> int:
+        # The keys themselves are already gone, only the index entries and the counter are left to update
+        deadline = time.time() - self.ttl
+        reaped = self._client.zremrangebyscore(self._index, "-inf", deadline)
+        self._count("expired", reaped)
+        return reaped
+
+    def stats(self) -> Dict[str, int]:
+        counters = {_decode(name): int(value) for name, value in self._client.hgetall(self._counters).items()}
+        return {"live": self._client.zcard(self._index), **{name: counters.get(name, 0) for name in SESSION_COUNTERS}}
+
+def _decode(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+async def run_session_reaper(store: SessionStore, interval: float = SESSION_REAP_INTERVAL) -> None:
+    """Background task dropping idle sessions every interval seconds, until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            reaped = await asyncio.to_thread(store.reap)
+            if reaped:
+                logger.info("[STORE] Reaped idle sessions: %s", reaped)
+        except Exception as e:
+            logger.warning("[STORE] Session reaper failed: %s", e)
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    """Session store selected by SESSION_BACKEND, shared setup for app.py and main.py"""
+    if backend == "redis":
+        logger.info("[STORE] Sessions are kept in Redis: %s", REDIS_URL)
+        return RedisSessionStore()
+    if backend == "sqlite":
+        from core.session_persistence import SQLiteSessionStore, SESSION_DB_PATH
+        logger.info("[STORE] Sessions are kept in memory and persisted to %s", SESSION_DB_PATH)
+        return SQLiteSessionStore()
+    if backend != "memory":
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+    return InMemorySessionStore()
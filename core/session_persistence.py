@@ -0,0 +1,171 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Optional
+from core.session_manager import InMemorySessionStore, SessionState, dump_state, load_state, SESSION_TTL_SECONDS, SESSION_MAX_COUNT
+
+logger = logging.getLogger(__name__)
+
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "./sessions.db")
+# How often dirty sessions are written out; a crash loses at most this much of the latest turns
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1.0"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    state BLOB NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_users (
+    user_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL
+);
+"""
+
+class SQLiteSessionStore(InMemorySessionStore):
+    """
+    In-memory session store backed by SQLite, so sessions survive restarts.
+    Turns only mark sessions dirty; a background thread writes them out in batches (write-behind).
+    After a restart a session is read from disk on first access to its id
+    """
+
+    # A lazy load or user lookup is a SELECT under the store lock and may wait behind a flush,
+    # so async callers go through the pool like with Redis
+    blocking_io = True
+
+    def __init__(self, path: str = SESSION_DB_PATH, flush_interval: float = SESSION_FLUSH_INTERVAL,
+                 ttl: int = SESSION_TTL_SECONDS, max_sessions: int = SESSION_MAX_COUNT):
+        super().__init__(ttl=ttl, max_sessions=max_sessions)
+        self.path = path
+        self.flush_interval = flush_interval
+        # Ids written or deleted since the last flush; the current state is taken from memory at flush time
+        self._dirty: set[str] = set()
+        self._dirty_users: dict[str, Optional[str]] = {}
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self._flusher.start()
+
+    # Hooks of InMemorySessionStore, called with self._lock held
+
+    def _load(self, session_id: str) -> Optional[tuple[SessionState, float]]:
+        if session_id in self._dirty:
+            return None # Dropped in memory, the delete is not flushed yet
+        with self._db_lock:
+            row = self._db.execute("SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        state = load_state(row[0])
+        if state is None:
+            return None
+        # Wall clock time of the last write, as a monotonic timestamp for the TTL check
+        return (state, time.monotonic() - (time.time() - row[1]))
+
+    def _changed(self, session_id: str) -> None:
+        self._dirty.add(session_id)
+
+    def _dropped(self, session_id: str) -> None:
+        self._dirty.add(session_id)
+
+    def _user_changed(self, user_id: Any, session_id: Optional[str]) -> None:
+        self._dirty_users[str(user_id)] = session_id
+
+    def get_latest_for_user(self, user_id: Any) -> Optional[str]:
+        with self._lock:
+            session_id = self._user_to_session.get(user_id)
+            if session_id is None and str(user_id) not in self._dirty_users:
+                with self._db_lock:
+                    row = self._db.execute("SELECT session_id FROM session_users WHERE user_id = ?", (str(user_id),)).fetchone()
+                if row:
+                    session_id = self._user_to_session[user_id] = row[0]
+            # The link may outlive its session, callers check the session itself
+            return session_id
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+            self._dirty.clear()
+            self._dirty_users.clear()
+            with self._db_lock, self._db:
+                self._db.execute("DELETE FROM sessions")
+                self._db.execute("DELETE FROM session_users")
+
+    def reap(self) -> int:
+        reaped = super().reap()
+
+        # Sessions that were never loaded back after a restart only exist on disk
+        deadline = time.time() - self.ttl
+        with self._db_lock:
+            stale = [row[0] for row in self._db.execute("SELECT session_id FROM sessions WHERE updated_at < ?", (deadline,))]
+        with self._lock:
+            # Sessions in memory may have been read since their last write, the in-memory reap above decides for them
+            stale = [session_id for session_id in stale if session_id not in self._mem and session_id not in self._dirty]
+            self._count("expired", len(stale))
+        if stale:
+            with self._db_lock, self._db:
+                self._db.executemany("DELETE FROM sessions WHERE session_id = ?", [(session_id,) for session_id in stale])
+                self._db.execute("DELETE FROM session_users WHERE session_id NOT IN (SELECT session_id FROM sessions)")
+        return reaped + len(stale)
+
+    def flush(self) -> int:
+        """Write dirty sessions out in one transaction, returns how many rows were written or deleted"""
+        with self._lock:
+            if not self._dirty and not self._dirty_users:
+                return 0
+            dirty, self._dirty = self._dirty, set()
+            dirty_users, self._dirty_users = self._dirty_users, {}
+            now = time.time()
+            upserts, deletes = [], []
+            for session_id in dirty:
+                entry = self._mem.get(session_id)
+                if entry is None:
+                    deletes.append((session_id,))
+                else:
+                    upserts.append((session_id, dump_state(entry[0]), now - (time.monotonic() - entry[1])))
+
+        try:
+            with self._db_lock, self._db:
+                self._db.executemany(
+                    "INSERT INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    upserts
+                )
+                self._db.executemany("DELETE FROM sessions WHERE session_id = ?", deletes)
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO session_users (user_id, session_id) VALUES (?, ?)",
+                    [(user_id, session_id) for user_id, session_id in dirty_users.items() if session_id]
+                )
+                self._db.executemany(
+                    "DELETE FROM session_users WHERE user_id = ?",
+                    [(user_id,) for user_id, session_id in dirty_users.items() if not session_id]
+                )
+        except sqlite3.Error as e:
+            logger.warning("[STORE] Не удалось сохранить сессии в %s, повторим позже: %s", self.path, e)
+            with self._lock:
+                self._dirty |= dirty
+                for user_id, session_id in dirty_users.items():
+                    self._dirty_users.setdefault(user_id, session_id)
+            return 0
+
+        return len(upserts) + len(deletes)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        """Stop the background thread and write out what is still pending"""
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
@@ -0,0 +1,280 @@
+import os
+import re
+import glob
+import hashlib
+import logging
+import threading
+from time import perf_counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterator, NamedTuple, Optional
+from core.metrics import RENDER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MANIFESTS_DIR = "manifests"
+
+PLACEHOLDER_PATTERN = r"\{\{\s*\$(\w+)\s*\}\}" # {{ $dpPort1 }}
+
+PLACEHOLDER_TYPES = {
+    "secretServerHost": "str",
+    "egressLabel": "str",
+    "serverHostDB1": "str",
+    "serverHostDB1ip": "str",
+    "serverHostDB2": "str",
+    "serverHostDB2ip": "str",
+    "serverPort": "int",
+    "virtualPortDB1": "int",
+    "virtualPortDB2": "int",
+    "pathToCACert": "str",
+    "pathToCert": "str",
+    "pathToKey": "str"
+}
+
+_PLACEHOLDER_RE = re.compile(PLACEHOLDER_PATTERN)
+
+class MissingPlaceholdersError(KeyError):
+    """Raised by a strict render when some placeholders have no value"""
+
+    def __init__(self, missing: list[str]):
+        super().__init__(missing)
+        self.missing = missing
+
+    def __str__(self) -> str:
+        return "Не заданы значения плейсхолдеров: " + ", ".join(self.missing)
+
+_TOP_LEVEL_KEY_RE = re.compile(r"([A-Za-z_][\w.-]*)[ \t]*:")
+_KIND_RE = re.compile(r"^kind:[ \t]*(\S+)", re.M)
+
+class PlaceholderSlot(NamedTuple):
+    """One occurrence of {{ $name }} in the template text, [start, end) offsets"""
+    name: str
+    start: int
+    end: int
+
+class ManifestDocument(NamedTuple):
+    """One YAML document of a template: text[start:end] holding slots[first_slot:last_slot]"""
+    start: int
+    end: int
+    first_slot: int
+    last_slot: int
+    kind: str
+    name: str # metadata.name as written in the template, may contain placeholders
+
+@dataclass(frozen=True)
+class Template:
+    id: str # File name without extension, e.g. "istio_postgres_se"
+    source: str # Path as stored in document metadata, e.g. "manifests/istio_postgres_se.yaml"
+    text: str
+    content_hash: str
+    placeholders: tuple[str, ...] # Unique names, sorted (the order placeholders are asked in)
+    slots: tuple[PlaceholderSlot, ...] # Every occurrence, in text order
+    types: dict[str, str] # Expected type per placeholder, see PLACEHOLDER_TYPES
+    # Render plan: literal text around the slots, len(literals) == len(slots) + 1
+    literals: tuple[str, ...]
+    documents: tuple[ManifestDocument, ...]
+
+    def missing(self, values: dict[str, str]) -> list[str]:
+        """Placeholders without a value, in the order they are asked in"""
+        return [name for name in self.placeholders if name not in values]
+
+    def render(self, values: dict[str, str], strict: bool = False) -> str:
+        """
+        Substitute values in one pass over the precomputed segments.
+        Placeholders without a value stay as they are, or raise MissingPlaceholdersError if strict.
+        Values are inserted verbatim, nothing in them is interpreted
+        """
+        if strict:
+            missing = self.missing(values)
+            if missing:
+                raise MissingPlaceholdersError(missing)
+
+        started = perf_counter()
+        text, literals = self.text, self.literals
+        parts = [literals[0]]
+        for slot, literal in zip(self.slots, literals[1:]):
+            value = values.get(slot.name)
+            parts.append(text[slot.start:slot.end] if value is None else value)
+            parts.append(literal)
+        rendered = "".join(parts)
+        RENDER_SECONDS.observe(perf_counter() - started)
+        return rendered
+
+    def iter_render(self, values: dict[str, str], document: Optional[ManifestDocument] = None) -> Iterator[str]:
+        """Rendered text of the whole template or of one document, piece by piece"""
+        if document is None:
+            start, end, first_slot, last_slot = 0, len(self.text), 0, len(self.slots)
+        else:
+            start, end, first_slot, last_slot = document[:4]
+
+        text = self.text
+        position = start
+        for slot in self.slots[first_slot:last_slot]:
+            yield text[position:slot.start]
+            value = values.get(slot.name)
+            yield text[slot.start:slot.end] if value is None else value
+            position = slot.end
+        yield text[position:end]
+
+    def render_document(self, document: ManifestDocument, values: dict[str, str]) -> str:
+        return "".join(self.iter_render(values, document))
+
+def _metadata_name(document_text: str) -> str:
+    """metadata.name of a YAML document, found without parsing (the text may hold placeholders)"""
+    lines = iter(document_text.splitlines())
+    for line in lines:
+        if line.rstrip() == "metadata:":
+            break
+    indent = None
+    for line in lines:
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        current = len(line) - len(line.lstrip())
+        if current == 0:
+            break
+        if indent is None:
+            indent = current
+        key, _, value = line.strip().partition(":")
+        if current == indent and key == "name":
+            return value.strip().strip("\"'")
+    return ""
+
+def _split_documents(text: str, slots: list[PlaceholderSlot]) -> tuple[ManifestDocument, ...]:
+    """
+    Split a template into YAML documents.
+    A document ends at a "---" line or where one of its top-level keys appears again,
+    since some templates list resources one after another without separators
+    """
+    bounds = []
+    start = position = 0
+    keys = set()
+    for line in text.splitlines(keepends=True):
+        if line.rstrip() == "---" or line.startswith("--- "):
+            bounds.append((start, position))
+            start = position + len(line)
+            keys = set()
+        else:
+            match = _TOP_LEVEL_KEY_RE.match(line)
+            if match:
+                if match.group(1) in keys:
+                    bounds.append((start, position))
+                    start = position
+                    keys = set()
+                keys.add(match.group(1))
+        position += len(line)
+    bounds.append((start, len(text)))
+
+    documents = []
+    slot_index = 0
+    for start, end in bounds:
+        first_slot = slot_index
+        while slot_index < len(slots) and slots[slot_index].start < end:
+            slot_index += 1
+        document_text = text[start:end]
+        if not any(line.strip() and not line.lstrip().startswith("#") for line in document_text.splitlines()):
+            continue
+        kind = _KIND_RE.search(document_text)
+        documents.append(ManifestDocument(
+            start, end, first_slot, slot_index,
+            kind.group(1) if kind else "",
+            _metadata_name(document_text)
+        ))
+    return tuple(documents)
+
+def compile_template(source: str, text: str) -> Template:
+    """Scan the text once and precompute everything the engines need"""
+    slots = []
+    literals = []
+    last = 0
+    for match in _PLACEHOLDER_RE.finditer(text):
+        slots.append(PlaceholderSlot(match.group(1), match.start(), match.end()))
+        literals.append(text[last:match.start()])
+        last = match.end()
+    literals.append(text[last:])
+
+    placeholders = tuple(sorted({slot.name for slot in slots}))
+    return Template(
+        id=os.path.splitext(os.path.basename(source))[0],
+        source=source,
+        text=text,
+        content_hash=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        placeholders=placeholders,
+        slots=tuple(slots),
+        types={name: PLACEHOLDER_TYPES.get(name, "str") for name in placeholders},
+        literals=tuple(literals),
+        documents=_split_documents(text, slots)
+    )
+
+@lru_cache(maxsize=256)
+def compile_text(text: str) -> Template:
+    """Compiled template for arbitrary text, e.g. a manifest that is not in the registry"""
+    return compile_template("", text)
+
+def render_text(text: str, values: dict[str, str], strict: bool = False) -> str:
+    """Render text with values, tokenizing each distinct text only once"""
+    return compile_text(text).render(values, strict)
+
+class TemplateRegistry:
+    """
+    Every manifest template, read and compiled once.
+    Lookups by id or by source path are dict lookups, no disk I/O
+    """
+
+    def __init__(self, directory: str = MANIFESTS_DIR):
+        self.directory = directory
+        self._by_id: dict[str, Template] = {}
+        self._by_source: dict[str, Template] = {}
+        # Intern table: content hash -> the one shared Template with that text
+        self._by_hash: dict[str, Template] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> "TemplateRegistry":
+        by_id, by_source = {}, {}
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.yaml"))):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    template = compile_template(path, f.read())
+            except OSError as e:
+                logger.warning("[TemplateRegistry] Не удалось прочитать шаблон %s: %s", path, e)
+                continue
+            by_id[template.id] = template
+            by_source[os.path.normpath(path)] = template
+
+        with self._lock:
+            self._by_id, self._by_source = by_id, by_source
+            for template in by_id.values():
+                self._by_hash[template.content_hash] = template
+            self._loaded = True
+        logger.info("[TemplateRegistry] Загружено шаблонов: %d", len(by_id))
+        return self
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            with self._lock:
+                loaded = self._loaded
+            if not loaded:
+                self.load()
+
+    def get(self, template_id: str) -> Optional[Template]:
+        self._ensure_loaded()
+        return self._by_id.get(template_id)
+
+    def by_source(self, source: str) -> Optional[Template]:
+        self._ensure_loaded()
+        return self._by_source.get(os.path.normpath(source))
+
+    def by_hash(self, content_hash: str) -> Optional[Template]:
+        self._ensure_loaded()
+        return self._by_hash.get(content_hash)
+
+    def intern(self, template: Template) -> Template:
+        """Shared instance for the template's text, so sessions never keep their own copy of it"""
+        with self._lock:
+            return self._by_hash.setdefault(template.content_hash, template)
+
+    def ids(self) -> list[str]:
+        self._ensure_loaded()
+        return list(self._by_id)
+
+template_registry = TemplateRegistry()
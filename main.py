@@ -2,6 +2,7 @@ import os
 import uvicorn
 import logging
 import asyncio
+from contextlib import asynccontextmanager
 
 from dialog_bot_sdk.bot import DialogBot
 from dialog_bot_sdk.entities.messaging import CommandHandler, MessageHandler, UpdateMessage, MessageContentType
@@ -9,8 +10,9 @@ from dialog_bot_sdk.entities.messaging import CommandHandler, MessageHandler, Up
 from fastapi import FastAPI
 
 # Import LLM-bot components
-from core.config import llm, vector_store
-from core.session_manager import SessionStore
+from core.config import warm_up, get_llm, get_vector_store, get_retriever
+from core.session_manager import create_session_store, run_session_reaper
+from core.logging_config import setup_logging
 from models import ChatRequest
 from routes.chat import chat as chat_handler
 import routes.chat as chat
@@ -29,19 +31,31 @@ bot_config = {
     }
 }
 
+setup_logging()
 logger = logging.getLogger(__name__)
 
 bot = DialogBot.create_bot(bot_config)
 
-# Inject dependencies. Same as in app.py
-session_store = SessionStore()
-chat.llm = llm
-chat.vector_store = vector_store
-chat.session_store = session_store
+session_store = create_session_store()
 
-peer_sessions = {}
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The bot is useless without LLM clients and the index, so wait for them before polling updates
+    await asyncio.to_thread(warm_up)
 
-app = FastAPI()
+    # Inject dependencies. Same as in app.py
+    chat.llm = get_llm()
+    chat.vector_store = get_vector_store()
+    chat.retriever = get_retriever()
+    chat.session_store = session_store
+
+    reaper_task = asyncio.create_task(run_session_reaper(session_store))
+    bot.updates.on_updates(do_read_messages=True, do_register_commands=True,in_thread=True)
+    yield
+    reaper_task.cancel()
+    session_store.close()
+
+app = FastAPI(lifespan=lifespan)
 
 def start(message: UpdateMessage) -> None:
     # Метод срабатывает при выполнении команды /start в окне бота
@@ -71,32 +85,21 @@ async def text(message: UpdateMessage) -> None:
    
     # session_id = None
     # prior_session_id = peer_sessions.get(user_id)
-    prior_session_id = session_store.get_latest_for_user(user_id)
+    prior_session_id = await session_store.run(session_store.get_latest_for_user, user_id)
     
-    print(f"[MAIN] user_id = {user_id}, peer_sessions = {peer_sessions}")
-
-    if prior_session_id and session_store.get(prior_session_id):
-        print(f"[DEBUG] Using session: {prior_session_id}")
+    if prior_session_id and await session_store.aget(prior_session_id):
         session_id = prior_session_id
     else:
-        print(f"[DEBUG] No valid session for user {user_id}")
         session_id = None
 
-    print(f"[MAIN] Incoming message from {user_id}: {user_text}")
-    print(f"[MAIN] peer_sessions BEFORE: {peer_sessions}")
-    print(f"[MAIN] Prior session_id used in ChatRequest: {session_id}")
+    logger.debug("[MAIN] Incoming message from %s (%d chars), session_id = %s, prior = %s", user_id, len(user_text), session_id, prior_session_id)
 
     chat_request = ChatRequest(message=user_text, session_id=session_id)
     chat_response = await chat_handler(chat_request)
 
-    print(f"[MAIN] chat_response.session_id = {chat_response.session_id}")
-
-    if chat_response.session_id:
-        peer_sessions[user_id] = chat_response.session_id
-        print(f"[MAIN] Updated session for {user_id}: {chat_response.session_id}")
-    else:
-        peer_sessions.pop(user_id, None)
-        print(f"[MAIN] Cleared session for {user_id}")
+    # Kept in the session store, so any worker can pick up the user's next message
+    await session_store.run(session_store.bind_user, user_id, chat_response.session_id)
+    logger.debug("[MAIN] Session of %s: %s", user_id, chat_response.session_id)
 
     bot.messaging.send_message(
         message.peer,
@@ -106,7 +109,5 @@ async def text(message: UpdateMessage) -> None:
 bot.messaging.command_handler([CommandHandler(start, "start", description="Расскажу о себе")])   
 bot.messaging.message_handler([MessageHandler(sync_text_wrapper, MessageContentType.TEXT_MESSAGE)])
 
-bot.updates.on_updates(do_read_messages=True, do_register_commands=True,in_thread=True)
-
 if __name__ == '__main__':
-    uvicorn.run("main:app", host="0.0.0.0", port=5001, log_level="info") # filename:fastapi app instance
+    uvicorn.run("main:app", host="0.0.0.0", port=5001, log_level="info", log_config=None) # filename:fastapi app instance
@@ -1,10 +1,45 @@
-from pydantic import BaseModel
-from typing import Optional, Literal
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional, Literal
+from enum import Enum
+
+# Conversation intents
+class Intent(str, Enum):
+    GET_MANIFESTS = "GET_MANIFESTS"
+    HELP = "HELP"
+    CHAT = "CHAT"
+    CANCEL = "CANCEL"
 
 # User request body in POST /get_manifests
 class QueryRequest(BaseModel):
     query: str
 
+# User request body in POST /get_manifests/batch
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(min_length=1, max_length=100)
+    greeting: bool = False # Open a session per found manifest and greet with its first placeholder, one LLM call each
+
+# Template candidate of a query that matched several templates equally well
+class ManifestCandidate(BaseModel):
+    source: str
+    description: str
+
+# Outcome of one query in POST /get_manifests/batch
+class ManifestMatch(BaseModel):
+    query: str
+    status: Literal["FOUND", "AMBIGUOUS", "NOT_FOUND", "ERROR"]
+    manifest_id: Optional[str] = None # Template id, e.g. "postgres_with_ip"
+    source: Optional[str] = None # Template file
+    score: Optional[float] = None # Fused retrieval score
+    similarity: Optional[float] = None # Cosine similarity, None if matched by keywords only
+    placeholders: List[str] = [] # Placeholders to fill, in the order they are asked
+    candidates: List[ManifestCandidate] = [] # For AMBIGUOUS, templates to choose from
+    session_id: Optional[str] = None # With greeting: the MANIFEST session opened for the template
+    reply: Optional[str] = None # With greeting: the greeting asking for the first placeholder
+
+# API response for POST /get_manifests/batch
+class BatchManifestsResponse(BaseModel):
+    results: List[ManifestMatch] # In the order of the queries
+
 # User request body in POST /classify
 class ClassifyRequest(BaseModel):
     query: str
@@ -20,8 +55,22 @@ class ChatRequest(BaseModel):
 
 # API response for POST /chat
 class ChatResponse(BaseModel):
-    intent: Literal["GET_MANIFESTS", "HELP", "CHAT"] # Conversation intents
+    intent: Literal["GET_MANIFESTS", "HELP", "CHAT", "CANCEL"] # Conversation intents
     action: Literal["CALL_GET_MANIFESTS", "ASK_SCENARIO", "NONE"] # For API calls actions
     suggested_payload: Optional[dict] = None # A hint to user with what API call to make next
     reply: str # Human-readable reply to the user
     session_id: Optional[str] = None # Session ID for continuing the conversation
+
+# User request body in POST /render
+class RenderRequest(BaseModel):
+    template_id: Optional[str] = None # Template to render, e.g. "istio_postgres_se"
+    session_id: Optional[str] = None # Or a MANIFEST session: its template and the values filled so far
+    values: Dict[str, str] = {} # Placeholder values, override the ones from the session
+    format: Literal["yaml", "tar"] = "yaml" # Multi-document YAML or a tar with one file per resource
+    strict: bool = False # Reject the request if some placeholders have no value
+
+# User request body in POST /render/bulk
+class BulkRenderRequest(BaseModel):
+    template_id: str
+    value_sets: List[Dict[str, str]] = Field(min_length=1) # One rendered manifest per value set
+    strict: bool = True # A value set without a value for some placeholder is an error
@@ -1,35 +1,15 @@
 import re
 import logging
+from core.template_registry import render_text, PLACEHOLDER_TYPES
 
 PLACEHOLDER_PATTERN = r"\{\{\s*\$(\w+)\s*\}\}" # {{ $dpPort1 }}
 
-PLACEHOLDER_TYPES = {
-    "secretServerHost": "str",
-    "egressLabel": "str",
-    "serverHostDB1": "str",
-    "serverHostDB1ip": "str",
-    "serverHostDB2": "str",
-    "serverHostDB2ip": "str",
-    "serverPort": "int",
-    "virtualPortDB1": "int",
-    "virtualPortDB2": "int",
-    "pathToCACert": "str",
-    "pathToCert": "str",
-    "pathToKey": "str"
-}
-
 def extract_placeholders(yaml_text: str) -> list[str]:
     """Extract unique placeholders like {{ $dbPort1 }}."""
     return sorted(set(re.findall(PLACEHOLDER_PATTERN, yaml_text)))
 
-def fill_placeholders(yaml_text: str, values: dict[str, str]) -> str:
-    print("[DEBUG] Starting fill_placeholders")
-    print("[DEBUG] values = ", values)
-
-    for key, value in values.items():
-        pattern = re.compile(r"\{\{\s*\$" + re.escape(key) + r"\s*\}\}")
-        yaml_text = pattern.sub(value, yaml_text)
-    return yaml_text
+def fill_placeholders(yaml_text: str, values: dict[str, str], strict: bool = False) -> str:
+    return render_text(yaml_text, values, strict)
 
 def is_placeholder_valid(value: str, expected_type: str) -> bool:
     value = value.strip()
@@ -1,10 +1,34 @@
-from fastapi import APIRouter
+import os
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
 from fastapi.responses import JSONResponse
 
-router = APIRouter()
+# Shared secret for the admin routes, sent as X-Admin-Token. Unset keeps the routes disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+
+async def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    """Dependency of the admin routes: 404 while ADMIN_TOKEN is unset, 403 on a missing or wrong token"""
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=404)
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Неверный токен администратора")
+
+router = APIRouter(dependencies=[Depends(require_admin)])
 session_store = None
+retriever = None
 
+# curl -H "X-Admin-Token: $ADMIN_TOKEN" http://localhost:5000/sessions
 @router.get("/sessions")
-async def list_sessions():
-    return JSONResponse(content={"active_sessions": session_store.list_ids()})
+async def session_stats():
+    # Counters only: a session id is enough to continue someone else's dialog, so ids are never listed
+    return JSONResponse(content={
+        "stats": await session_store.run(session_store.stats) # live sessions, created/ended/expired/evicted counters
+    })
 
+@router.get("/retrieval")
+async def retrieval_stats():
+    router_stats = retriever.router.stats() if retriever is not None and retriever.router is not None else None
+    return JSONResponse(content={
+        "keyword_router": router_stats # hits answered without vector search, misses that fell through
+    })
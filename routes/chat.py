@@ -1,44 +1,110 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from routes.health import require_ready
+from fastapi.responses import StreamingResponse
 from models import ChatRequest, ChatResponse, Intent
-from core.llm_utils import llm_classify_intent, llm_rephrase_history, llm_assess_specificity, llm_detect_meta_intent, llm_detect_meta_in_scenario_mode, llm_detect_gibberish
-from core.placeholder_engine import handle_placeholder_reply, extract_placeholders, fill_placeholders
+from core.llm_utils import llm_classify_intent_async, llm_rephrase_history_async, llm_assess_specificity_async, llm_detect_meta_in_scenario_mode_async, llm_detect_gibberish_async, llm_route_turn_async
+from core.placeholder_engine import handle_placeholder_reply_async
 # from core.manifest_flow import start_manifest_flow_from_query
-from core.manifest_engine import start_manifest_flow_from_query
-import uuid, logging
+from core.manifest_engine import start_manifest_flow_from_query_async, start_manifest_flow_from_source_async
+import logging, asyncio, os, json
 from core.placeholder_engine import format_placeholder_list
 from core.session_manager import SessionStore, SessionState
-from core.safe_llm import safe_llm_invoke
+from core.safe_llm import safe_llm_astream, run_blocking, stream_tokens_to
+from core.semantic_cache import semantic_cache, ResolvedQuery, SEMANTIC_CACHE_ENABLED
+from core.keyword_router import normalize_terms
+from core.metrics import INTENTS
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(require_ready)])
 logger = logging.getLogger(__name__)
 
 session_store: SessionStore = None # Should be imported or injected
 vector_store = None # injected from app.py
+retriever = None # injected from app.py
 llm = None
 
+# Classify, rephrase and assess a fresh message with one combined LLM call
+USE_TURN_ROUTER = os.getenv("USE_TURN_ROUTER", "false").lower() in ("1", "true", "yes")
+
+async def _run_scenario_stages(message: str, collected_messages: tuple[str, ...]) -> tuple[str, bool, str | None]:
+    """
+    Run the independent ASK_SCENARIO stages concurrently: meta-intent, gibberish check
+    and a speculative rephrase of the history with the new message.
+    Stages that are no longer needed are cancelled as soon as an earlier one decides the turn.
+    Returns (meta_intent, is_gibberish, rephrased); rephrased is None if the turn ended early
+    """
+    meta_task = asyncio.create_task(llm_detect_meta_in_scenario_mode_async(llm, message))
+    gibberish_task = asyncio.create_task(llm_detect_gibberish_async(llm, message))
+    rephrase_task = asyncio.create_task(llm_rephrase_history_async(llm, [*collected_messages, message]))
+
+    try:
+        meta_intent = await meta_task
+        if meta_intent != "OTHER":
+            return (meta_intent, False, None)
+        if await gibberish_task:
+            return (meta_intent, True, None)
+        return (meta_intent, False, await rephrase_task)
+    finally:
+        for task in (meta_task, gibberish_task, rephrase_task):
+            if not task.done():
+                task.cancel()
+
+async def _embed_query(text: str):
+    """Embedding of a fresh message for the semantic cache, None if it can't be computed"""
+    embeddings = getattr(vector_store, "embeddings", None)
+    if not SEMANTIC_CACHE_ENABLED or embeddings is None:
+        return None
+    try:
+        return await run_blocking(embeddings.embed_query, text)
+    except Exception as e:
+        logger.warning("[SemanticCache] Не удалось получить эмбеддинг запроса: %s", e)
+        return None
+
+async def _remember_resolution(query_vector, terms: frozenset[str], rephrased: str, response: ChatResponse) -> None:
+    """Cache the manifest a query resolved to, if the flow actually opened a MANIFEST session"""
+    if query_vector is None or not response.session_id:
+        return
+    state = await session_store.aget(response.session_id)
+    if state and state.mode == "MANIFEST":
+        semantic_cache.add(query_vector, ResolvedQuery(is_specific=True, rephrased_query=rephrased, source=state.source_file), terms)
+
+async def _start_ask_scenario(message: str, followups: list[str]) -> ChatResponse:
+    """Open an ASK_SCENARIO session and ask the follow-up questions"""
+    bullet_questions = "\n".join(f"- " + q for q in followups)
+    # Create new ASK_SCENARIO session in store, the store picks the id so it counts the session as created
+    session_id = await session_store.acreate(SessionState(
+        mode="ASK_SCENARIO",
+        collected_messages=(message,)
+    ))
+    logger.info("[CHAT] ASK_SCENARIO session created: %s", session_id)
+    return ChatResponse(
+        intent=Intent.GET_MANIFESTS,
+        action="ASK_SCENARIO",
+        suggested_payload=None,
+        reply=(
+            "Уточните, пожалуйста, какую интеграцию вы хотите настроить:\n"
+            f"{bullet_questions}"
+        ),
+        session_id=session_id
+    )
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
-    print(f"[CHAT] Received ChatRequest: {request}")
-    print(f"[CHAT] Request.session_id: {request.session_id}")
+    logger.debug("[CHAT] Received message of %d chars, session_id = %s", len(request.message), request.session_id)
     if request.session_id:
         # Retrieve session from SessionStore
-        session = session_store.get(request.session_id)
-        print(f"[CHAT] Looked up session_store.get({request.session_id}) -> {session}")
-
-        print(f"Incoming session_id: {request.session_id}")
-        print(f"Active sessions: {session_store.list_ids()}")
+        session = await session_store.aget(request.session_id)
 
         if not session:
-            logger.warning(f"Session {request.session_id} not found. Starting new session.")
+            logger.warning("Session %s not found. Starting new session.", request.session_id)
             request.message = (
                 f"Предыдущая сессия завершена. Начнем заново\n" + request.message
             )
             return await chat(ChatRequest(message=request.message, session_id=None))
 
         if session.mode == "ASK_SCENARIO":
-            print(f"[CHAT] Mode: ASK_SCENARIO, messages so far: {session.collected_messages}")
-            # Detect meta intent early to handle unexpected user input
-            meta_intent = llm_detect_meta_in_scenario_mode(llm, request.message)
+            logger.debug("[CHAT] Mode: ASK_SCENARIO, messages so far: %d", len(session.collected_messages))
+            # Meta intent, gibberish check and rephrase don't depend on each other, run them at once
+            meta_intent, is_gibberish, rephrased = await _run_scenario_stages(request.message, session.collected_messages)
 
             if meta_intent == "HELP":
                 return ChatResponse(
@@ -54,7 +120,7 @@ async def chat(request: ChatRequest):
                 )
             
             if meta_intent == "CANCEL":
-                session_store.end(request.session_id)
+                await session_store.aend(request.session_id)
                 return ChatResponse(
                     intent=Intent.CANCEL,
                     action="NONE",
@@ -64,8 +130,7 @@ async def chat(request: ChatRequest):
                 )
                 
             # Proceed only if input is not a meta intent
-            # Append message and update session
-            if llm_detect_gibberish(llm, request.message):
+            if is_gibberish:
                 return ChatResponse(
                     intent=Intent.GET_MANIFESTS,
                     action="ASK_SCENARIO",
@@ -74,16 +139,14 @@ async def chat(request: ChatRequest):
                     session_id=request.session_id
                 )
 
-            session.collected_messages.append(request.message)
+            # Append message and update session
+            await session_store.aupdate(request.session_id, lambda state: state.add_message(request.message))
 
             try:
-                rephrased = llm_rephrase_history(llm, session.collected_messages)
-                print(f"[CHAT] collected_messages: {session.collected_messages}")
-                print(f"[CHAT] rephrased: {rephrased}")
-
-                assess = llm_assess_specificity(llm, rephrased)
+                logger.debug("[CHAT] rephrased: %s", rephrased)
+                assess = await llm_assess_specificity_async(llm, rephrased)
             except Exception as e:
-                logger.exception(f"Error while rephrasing or assessing specificity: {e}")
+                logger.exception("Error while rephrasing or assessing specificity: %s", e)
                 return ChatResponse(
                     intent=Intent.CHAT,
                     action="NONE",
@@ -93,7 +156,6 @@ async def chat(request: ChatRequest):
 
             if not assess["is_specific"]:
                 bullet_questions = "\n".join(f"- " + q for q in assess["followups"])
-                session_store.save(request.session_id, session)
                 return ChatResponse(
                     intent=Intent.GET_MANIFESTS,
                     action="ASK_SCENARIO",
@@ -104,14 +166,14 @@ async def chat(request: ChatRequest):
 
             query = assess["rephrased_query"] or rephrased.strip()
             logger.info("ASK_SCENARIO query: %s", query)
-            return start_manifest_flow_from_query(query, vector_store, llm, session_store, reuse_session_id=request.session_id)
+            return await start_manifest_flow_from_query_async(query, retriever, llm, session_store, reuse_session_id=request.session_id)
 
         if session.mode == "MANIFEST":
-            print(f"[CHAT] Mode: MANIFEST, remaining placeholders: {session.remaining_placeholders}")
+            logger.debug("[CHAT] Mode: MANIFEST, remaining placeholders: %d", len(session.remaining_placeholders))
             # Pass session_store to placeholder handler
-            text, done = handle_placeholder_reply(llm, request.session_id, session_store, request.message)
+            text, done = await handle_placeholder_reply_async(llm, request.session_id, session_store, request.message)
             if done:
-                session_store.end(request.session_id)
+                await session_store.aend(request.session_id)
             return ChatResponse(
                 intent=Intent.GET_MANIFESTS,
                 action="NONE",
@@ -126,60 +188,75 @@ async def chat(request: ChatRequest):
             suggested_payload=None,
             reply="Сессия в неизвестном состоянии. Начните сначала."
         )
+    # The message is embedded for the semantic cache while it is classified, the remote round trip
+    # adds no latency. Small talk and HELP never wait for it
+    embed_task = asyncio.create_task(_embed_query(request.message))
     try:
-        label = llm_classify_intent(llm,request.message)
-    except Exception as e:
-        logger.exception(f"Error while classifying intent: {e}")
-        return ChatResponse(
-            intent=Intent.CHAT,
-            action="NONE",
-            suggested_payload=None,
-            reply="Не удалось распознать ваш запрос. Попробуйте снова.",
-        )
+        return await _fresh_message(request, embed_task)
+    finally:
+        if not embed_task.done():
+            embed_task.cancel()
+
+async def _fresh_message(request: ChatRequest, embed_task: asyncio.Task) -> ChatResponse:
+    """Turn without a session: classify, then resolve GET_MANIFESTS through the semantic cache or the full pipeline"""
+    # Falls back to separate classify/rephrase/assess calls if the router's response can't be parsed
+    route = await llm_route_turn_async(llm, request.message) if USE_TURN_ROUTER else None
+
+    if route:
+        label = route["intent"]
+    else:
+        try:
+            label = await llm_classify_intent_async(llm,request.message)
+        except Exception as e:
+            logger.exception("Error while classifying intent: %s", e)
+            return ChatResponse(
+                intent=Intent.CHAT,
+                action="NONE",
+                suggested_payload=None,
+                reply="Не удалось распознать ваш запрос. Попробуйте снова.",
+            )
+    INTENTS.labels(getattr(label, "value", label)).inc()
 
     if label == "GET_MANIFESTS":
+        # Near-duplicates of an already resolved query skip rephrase, assessment and vector search.
+        # The terms keep "с ip" and "без ip" apart, their embeddings are almost the same
+        query_vector = await embed_task
+        terms = frozenset(normalize_terms(request.message))
+        cached = semantic_cache.lookup(query_vector, terms) if query_vector is not None else None
+        if cached:
+            logger.info("[SemanticCache] Hit: source = %s, is_specific = %s", cached.source, cached.is_specific)
+            if not cached.is_specific:
+                return await _start_ask_scenario(request.message, cached.followups)
+            return await start_manifest_flow_from_source_async(cached.source, llm, session_store)
+
         try:
-            rephrased = llm_rephrase_history(llm, [request.message])
-            assess = llm_assess_specificity(llm, rephrased)
+            if route:
+                rephrased = route["rephrased_query"] or request.message
+                assess = route
+            else:
+                rephrased = await llm_rephrase_history_async(llm, [request.message])
+                assess = await llm_assess_specificity_async(llm, rephrased)
 
         except Exception as e:
-            logger.exception(f"Error while rephrasing or assessing specificity: {e}")
+            logger.exception("Error while rephrasing or assessing specificity: %s", e)
             return ChatResponse(
                 intent=Intent.CHAT,
                 action="NONE",
                 suggested_payload=None,
                 reply="Ошибка при обработке запроса. Попробуйте снова.",
             )
-        logger.info("Hitting GET_MANIFESTS")
-        logger.info("request.message = %s", request.message)
-        logger.info("rephrased = %s", rephrased)
-        logger.info(f"assess is_specific = {assess['is_specific']}")
+        logger.debug("GET_MANIFESTS: rephrased = %s, is_specific = %s", rephrased, assess["is_specific"])
 
         if not assess["is_specific"]:
-            bullet_questions = "\n".join(f"- " + q for q in assess["followups"])
-            session_id = str(uuid.uuid4())
-            logger.info(f"GET_MANIFESTS: session_id = {session_id}")
-            # Create new ASK_SCENARIO session in store
-            session_store.create(SessionState(
-                mode="ASK_SCENARIO",
-                collected_messages=[request.message]
-            ), reuse_session_id=session_id)
-            print(f"[CHAT] ASK_SCENARIO session created: {session_id}")
-            print(f"[CHAT] Stored session: {session_store.get(session_id)}")
-            return ChatResponse(
-                intent=Intent.GET_MANIFESTS,
-                action="ASK_SCENARIO",
-                suggested_payload=None,
-                reply=(
-                    "Уточните, пожалуйста, какую интеграцию вы хотите настроить:\n"
-                    f"{bullet_questions}"
-                ),
-                session_id=session_id
-            )
+            if query_vector is not None:
+                semantic_cache.add(query_vector, ResolvedQuery(is_specific=False, rephrased_query=rephrased, followups=assess["followups"]), terms)
+            return await _start_ask_scenario(request.message, assess["followups"])
 
         query = rephrased.strip()
         logger.info("GET_MANIFESTS: query = %s", query)
-        return start_manifest_flow_from_query(query, vector_store, llm, session_store)
+        response = await start_manifest_flow_from_query_async(query, retriever, llm, session_store)
+        await _remember_resolution(query_vector, terms, query, response)
+        return response
 
     if label == "HELP":
         return ChatResponse(
@@ -193,10 +270,10 @@ async def chat(request: ChatRequest):
 
     try:
         # response = llm.invoke(f"Ответь коротко и дружелюбно: {request.message}")
-        response = safe_llm_invoke(llm, f"Ответь коротко и дружелюбно: {request.message}")
+        response = await safe_llm_astream(llm, f"Ответь коротко и дружелюбно: {request.message}")
         text = (getattr(response, "content", "") or "").strip() or "Привет! Не удалось получить ответ от модели. Опишите, какой сценарий вас интересует."
     except Exception as e:
-        logger.exception(f"Error while invoking LLM: {e}")
+        logger.exception("Error while invoking LLM: %s", e)
         text = "Привет! Опишите, какой сценарий вас интересует."
 
     return ChatResponse(
@@ -205,3 +282,42 @@ async def chat(request: ChatRequest):
         suggested_payload=None,
         reply=text,
     )
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Same turn as /chat, as Server-Sent Events.
+    "token" events carry parts of the LLM reply (greeting, placeholder explanation, small talk) as they are generated,
+    the final "done" event carries the ChatResponse. Its reply is authoritative: it also covers
+    replies that were not generated token by token (cached, fallback or fixed texts)
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run_turn() -> ChatResponse:
+        with stream_tokens_to(queue.put_nowait):
+            return await chat(request)
+
+    # The turn is not cancelled if the client goes away, so the session is never left half-updated
+    task = asyncio.create_task(run_turn())
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+
+    async def events():
+        while (text := await queue.get()) is not None:
+            yield _sse("token", {"text": text})
+        try:
+            response = task.result()
+        except Exception as e:
+            logger.exception("Error while streaming chat turn: %s", e)
+            response = ChatResponse(
+                intent=Intent.CHAT,
+                action="NONE",
+                suggested_payload=None,
+                reply="Ошибка при обработке запроса. Попробуйте снова.",
+                session_id=request.session_id
+            )
+        yield _sse("done", response.model_dump(mode="json"))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,13 +1,13 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from routes.health import require_ready
 from models import ClassifyRequest, ClassifyResponse
-from core.llm_utils import llm_classify_intent
+from core.llm_utils import llm_classify_intent_async
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(require_ready)])
 llm = None # Will be injected
 
 # curl -X POST http://localhost:5000/classify -H "Content-Type: application/json" -d '{"query": "Что ты умеешь?"}'
 @router.post("/classify", response_model=ClassifyResponse)
 async def classify(request: ClassifyRequest):
-    label = llm_classify_intent(llm, request.query)
-    print(label)
+    label = await llm_classify_intent_async(llm, request.query)
     return ClassifyResponse(intent=label)
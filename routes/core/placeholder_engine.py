@@ -1,25 +1,11 @@
 from core.llm_utils import llm_detect_meta_intent
+from core.template_registry import PLACEHOLDER_TYPES
 import re, logging
 
 logger = logging.getLogger(__name__)
 
 PLACEHOLDER_PATTERN = r"\{\{\s*\$(\w+)\s*\}\}" # {{ $dpPort1 }}
 
-PLACEHOLDER_TYPES = {
-    "secretServerHost": "str",
-    "egressLabel": "str",
-    "serverHostDB1": "str",
-    "serverHostDB1ip": "str",
-    "serverHostDB2": "str",
-    "serverHostDB2ip": "str",
-    "serverPort": "int",
-    "virtualPortDB1": "int",
-    "virtualPortDB2": "int",
-    "pathToCACert": "str",
-    "pathToCert": "str",
-    "pathToKey": "str"
-}
-
 def extract_placeholders(yaml_text: str) -> list[str]:
     """Extract unique placeholders like {{ $dbPort1 }}."""
     return sorted(set(re.findall(PLACEHOLDER_PATTERN, yaml_text)))
@@ -1,15 +1,16 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, Depends
+from routes.health import require_ready
 from fastapi.responses import PlainTextResponse
-from models import QueryRequest
-from core.manifest_engine import start_manifest_flow_from_query
+from models import QueryRequest, BatchQueryRequest, BatchManifestsResponse
+from core.manifest_engine import start_manifest_flow_from_query_async, resolve_manifests_async
 from core.session_manager import SessionStore
 import logging
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(require_ready)])
 logger = logging.getLogger(__name__)
 
 llm = None
-vector_store = None
+retriever = None
 session_store: SessionStore = None
 
 @router.post("/get_manifests")
@@ -17,10 +18,10 @@ async def get_manifest(request: QueryRequest, fastapi_request: Request):
     query = request.query
 
     client_ip = fastapi_request.client.host if fastapi_request.client else "unknown"
-    logger.info(f"[GET_MANIFESTS Request from {client_ip} with query: {query}]")
+    logger.info("[GET_MANIFESTS] Request from %s with query: %s", client_ip, query)
     
     try:
-        response = start_manifest_flow_from_query(query=query, vector_store=vector_store, llm=llm, session_store=session_store)
+        response = await start_manifest_flow_from_query_async(query=query, retriever=retriever, llm=llm, session_store=session_store)
     except Exception as e:
         logger.exception("Error during manifest flow")
         return PlainTextResponse(
@@ -37,3 +38,11 @@ async def get_manifest(request: QueryRequest, fastapi_request: Request):
         },
         media_type="text/plain"
     )
+
+@router.post("/get_manifests/batch", response_model=BatchManifestsResponse)
+async def get_manifests_batch(request: BatchQueryRequest, fastapi_request: Request):
+    client_ip = fastapi_request.client.host if fastapi_request.client else "unknown"
+    logger.info("[GET_MANIFESTS] Batch request from %s with %d queries", client_ip, len(request.queries))
+
+    results = await resolve_manifests_async(request.queries, retriever=retriever, llm=llm, session_store=session_store, greeting=request.greeting)
+    return BatchManifestsResponse(results=results)
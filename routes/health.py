@@ -1,8 +1,21 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from core.config import readiness, is_ready
 
 router = APIRouter()
 
+async def require_ready() -> None:
+    """Dependency of the routes that need the LLM, the index or the templates: 503 until warm-up is done, like /ready"""
+    if not is_ready():
+        raise HTTPException(status_code=503, detail="Сервис еще не готов, попробуйте позже")
+
 # curl -X GET http://localhost:5000/health
 @router.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+# curl -X GET http://localhost:5000/ready
+@router.get("/ready")
+async def readiness_check():
+    state = readiness()
+    return JSONResponse(content=state, status_code=200 if state["ready"] else 503)
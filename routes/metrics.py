@@ -0,0 +1,79 @@
+import time
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from core.metrics import registry, collected, Counter, Gauge, HTTP_REQUEST_SECONDS
+from core.llm_cache import llm_cache
+from core.semantic_cache import semantic_cache
+from core.config import get_embeddings
+from core.safe_llm import run_blocking
+
+router = APIRouter()
+
+session_store = None # injected from app.py
+retriever = None
+
+def _cache_metrics():
+    """Hit and miss counters kept by the caches themselves"""
+    samples = []
+    for namespace, counters in llm_cache.stats().items():
+        samples.append((("llm", namespace, "hit"), counters["hits"]))
+        samples.append((("llm", namespace, "miss"), counters["misses"]))
+    samples.append((("semantic", "", "hit"), semantic_cache.hits))
+    samples.append((("semantic", "", "miss"), semantic_cache.misses))
+    if get_embeddings.is_initialized():
+        embeddings = get_embeddings()
+        samples.append((("embedding", "", "hit"), getattr(embeddings, "hits", 0)))
+        samples.append((("embedding", "", "miss"), getattr(embeddings, "misses", 0)))
+    router_stats = retriever.router.stats() if retriever is not None and retriever.router is not None else None
+    if router_stats:
+        samples.append((("keyword_router", "", "hit"), router_stats["hits"]))
+        samples.append((("keyword_router", "", "miss"), router_stats["misses"]))
+    return [collected(Counter("cache_requests_total", "Cache lookups by cache, namespace and result", ["cache", "namespace", "result"]), samples)]
+
+def _session_metrics():
+    if session_store is None:
+        return []
+    stats = session_store.stats()
+    live = Gauge("sessions_live", "Sessions currently in the store")
+    live.set(stats.pop("live"))
+    events = collected(Counter("sessions_total", "Sessions by what happened to them: created, ended, expired, evicted", ["event"]),
+                       (((event,), count) for event, count in stats.items()))
+    return [live, events]
+
+registry.register_collector(_cache_metrics)
+registry.register_collector(_session_metrics)
+
+class MetricsMiddleware:
+    """Request latency per route template (/render, not /render?x=1), up to the start of the response"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = []
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+                route = scope.get("route")
+                HTTP_REQUEST_SECONDS.labels(scope["method"], getattr(route, "path", "unmatched"), str(message["status"])).observe(time.perf_counter() - started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            if not status:
+                route = scope.get("route")
+                HTTP_REQUEST_SECONDS.labels(scope["method"], getattr(route, "path", "unmatched"), "500").observe(time.perf_counter() - started)
+            raise
+
+# curl -X GET http://localhost:5000/metrics
+@router.get("/metrics")
+async def metrics():
+    # Collectors may call Redis, keep them off the event loop
+    body = await run_blocking(registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,70 @@
+import json
+from fastapi import APIRouter, Depends
+from routes.health import require_ready
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
+from models import RenderRequest, BulkRenderRequest
+from core.session_manager import SessionStore
+from core.template_registry import template_registry
+from core.placeholder_engine import validate_values
+from core.manifest_stream import stream_yaml, stream_tar
+from core.bulk_render import render_many
+import logging
+
+router = APIRouter(dependencies=[Depends(require_ready)])
+logger = logging.getLogger(__name__)
+
+session_store: SessionStore = None
+
+@router.post("/render")
+async def render(request: RenderRequest):
+    template_id = request.template_id
+    template = template_registry.get(template_id) if template_id else None
+    values = {}
+
+    if request.session_id:
+        session = await session_store.aget(request.session_id)
+        if not session or session.mode != "MANIFEST":
+            return PlainTextResponse(f"Сессия {request.session_id} не найдена или не заполняет манифест", status_code=404)
+        if not template_id:
+            # The session's own template, it may be compiled from the index text and not be in the registry
+            template_id, template = session.template_id, session.template
+        values.update(session.filled_values)
+    values.update(request.values)
+
+    if not template:
+        return PlainTextResponse(f"Шаблон {template_id} не найден", status_code=404)
+
+    # Checked before streaming starts, the status code can't change afterwards.
+    # Values go into YAML as is, a value with a newline could add fields or whole resources
+    missing = template.missing(values)
+    errors = validate_values(template, values, strict=request.strict)
+    if errors:
+        return JSONResponse(content={"errors": errors, "missing": missing if request.strict else []}, status_code=422)
+
+    logger.info("[RENDER] template=%s format=%s documents=%d missing=%d", template.id, request.format, len(template.documents), len(missing))
+
+    if request.format == "tar":
+        return StreamingResponse(
+            stream_tar(template, values),
+            media_type="application/x-tar",
+            headers={"Content-Disposition": f'attachment; filename="{template.id}.tar"'}
+        )
+    return StreamingResponse(stream_yaml(template, values), media_type="application/yaml")
+
+@router.post("/render/bulk")
+async def render_bulk(request: BulkRenderRequest):
+    """
+    Render the template for every value set, no LLM calls.
+    Streams NDJSON in input order, one line per value set: {"index", "manifest"} or {"index", "errors"}
+    """
+    template = template_registry.get(request.template_id)
+    if not template:
+        return PlainTextResponse(f"Шаблон {request.template_id} не найден", status_code=404)
+
+    logger.info("[RENDER] bulk template=%s items=%d", template.id, len(request.value_sets))
+
+    async def lines():
+        async for result in render_many(template, request.value_sets, request.strict):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
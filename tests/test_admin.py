@@ -0,0 +1,32 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core.session_manager import InMemorySessionStore, SessionState
+from routes import admin
+
+@pytest.fixture
+def client(monkeypatch):
+    store = InMemorySessionStore()
+    store.create(SessionState(mode="ASK_SCENARIO", collected_messages=("istio",)))
+    monkeypatch.setattr(admin, "session_store", store)
+    app = FastAPI()
+    app.include_router(admin.router)
+    return TestClient(app)
+
+def test_admin_routes_are_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", None)
+    assert client.get("/sessions", headers={"X-Admin-Token": ""}).status_code == 404
+
+def test_admin_routes_require_the_token(client, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    assert client.get("/sessions").status_code == 403
+    assert client.get("/sessions", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/retrieval", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+def test_session_stats_do_not_list_session_ids(client, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    response = client.get("/sessions", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json() == {"stats": admin.session_store.stats()}
+    assert response.json()["stats"]["live"] == 1
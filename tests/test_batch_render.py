@@ -0,0 +1,68 @@
+import json
+
+import batch_render
+from tests.test_render import VALUES
+
+def _write_input(path, records):
+    path.write_text("\n".join(json.dumps(record) for record in records) + "\n", encoding="utf-8")
+
+def _results(out_dir):
+    with open(out_dir / "results.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def test_numbers_are_rendered_as_strings_and_other_types_are_reported(tmp_path):
+    numeric = {**VALUES, "serverPort": 5432}
+    nested = {**VALUES, "serverPort": {"port": 5432}}
+    _write_input(tmp_path / "in.jsonl", [
+        {"id": "numeric", "template_id": "istio_postgres_se", "values": numeric},
+        {"id": "nested", "template_id": "istio_postgres_se", "values": nested}
+    ])
+
+    summary = batch_render.run(str(tmp_path / "in.jsonl"), str(tmp_path / "out"), workers=1, window=10, strict=True)
+
+    assert summary["rendered"] == 1
+    numeric_result, nested_result = _results(tmp_path / "out")
+    assert numeric_result["status"] == "ok"
+    assert "5432" in (tmp_path / "out" / "numeric.yaml").read_text(encoding="utf-8")
+    assert nested_result["status"] == "error"
+    assert set(nested_result["errors"]) == {"serverPort"}
+
+def test_repeated_ids_do_not_overwrite_each_other(tmp_path):
+    first = {**VALUES, "serverHostDB1": "first.example.com"}
+    second = {**VALUES, "serverHostDB1": "second.example.com"}
+    _write_input(tmp_path / "in.jsonl", [
+        {"id": "db", "template_id": "istio_postgres_se", "values": first},
+        {"id": "db", "template_id": "istio_postgres_se", "values": second}
+    ])
+
+    batch_render.run(str(tmp_path / "in.jsonl"), str(tmp_path / "out"), workers=1, window=1, strict=True)
+
+    files = [result["file"] for result in _results(tmp_path / "out")]
+    assert files == ["db.yaml", "db-000002.yaml"]
+    assert "first.example.com" in (tmp_path / "out" / "db.yaml").read_text(encoding="utf-8")
+    assert "second.example.com" in (tmp_path / "out" / "db-000002.yaml").read_text(encoding="utf-8")
+
+def test_resolver_keeps_a_bounded_number_of_queries():
+    resolver = batch_render._Resolver(cache_size=2)
+    for query in ("a", "b", "c"):
+        resolver._remember(query, (None, query))
+    assert list(resolver._by_query) == ["b", "c"]
+
+def test_malformed_records_are_reported_per_line(tmp_path):
+    _write_input(tmp_path / "in.jsonl", [
+        {"id": "list", "query": ["x"], "values": VALUES},
+        {"id": "dict", "query": {"a": 1}, "values": VALUES},
+        {"id": "number", "template_id": 5, "values": VALUES},
+        {"id": "blank", "template_id": " ", "values": VALUES},
+        {"id": "neither", "values": VALUES},
+        ["not", "an", "object"],
+        {"id": "good", "template_id": "istio_postgres_se", "values": VALUES}
+    ])
+
+    summary = batch_render.run(str(tmp_path / "in.jsonl"), str(tmp_path / "out"), workers=1, window=10, strict=True)
+
+    assert summary == {**summary, "total": 7, "rendered": 1, "failed": 6}
+    results = _results(tmp_path / "out")
+    assert [result["status"] for result in results] == ["error"] * 6 + ["ok"]
+    assert results[0]["errors"] == {"": "query должен быть непустой строкой"}
+    assert results[4]["errors"] == {"": "нужно поле template_id или query"}
@@ -0,0 +1,104 @@
+import multiprocessing
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from core.embedding_cache import CachedEmbeddings, _VectorFile
+
+class _TextEmbeddings(Embeddings):
+    """Vector derived from the text, so a wrong row is easy to spot"""
+
+    model = "test-embeddings"
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(sum(map(ord, text))), float(len(text)), 1.0]
+
+def _embed_in_process(cache_dir: str, prefix: str, count: int) -> None:
+    cached = CachedEmbeddings(_TextEmbeddings(), cache_dir=cache_dir)
+    for i in range(count):
+        # One text per call, so the processes keep interleaving their appends
+        cached.embed_documents([f"{prefix}-{i}"])
+
+def test_two_processes_share_the_vector_file(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_embed_in_process, args=(str(tmp_path), prefix, 200)) for prefix in ("a", "b")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    base = _TextEmbeddings()
+    cached = CachedEmbeddings(base, cache_dir=str(tmp_path))
+    texts = [f"{prefix}-{i}" for prefix in ("a", "b") for i in range(200)]
+    assert len(cached._disk.rows) == len(texts)
+    assert len(set(cached._disk.rows.values())) == len(texts)
+    assert cached.embed_documents(texts) == base.embed_documents(texts)
+    assert cached.misses == 0
+
+def test_rows_appended_by_another_instance_are_visible(tmp_path):
+    first = CachedEmbeddings(_TextEmbeddings(), cache_dir=str(tmp_path))
+    second = CachedEmbeddings(_TextEmbeddings(), cache_dir=str(tmp_path))
+    first.embed_documents(["one"])
+    second.embed_documents(["two"])
+    first.embed_documents(["three"])
+
+    assert second.embed_documents(["one", "three"]) == _TextEmbeddings().embed_documents(["one", "three"])
+    assert second.misses == 1 # only "two"
+    assert sorted(second._disk.rows.values()) == [0, 1, 2]
+
+def test_truncated_index_line_is_skipped(tmp_path):
+    vectors = _VectorFile(str(tmp_path), "model")
+    vectors.append([("good", np.array([1, 2, 3], dtype=np.float32))])
+    # A writer died halfway through its line
+    with open(tmp_path / "model.idx", "a", encoding="utf-8") as f:
+        f.write("torn\t1")
+
+    reopened = _VectorFile(str(tmp_path), "model")
+    assert set(reopened.rows) == {"good"}
+    reopened.append([("next", np.array([4, 5, 6], dtype=np.float32))])
+
+    again = _VectorFile(str(tmp_path), "model")
+    assert set(again.rows) == {"good", "next"}
+    assert again.get("next").tolist() == [4.0, 5.0, 6.0]
+    assert again.get("good").tolist() == [1.0, 2.0, 3.0]
+
+def test_corrupted_index_line_is_skipped(tmp_path):
+    vectors = _VectorFile(str(tmp_path), "model")
+    vectors.append([("good", np.array([1, 2, 3], dtype=np.float32))])
+    with open(tmp_path / "model.idx", "a", encoding="utf-8") as f:
+        f.write("other\t0\tdeadbeef\n")
+
+    assert _VectorFile(str(tmp_path), "model").rows == {"good": 0}
+
+def test_cached_texts_are_served_while_a_miss_is_written(tmp_path):
+    import threading
+
+    base = _TextEmbeddings()
+    cached = CachedEmbeddings(base, cache_dir=str(tmp_path))
+    cached.embed_documents(["cached"])
+
+    writing, release = threading.Event(), threading.Event()
+    append = cached._disk.append
+
+    def slow_append(items):
+        writing.set()
+        release.wait(5)
+        append(items)
+
+    cached._disk.append = slow_append
+    miss = threading.Thread(target=cached.embed_documents, args=(["new"],))
+    miss.start()
+    try:
+        assert writing.wait(5)
+        served = []
+        reader = threading.Thread(target=lambda: served.append(cached.embed_documents(["cached"])))
+        reader.start()
+        reader.join(1)
+        assert served == [base.embed_documents(["cached"])]
+    finally:
+        release.set()
+        miss.join(5)
+    assert cached._disk.get(cached._key("doc", "new")) is not None
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+from core.indexer import sync_vector_store
+from core.semantic_cache import semantic_cache, ResolvedQuery
+
+class _Collection:
+    """The part of the Chroma API the indexer uses"""
+
+    def __init__(self):
+        self.documents = {}
+
+    def get(self, include):
+        return {"ids": list(self.documents)}
+
+    def delete(self, ids):
+        for doc_id in ids:
+            self.documents.pop(doc_id, None)
+
+    def add_documents(self, documents, ids):
+        self.documents.update(zip(ids, documents))
+
+def _document(text):
+    return SimpleNamespace(page_content=text, metadata={"source": "manifests/a.yaml", "description": "a"})
+
+def _cache_something():
+    semantic_cache.add([1.0, 0.0], ResolvedQuery(is_specific=True, source="manifests/a.yaml"))
+    assert semantic_cache.lookup([1.0, 0.0]) is not None
+
+def test_changed_documents_clear_the_semantic_cache(tmp_path):
+    collection, manifest = _Collection(), str(tmp_path / "manifest.json")
+    sync_vector_store(collection, [_document("v1")], manifest)
+
+    _cache_something()
+    sync_vector_store(collection, [_document("v1")], manifest)
+    assert semantic_cache.lookup([1.0, 0.0]) is not None
+
+    sync_vector_store(collection, [_document("v2")], manifest)
+    assert semantic_cache.lookup([1.0, 0.0]) is None
+
+def test_removed_documents_clear_the_semantic_cache(tmp_path):
+    collection, manifest = _Collection(), str(tmp_path / "manifest.json")
+    sync_vector_store(collection, [_document("v1")], manifest)
+
+    _cache_something()
+    sync_vector_store(collection, [], manifest)
+    assert semantic_cache.lookup([1.0, 0.0]) is None
+    assert collection.documents == {}
@@ -0,0 +1,64 @@
+import asyncio
+
+from core import safe_llm
+from core.llm_cache import LLMCache
+
+class FakeLLM:
+    model = "fake"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        return safe_llm.CachedResponse(f"answer to {prompt}")
+
+def test_writes_are_batched_and_survive_restart(tmp_path):
+    path = str(tmp_path / "llm.db")
+    cache = LLMCache(path=path, flush_interval=3600)
+    cache.set("greeting", "k1", "hello")
+    cache.set("greeting", "k2", "hi")
+    assert cache.get("greeting", "k1", memory_only=True) == "hello"
+    assert cache.flush() == 2
+    assert cache.flush() == 0
+    cache.close()
+
+    reopened = LLMCache(path=path, flush_interval=3600)
+    # Memory is empty after a restart: the inline lookup defers to the disk read
+    assert reopened.get("greeting", "k1", memory_only=True) is None
+    assert reopened.stats() == {}
+    assert reopened.get("greeting", "k1") == "hello"
+    assert reopened.stats() == {"greeting": {"hits": 1, "misses": 0}}
+    assert reopened.get("greeting", "k1", memory_only=True) == "hello"
+    reopened.close()
+
+def test_close_flushes_pending(tmp_path):
+    path = str(tmp_path / "llm.db")
+    cache = LLMCache(path=path, flush_interval=3600)
+    cache.set("greeting", "k", "hello")
+    cache.close()
+    assert LLMCache(path=path, flush_interval=3600).get("greeting", "k") == "hello"
+
+def test_cached_ainvoke_reads_disk_in_pool(tmp_path, monkeypatch):
+    path = str(tmp_path / "llm.db")
+    warm = LLMCache(path=path, flush_interval=3600)
+    key = safe_llm.cache_key("fake", "ping")
+    warm.set("greeting", key, "pong")
+    warm.close()
+
+    cache = LLMCache(path=path, flush_interval=3600)
+    monkeypatch.setattr(safe_llm, "llm_cache", cache)
+    offloaded = []
+    real_run_blocking = safe_llm.run_blocking
+
+    async def run_blocking(func, *args):
+        offloaded.append(func)
+        return await real_run_blocking(func, *args)
+
+    monkeypatch.setattr(safe_llm, "run_blocking", run_blocking)
+    llm = FakeLLM()
+    content = asyncio.run(safe_llm.cached_ainvoke(llm, "ping", "greeting", lambda r: r.content))
+    assert content == "pong"
+    assert llm.calls == 0
+    assert offloaded == [cache.get]
+    cache.close()
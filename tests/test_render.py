@@ -0,0 +1,69 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core.session_manager import InMemorySessionStore, SessionState
+from core.template_registry import template_registry, compile_template
+from routes import render
+from routes.health import require_ready
+
+VALUES = {
+    "egressLabel": "egress",
+    "pathToCACert": "/certs/ca.pem",
+    "pathToCert": "/certs/cert.pem",
+    "pathToKey": "/certs/key.pem",
+    "serverHostDB1": "db1.example.com",
+    "serverHostDB1ip": "10.0.0.1",
+    "serverHostDB2": "db2.example.com",
+    "serverHostDB2ip": "10.0.0.2",
+    "serverPort": "5432",
+    "virtualPortDB1": "15432",
+    "virtualPortDB2": "15433"
+}
+
+@pytest.fixture(scope="module")
+def client():
+    template_registry.load()
+    app = FastAPI()
+    app.include_router(render.router)
+    app.dependency_overrides[require_ready] = lambda: None
+    return TestClient(app)
+
+def test_render_answers_503_until_warm_up_is_done():
+    app = FastAPI()
+    app.include_router(render.router)
+    response = TestClient(app).post("/render", json={"template_id": "istio_postgres_se", "values": VALUES})
+    assert response.status_code == 503
+
+def test_render_streams_the_manifest(client):
+    response = client.post("/render", json={"template_id": "istio_postgres_se", "values": VALUES, "strict": True})
+    assert response.status_code == 200
+    assert "db1.example.com" in response.text
+    assert "{{" not in response.text
+
+def test_render_rejects_a_value_that_injects_yaml(client):
+    values = {**VALUES, "serverPort": "abc\nkind: Secret"}
+    response = client.post("/render", json={"template_id": "istio_postgres_se", "values": values})
+    assert response.status_code == 422
+    assert set(response.json()["errors"]) == {"serverPort"}
+
+def test_render_strict_reports_missing_values(client):
+    values = {name: value for name, value in VALUES.items() if name != "pathToKey"}
+    response = client.post("/render", json={"template_id": "istio_postgres_se", "values": values, "strict": True})
+    assert response.status_code == 422
+    assert response.json() == {"errors": {"pathToKey": "значение не задано"}, "missing": ["pathToKey"]}
+
+    lenient = client.post("/render", json={"template_id": "istio_postgres_se", "values": values})
+    assert lenient.status_code == 200
+
+def test_render_uses_the_session_template_when_it_is_not_in_the_registry(client, monkeypatch):
+    store = InMemorySessionStore()
+    monkeypatch.setattr(render, "session_store", store)
+    # Compiled from the index text, like a session whose file is gone from manifests/
+    template = template_registry.intern(compile_template("manifests/removed.yaml", "kind: ServiceEntry\nport: {{ $serverPort }}\n"))
+    assert template_registry.get(template.id) is not template
+    session_id = store.create(SessionState(mode="MANIFEST", template=template, cursor=1, values=("5432",)))
+
+    response = client.post("/render", json={"session_id": session_id, "strict": True})
+    assert response.status_code == 200
+    assert "port: 5432" in response.text
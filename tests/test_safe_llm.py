@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+from core.safe_llm import llm_ainvoke, run_blocking, LLM_MAX_CONCURRENCY
+
+class _SlowLLM:
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+
+    async def ainvoke(self, prompt):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return prompt
+
+async def _burst(llm, count):
+    return await asyncio.gather(*(llm_ainvoke(llm, str(i)) for i in range(count)))
+
+def test_llm_slots_work_on_every_event_loop():
+    # The bot runs each message on a fresh loop; a semaphore bound to the first one used to raise on the second
+    for _ in range(3):
+        llm = _SlowLLM()
+        assert asyncio.run(_burst(llm, LLM_MAX_CONCURRENCY * 3)) == [str(i) for i in range(LLM_MAX_CONCURRENCY * 3)]
+        assert llm.peak == LLM_MAX_CONCURRENCY
+
+class _BlockingLLM:
+    """Sync-only client whose calls hang until released"""
+    def __init__(self):
+        self.release = threading.Event()
+
+    def invoke(self, prompt):
+        self.release.wait(5)
+        return prompt
+
+def test_blocking_io_is_not_starved_by_slow_llm_calls():
+    llm = _BlockingLLM()
+
+    async def scenario():
+        calls = [asyncio.create_task(llm_ainvoke(llm, str(i))) for i in range(LLM_MAX_CONCURRENCY)]
+        await asyncio.sleep(0.05) # every LLM thread is now busy
+        try:
+            return await asyncio.wait_for(run_blocking(lambda: "cache hit"), timeout=1)
+        finally:
+            llm.release.set()
+            await asyncio.gather(*calls)
+
+    assert asyncio.run(scenario()) == "cache hit"
@@ -0,0 +1,29 @@
+from core.keyword_router import normalize_terms
+from core.semantic_cache import SemanticCache, ResolvedQuery
+
+WITH_IP = "манифест для истио с постгресом с ip"
+WITHOUT_IP = "манифест для истио с постгресом без ip"
+
+def _terms(text):
+    return frozenset(normalize_terms(text))
+
+def test_near_identical_queries_naming_different_templates_do_not_share_a_hit():
+    cache = SemanticCache(max_distance=0.05)
+    # Embeddings of the two phrasings are well inside the distance threshold
+    cache.add([1.0, 0.0, 0.0], ResolvedQuery(is_specific=True, source="manifests/istio_postgres_se_ip.yaml"), _terms(WITH_IP))
+
+    assert cache.lookup([0.999, 0.02, 0.0], _terms(WITHOUT_IP)) is None
+    hit = cache.lookup([0.999, 0.02, 0.0], _terms(WITH_IP))
+    assert hit.source == "manifests/istio_postgres_se_ip.yaml"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_rephrasing_with_the_same_terms_still_hits():
+    cache = SemanticCache(max_distance=0.05)
+    cache.add([1.0, 0.0], ResolvedQuery(is_specific=True, source="manifests/a.yaml"), _terms(WITH_IP))
+    assert cache.lookup([0.999, 0.01], _terms("С IP для Истио и постгреса манифест")) is not None
+
+def test_lookup_picks_the_closest_entry_with_matching_terms():
+    cache = SemanticCache(max_distance=0.05)
+    cache.add([1.0, 0.0], ResolvedQuery(is_specific=True, source="manifests/ip.yaml"), _terms(WITH_IP))
+    cache.add([0.999, 0.01], ResolvedQuery(is_specific=True, source="manifests/no_ip.yaml"), _terms(WITHOUT_IP))
+    assert cache.lookup([1.0, 0.0], _terms(WITHOUT_IP)).source == "manifests/no_ip.yaml"
@@ -0,0 +1,120 @@
+import time
+import asyncio
+
+import fakeredis
+import pytest
+
+from core.session_manager import SessionStore, SessionState, InMemorySessionStore, RedisSessionStore
+from core.template_registry import template_registry, compile_template
+
+@pytest.fixture
+def template():
+    template_registry.load()
+    return template_registry.get("istio_postgres_se")
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+def _store(server, **kwargs):
+    return RedisSessionStore(client=fakeredis.FakeRedis(server=server), **kwargs)
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+def test_redis_update_is_stored(server, template):
+    store = _store(server)
+    session_id = store.create(SessionState(mode="MANIFEST", template=template))
+
+    assert store.update(session_id, lambda state: state.accept("egress")) == template.placeholders[1]
+
+    # Another worker sees the change
+    state = _store(server).get(session_id)
+    assert state.template is template
+    assert state.cursor == 1 and state.values == ("egress",)
+    assert store.update("missing", lambda state: state.accept("x")) is None
+
+def test_redis_update_retries_after_a_concurrent_write(server, template):
+    store, other = _store(server), _store(server)
+    session_id = store.create(SessionState(mode="MANIFEST", template=template))
+    calls = []
+
+    def mutate(state):
+        calls.append(state.cursor)
+        if len(calls) == 1:
+            # Another worker accepts a value between WATCH and EXEC
+            other.update(session_id, lambda other_state: other_state.accept("first"))
+        return state.accept("second")
+
+    store.update(session_id, mutate)
+
+    assert calls == [0, 1]
+    assert store.get(session_id).values == ("first", "second")
+
+def test_redis_sessions_expire_after_the_idle_ttl(server):
+    store = _store(server, ttl=1)
+    session_id = store.create(SessionState(mode="ASK_SCENARIO", collected_messages=("istio",)))
+    idle_id = store.create(SessionState(mode="ASK_SCENARIO"))
+    assert store.get(session_id).collected_messages == ("istio",)
+
+    time.sleep(1.2)
+
+    assert store.get(session_id) is None
+    assert store.update(session_id, lambda state: state.add_message("x")) is None
+    # The session read after it expired is already accounted for, the reaper finds the other one
+    assert store.reap() == 1
+    assert store.get(idle_id) is None
+    assert store.stats() == {"live": 0, "created": 2, "ended": 0, "expired": 2, "evicted": 0}
+
+def test_redis_size_cap_evicts_the_least_recently_used(server):
+    store = _store(server, max_sessions=2)
+    first, second = (store.create(SessionState(mode="ASK_SCENARIO")) for _ in range(2))
+    store.get(first)
+    store.create(SessionState(mode="ASK_SCENARIO"))
+
+    assert store.get(second) is None
+    assert store.get(first) is not None
+    assert store.stats()["evicted"] == 1
+
+def test_redis_calls_from_async_code_run_in_the_pool(server):
+    store = _store(server)
+
+    async def turn():
+        session_id = await store.acreate(SessionState(mode="ASK_SCENARIO"))
+        await store.aupdate(session_id, lambda state: state.add_message("istio"))
+        state = await store.aget(session_id)
+        await store.aend(session_id)
+        return state, await store.aget(session_id)
+
+    state, ended = asyncio.run(turn())
+    assert state.collected_messages == ("istio",)
+    assert ended is None
+
+def test_in_memory_get_returns_a_snapshot():
+    store = InMemorySessionStore()
+    session_id = store.create(SessionState(mode="ASK_SCENARIO"))
+
+    store.get(session_id).add_message("lost")
+    assert store.get(session_id).collected_messages == ()
+
+    store.update(session_id, lambda state: state.add_message("kept"))
+    assert store.get(session_id).collected_messages == ("kept",)
+
+def test_session_on_a_template_compiled_from_the_index_survives_other_workers(server, template):
+    fallback = template_registry.intern(compile_template("manifests/removed.yaml", "kind: ServiceEntry\nport: {{ $serverPort }}\n"))
+    store = _store(server)
+    session_id = store.create(SessionState(mode="MANIFEST", template=fallback))
+    registry_session_id = store.create(SessionState(mode="MANIFEST", template=template))
+
+    # Another worker or a restart: the interned template is not in its registry
+    del template_registry._by_hash[fallback.content_hash]
+
+    state = _store(server).get(session_id)
+    assert state.template.text == fallback.text
+    assert state.template.source == fallback.source
+    assert state.current_placeholder == "serverPort"
+    assert b"kind: ServiceEntry" not in _stored_raw(server, registry_session_id)
+
+def _stored_raw(server, session_id):
+    return fakeredis.FakeRedis(server=server).get(f"manifest-bot:session:{session_id}")